@@ -0,0 +1,438 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# A benchmark suite for every interpreter in the repository, from topic-01 to
+# topic-05 and lispy/lis.py.
+#
+#   python benchmark.py run --output before.json
+#   python benchmark.py run --output after.json --interpreters topic-05 --scale 2
+#   python benchmark.py compare before.json after.json
+#   python benchmark.py reader --sizes 10000 100000 400000
+#
+# Each workload is generated at several sizes and run through every
+# interpreter whose language can express it. Tokenizing, parsing and
+# evaluating are timed separately, each after `--warmup` untimed runs and for
+# `--repeat` timed runs, and then run once more under tracemalloc for its peak
+# memory. Printed output goes to os.devnull.
+#
+# Every interpreter runs in a subprocess of its own, because they all have
+# modules called tokenizer, parser and evaluator, and so one interpreter's
+# garbage does not count against the next. The results go to a JSON file with
+# the commit and machine they were measured on; `compare` lines two such files
+# up and reports the phases that got slower.
+
+root = os.path.dirname(os.path.abspath(__file__))
+
+# The languages, from least to most capable. "print" is printing arithmetic
+# on numbers, "assignment" adds variables and "while" adds loops.
+interpreters = {
+    "topic-01": ("topic-01-print", {"print"}),
+    "topic-02": ("topic-02-refactor-tokenizer", {"print"}),
+    "topic-03": ("topic-03-refactor-AST", {"print"}),
+    "topic-04": ("topic-04-assignment", {"print", "assignment"}),
+    "topic-05": ("topic-05-control structures", {"print", "assignment", "while"}),
+    "lispy": ("lispy", {"print", "assignment"}),
+}
+
+# Programs are generated as lists of statements,
+#
+#   ("print", expression)
+#   ("assign", name, expression)
+#   ("while", name, [statement, ...])     loop while the variable is not zero
+#
+# where an expression is a number, a variable name, or (operator, left, right),
+# and then written out in each interpreter's syntax.
+
+def chain(size):
+    "One print of `size` numbers joined by a repeating + - * /, with no parentheses."
+    expression = None
+    pending = None
+    term = 1
+    for i in range(1, size):
+        operator, number = "+-*/"[i % 4], i % 9 + 1
+        if operator in "*/":
+            term = (operator, term, number)
+        else:
+            expression = term if expression is None else (pending, expression, term)
+            pending, term = operator, number
+    expression = term if expression is None else (pending, expression, term)
+    return [("print", expression)]
+
+def nesting(size):
+    "One print of an expression nested `size` parentheses deep."
+    expression = 1
+    for i in range(size):
+        expression = ("+", i % 9 + 1, expression)
+    return [("print", expression)]
+
+def loop(size):
+    "A while loop that runs `size` times, with an accumulator."
+    return [
+        ("assign", "k", size),
+        ("assign", "s", 0),
+        ("while", "k", [
+            ("assign", "s", ("+", "s", ("*", "k", 2))),
+            ("assign", "k", ("-", "k", 1)),
+        ]),
+        ("print", "s"),
+    ]
+
+def assignments(size):
+    "`size` assignments to a hundred variables, each reading the one before."
+    statements = []
+    for i in range(size):
+        if i < 100:
+            expression = ("+", ("*", i, 2), 1)
+        else:
+            expression = ("+", f"v{(i - 1) % 100}", i % 9 + 1)
+        statements.append(("assign", f"v{i % 100}", expression))
+    statements.append(("print", f"v{(size - 1) % 100}"))
+    return statements
+
+# name -> (generator, features needed, default sizes)
+workloads = {
+    "chain": (chain, {"print"}, [1000, 10000]),
+    "nesting": (nesting, {"print"}, [100, 1000]),
+    "loop": (loop, {"while"}, [10000, 100000]),
+    "assignments": (assignments, {"assignment"}, [1000, 10000]),
+}
+
+precedence = {"+": 1, "-": 1, "*": 2, "/": 2}
+
+# Infix text for an expression, with only the parentheses it needs.
+def infix(expression, level=0, right=False):
+    if type(expression) is not tuple:
+        return str(expression)
+    operator, left, right_operand = expression
+    operator_level = precedence[operator]
+    text = f"{infix(left, operator_level)} {operator} {infix(right_operand, operator_level, True)}"
+    if operator_level < level or (right and operator_level == level):
+        return f"({text})"
+    return text
+
+def write_infix(statements):
+    lines = []
+    for statement in statements:
+        if statement[0] == "print":
+            lines.append(f"print {infix(statement[1])};")
+        elif statement[0] == "assign":
+            lines.append(f"{statement[1]} = {infix(statement[2])};")
+        else:
+            lines.append(f"while ({statement[1]}) {{ {write_infix(statement[2])} }}")
+    return "\n".join(lines)
+
+def prefix(expression):
+    if type(expression) is not tuple:
+        return str(expression)
+    operator, left, right = expression
+    return f"({operator} {prefix(left)} {prefix(right)})"
+
+def lisp_forms(statements):
+    forms = []
+    for statement in statements:
+        if statement[0] == "print":
+            forms.append(f"(print {prefix(statement[1])})")
+        elif statement[0] == "assign":
+            forms.append(f"(define {statement[1]} {prefix(statement[2])})")
+        else:
+            raise ValueError("lis.py has no loops")
+    return forms
+
+def write_lisp(statements):
+    return "(begin\n" + "\n".join(lisp_forms(statements)) + ")"
+
+# The tokenize, parse and evaluate functions of an interpreter, imported from
+# its directory, and a function returning a fresh environment for each run.
+def load(name):
+    directory = os.path.join(root, interpreters[name][0])
+    sys.path.insert(0, directory)
+    os.chdir(directory)
+    if name == "lispy":
+        import lis
+        return lis.tokenize, lis.read_from_tokens, lambda ast, env: lis.eval(ast, env), lis.standard_env
+    import tokenizer
+    import parser
+    import evaluator
+    try:
+        import closed_form
+    except ImportError:
+        pass
+    else:
+        # topic-05 would solve the loop workload without going round it,
+        # which the other interpreters cannot, so it goes round too
+        closed_form.enabled = False
+    def fresh_environment():
+        if hasattr(evaluator, "environment"):
+            evaluator.environment.clear()
+    return tokenizer.tokenize, parser.parse, lambda ast, env: evaluator.evaluate(ast), fresh_environment
+
+# Times, in seconds, and peak traced memory, in bytes, of function(argument()).
+# argument() is called outside the timing.
+def measure(function, argument, warmup, repeat):
+    times = []
+    for i in range(warmup + repeat):
+        value = argument()
+        start = time.perf_counter()
+        result = function(value)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+        del value, result
+    value = argument()
+    tracemalloc.start()
+    try:
+        function(value)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "best": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "times": times,
+        "peak_bytes": peak,
+    }
+
+def run_workload(functions, name, workload, size, warmup, repeat):
+    tokenize, parse, evaluate, fresh_environment = functions
+    statements = workloads[workload][0](size)
+    source = write_lisp(statements) if name == "lispy" else write_infix(statements)
+    result = {"interpreter": name, "workload": workload, "size": size,
+              "characters": len(source), "phases": {}}
+    phases = result["phases"]
+    try:
+        # tokenizers that print as they go print into os.devnull too
+        phases["tokenize"] = measure(tokenize, lambda: source, warmup, repeat)
+        tokens = tokenize(source)
+        result["tokens"] = len(tokens)
+        # lis.py's reader consumes its tokens, so every run parses a copy
+        phases["parse"] = measure(parse, lambda: list(tokens), warmup, repeat)
+        ast = parse(list(tokens))
+        phases["evaluate"] = measure(lambda env: evaluate(ast, env), fresh_environment,
+                                     warmup, repeat)
+    except (Exception, RecursionError) as e:
+        result["error"] = f"{type(e).__name__}: {e}"[:200]
+    return result
+
+# Run the workloads for one interpreter, in this process. Deep programs need
+# deep recursion in the older parsers and evaluators, so the work is done on
+# a thread with a large stack.
+def run_interpreter(name, jobs, warmup, repeat):
+    results = []
+    def work():
+        functions = load(name)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for workload, size in jobs:
+                results.append(run_workload(functions, name, workload, size, warmup, repeat))
+    sys.setrecursionlimit(200_000)
+    threading.stack_size(512 * 2**20)
+    worker = threading.Thread(target=work)
+    worker.start()
+    worker.join()
+    return results
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=root, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def jobs_for(name, args):
+    features = interpreters[name][1]
+    jobs = []
+    for workload in args.workloads:
+        _, needed, sizes = workloads[workload]
+        if needed <= features:
+            jobs.extend((workload, int(size * args.scale)) for size in sizes)
+    return jobs
+
+def run_suite(args):
+    report = {
+        "commit": commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "warmup": args.warmup,
+        "repeat": args.repeat,
+        "results": [],
+    }
+    for name in args.interpreters:
+        jobs = jobs_for(name, args)
+        if not jobs:
+            continue
+        with tempfile.NamedTemporaryFile("r", suffix=".json") as f:
+            command = [sys.executable, os.path.abspath(__file__), "worker", name, f.name,
+                       json.dumps(jobs), "--warmup", str(args.warmup), "--repeat", str(args.repeat)]
+            completed = subprocess.run(command)
+            if completed.returncode != 0:
+                results = [{"interpreter": name, "workload": workload, "size": size, "phases": {},
+                            "error": f"worker exited with status {completed.returncode}"}
+                           for workload, size in jobs]
+            else:
+                results = json.load(f)
+        for result in results:
+            print_result(result)
+        report["results"].extend(results)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"wrote {args.output}")
+
+def print_result(result):
+    label = f"{result['interpreter']:9} {result['workload']:12} {result['size']:>8}"
+    if "error" in result and not result["phases"]:
+        print(f"{label}  {result['error']}")
+        return
+    columns = [f"{phase} {measured['best']:9.4f}s {measured['peak_bytes'] / 2**20:8.2f} MiB"
+               for phase, measured in result["phases"].items()]
+    if "error" in result:
+        columns.append(result["error"])
+    print(f"{label}  " + "  ".join(columns))
+
+# Line two reports up by interpreter, workload, size and phase, and compare
+# their best times. Returns the regressions: the phases that got slower by
+# more than `threshold`, as a fraction.
+def compare_reports(old, new, threshold):
+    def phases(report):
+        return {(result["interpreter"], result["workload"], result["size"], phase): measured
+                for result in report["results"]
+                for phase, measured in result["phases"].items()}
+    before, after = phases(old), phases(new)
+    rows = []
+    for key in before:
+        if key in after:
+            ratio = after[key]["best"] / before[key]["best"]
+            rows.append((key, before[key]["best"], after[key]["best"], ratio))
+    return rows, [row for row in rows if row[3] > 1 + threshold]
+
+def compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"old {old['commit']}  new {new['commit']}")
+    rows, regressions = compare_reports(old, new, args.threshold)
+    for (name, workload, size, phase), before, after, ratio in rows:
+        mark = "  slower" if ratio > 1 + args.threshold else "  faster" if ratio < 1 - args.threshold else ""
+        print(f"{name:9} {workload:12} {size:>8} {phase:9} {before:9.4f}s {after:9.4f}s "
+              f"{ratio:6.2f}x{mark}")
+    print(f"{len(regressions)} of {len(rows)} phases slower by more than {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+# How lis.py's reader scales: the time to tokenize and read programs of more
+# and more top-level forms, and of deeper and deeper nesting. The time per
+# token stays flat when reading takes linear time.
+def reader(args):
+    sys.path.insert(0, os.path.join(root, interpreters["lispy"][0]))
+    import lis
+    programs = [("forms", size, "\n".join(lisp_forms(assignments(size)))) for size in args.sizes]
+    programs += [("depth", depth, "(" * depth + "1" + ")" * depth) for depth in args.depths]
+    for label, size, source in programs:
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            forms = lis.parse_all(source)
+            times.append(time.perf_counter() - start)
+        tokens = len(lis.tokenize(source))
+        print(f"reader {label:5} {size:>9} {len(source) / 2**20:8.2f} MiB {tokens:>10} tokens "
+              f"{len(forms):>9} forms {min(times):8.3f}s {min(times) / tokens * 1e9:7.1f} ns/token")
+        del forms
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Benchmark every interpreter in the repository.")
+    commands = argument_parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the suite and write the results as JSON")
+    run.add_argument("--output", default="benchmark-results.json")
+    run.add_argument("--interpreters", nargs="+", choices=list(interpreters), default=list(interpreters))
+    run.add_argument("--workloads", nargs="+", choices=list(workloads), default=list(workloads))
+    run.add_argument("--scale", type=float, default=1.0,
+        help="multiply every workload size by this")
+    run.add_argument("--warmup", type=int, default=1)
+    run.add_argument("--repeat", type=int, default=5)
+    compare_command = commands.add_parser("compare",
+        help="compare two result files; exits with status 1 if anything got slower")
+    compare_command.add_argument("old")
+    compare_command.add_argument("new")
+    compare_command.add_argument("--threshold", type=float, default=0.1,
+        help="slowdown to report, as a fraction (default: 0.1)")
+    reader_command = commands.add_parser("reader",
+        help="time lis.py's reader on growing programs, to check it scales linearly")
+    reader_command.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 400_000],
+        help="top-level forms per program")
+    reader_command.add_argument("--depths", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+        help="nesting depths")
+    reader_command.add_argument("--repeat", type=int, default=3)
+    worker = commands.add_parser("worker", help=argparse.SUPPRESS)
+    worker.add_argument("interpreter")
+    worker.add_argument("result")
+    worker.add_argument("jobs")
+    worker.add_argument("--warmup", type=int, default=1)
+    worker.add_argument("--repeat", type=int, default=5)
+    args = argument_parser.parse_args()
+    if args.command == "run":
+        run_suite(args)
+    elif args.command == "compare":
+        sys.exit(compare(args))
+    elif args.command == "reader":
+        reader(args)
+    else:
+        results = run_interpreter(args.interpreter, json.loads(args.jobs), args.warmup, args.repeat)
+        with open(args.result, "w") as f:
+            json.dump(results, f)
+
+def test_written_programs():
+    print("testing generated programs")
+    assert write_infix(chain(6)) == "print 1 - 2 * 3 / 4 + 5 - 6;"
+    assert write_lisp(chain(4)) == "(begin\n(print (- 1 (/ (* 2 3) 4))))"
+    assert write_infix(nesting(2)) == "print 2 + (1 + 1);"
+    assert write_lisp(nesting(2)) == "(begin\n(print (+ 2 (+ 1 1))))"
+    assert write_infix(loop(3)) == ("k = 3;\ns = 0;\nwhile (k) { s = s + k * 2;\nk = k - 1; }\nprint s;")
+    assert write_lisp(assignments(2)) == "(begin\n(define v0 (+ (* 0 2) 1))\n(define v1 (+ (* 1 2) 1))\n(print v1))"
+
+def test_suite_runs():
+    print("testing a small run of the suite")
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "results.json")
+        subprocess.run([sys.executable, os.path.abspath(__file__), "run", "--output", output,
+                        "--scale", "0.01", "--warmup", "0", "--repeat", "1"],
+                       check=True, capture_output=True)
+        with open(output) as f:
+            report = json.load(f)
+    done = {(result["interpreter"], result["workload"]) for result in report["results"]
+            if "error" not in result}
+    assert len(done) == 6 * 2 + 3 + 1, report["results"]
+    for result in report["results"]:
+        assert set(result["phases"]) == {"tokenize", "parse", "evaluate"}
+    rows, regressions = compare_reports(report, report, 0.1)
+    assert len(rows) == 3 * len(report["results"]) and regressions == []
+
+def test_loops_go_round():
+    print("testing loop times grow with the number of iterations")
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "results.json")
+        subprocess.run([sys.executable, os.path.abspath(__file__), "run", "--output", output,
+                        "--interpreters", "topic-05", "--workloads", "loop",
+                        "--scale", "0.1", "--warmup", "0", "--repeat", "1"],
+                       check=True, capture_output=True)
+        with open(output) as f:
+            report = json.load(f)
+    small, large = sorted(report["results"], key=lambda result: result["size"])
+    assert large["size"] == 10 * small["size"]
+    # solved in closed form, both would take about as long
+    ratio = large["phases"]["evaluate"]["best"] / small["phases"]["evaluate"]["best"]
+    assert ratio > 5, ratio
+
+if __name__ == "__main__":
+    main()
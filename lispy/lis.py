@@ -1,9 +1,16 @@
 import math
 import operator as op
+import re
+from itertools import chain
+from typing import Iterable, Iterator
+
+# A token is a parenthesis or a run of characters that are neither
+# parentheses nor whitespace.
+token_pattern = re.compile(r'[()]|[^\s()]+')
 
 def tokenize(chars: str) -> list:
     "Convert a string of characters into a list of tokens."
-    return chars.replace('(', ' ( ').replace(')', ' ) ').split()
+    return token_pattern.findall(chars)
 
 Symbol = str              # A Scheme Symbol is implemented as a Python str
 Number = (int, float)     # A Scheme Number is implemented as a Python int or float
@@ -15,23 +22,52 @@ Exp    = (Atom, List)     # A Scheme expression is an Atom or List
 
 def parse(program: str) -> Exp:
     "Read a Scheme expression from a string."
-    return read_from_tokens(tokenize(program))
+    return read_form(iter(tokenize(program)))
+
+def parse_all(program: str) -> list:
+    "Read every Scheme expression in a string, in order."
+    return list(read_forms(tokenize(program)))
+
+class Atoms(dict):
+    "The atom for each token read so far, so that atom() sees each distinct token once."
+    def __missing__(self, token):
+        exp = self[token] = atom(token)
+        return exp
+
+def read_form(tokens: Iterator[str], atoms: Atoms = None) -> Exp:
+    "Read an expression from an iterator of tokens, taking only its own tokens."
+    if atoms is None:
+        atoms = Atoms()
+    # The lists still open, innermost last, so deep nesting needs no recursion
+    stack = []
+    for token in tokens:
+        if token == '(':
+            stack.append([])
+            continue
+        if token == ')':
+            if not stack:
+                raise SyntaxError('unexpected )')
+            exp = stack.pop()
+        else:
+            exp = atoms[token]
+        if not stack:
+            return exp
+        stack[-1].append(exp)
+    raise SyntaxError('unexpected EOF')
+
+def read_forms(tokens: Iterable[str]) -> Iterator:
+    "Read expressions one after another from tokens, until they run out."
+    tokens = iter(tokens)
+    atoms = Atoms()
+    for token in tokens:
+        yield read_form(chain((token,), tokens), atoms)
 
 def read_from_tokens(tokens: list) -> Exp:
-    "Read an expression from a sequence of tokens."
-    if len(tokens) == 0:
-        raise SyntaxError('unexpected EOF')
-    token = tokens.pop(0)
-    if token == '(':
-        L = []
-        while tokens[0] != ')':
-            L.append(read_from_tokens(tokens))
-        tokens.pop(0) # pop off ')'
-        return L
-    elif token == ')':
-        raise SyntaxError('unexpected )')
-    else:
-        return atom(token)
+    "Read an expression from a list of tokens, removing its tokens from the list."
+    remaining = iter(tokens)
+    exp = read_form(remaining)
+    del tokens[:len(tokens) - op.length_hint(remaining)]
+    return exp
 
 def atom(token: str) -> Atom:
     "Numbers become numbers; every other token is a symbol."
@@ -129,9 +165,10 @@ class Procedure(object):
 def repl(prompt='lis.py> '):
     "A prompt-read-eval-print loop."
     while True:
-        val = eval(parse(input(prompt)))
-        if val is not None: 
-            print(schemestr(val))
+        for exp in parse_all(input(prompt)):
+            val = eval(exp)
+            if val is not None:
+                print(schemestr(val))
 
 def test_tokenize():
     program = "(begin (define r 10) (* pi (* r r)))"
@@ -141,6 +178,33 @@ def test_parse():
     program = "(begin (define r 10) (* pi (* r r)))"
     assert parse(program) == ['begin', ['define', 'r', 10], ['*', 'pi', ['*', 'r', 'r']]]
 
+def test_parse_all():
+    program = "(define r 10)\n(* pi (* r r)) r\n(quote ())"
+    assert parse_all(program) == [['define', 'r', 10], ['*', 'pi', ['*', 'r', 'r']], 'r', ['quote', []]]
+    assert parse_all("  ") == []
+
+def test_syntax_errors():
+    for read, program in [(parse, ""), (parse, "(+ 1 2"), (parse, ")"), (parse_all, "(+ 1 2))")]:
+        try:
+            read(program)
+        except SyntaxError:
+            pass
+        else:
+            assert False, f"Expected SyntaxError for {program!r}"
+
+def test_read_from_tokens():
+    tokens = tokenize("(+ 1 (* 2 3)) 4 (x)")
+    assert read_from_tokens(tokens) == ['+', 1, ['*', 2, 3]]
+    assert tokens == ['4', '(', 'x', ')']
+    assert read_from_tokens(tokens) == 4 and read_from_tokens(tokens) == ['x'] and tokens == []
+
+def test_deep_nesting():
+    depth = 100000
+    exp = parse("(" * depth + "1" + ")" * depth)
+    for _ in range(depth):
+        (exp,) = exp
+    assert exp == 1
+
 def test_global_env():
     assert global_env["+"] == op.add
     assert global_env["sin"] == math.sin
@@ -157,6 +221,10 @@ def test_schemestr():
 if __name__ == "__main__":
     test_tokenize()
     test_parse()
+    test_parse_all()
+    test_syntax_errors()
+    test_read_from_tokens()
+    test_deep_nesting()
     test_global_env()
     test_eval()
     test_schemestr()
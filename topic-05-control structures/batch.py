@@ -0,0 +1,293 @@
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from evaluator import comparisons
+
+# Batch evaluation: run one program over many rows of input at once, instead
+# of calling evaluate() once per row with its own environment.
+#
+# The input is column-oriented, a dict from variable name to an array with
+# one value per row (or a single number for every row). Every variable is
+# held as a NumPy array with one element per row, so each arithmetic node is
+# one vectorized operation over all the rows. Rows can take different paths
+# through if and while: each statement runs under a mask of the rows that
+# reach it. An if runs its then branch for the rows whose condition is true
+# and its else branch for the rest, skipping a branch no row takes; a while
+# keeps going round while any row's condition is true, with the rows that
+# are done masked off. Assignments only change the rows in the mask. && and
+# || run their right operand only for the rows their left one leaves open.
+#
+# Values are float64. Beside each value goes whether it is an int in that
+# row, following the evaluator's types: int literals are ints, +, - and * of
+# two ints give an int, / gives a float, and comparisons, &&, || and ! give
+# the int 1 or 0. row() turns each value back into an int or a float, so
+# every row gets the environment, printed values and result that evaluate()
+# would give it, exactly so while its ints stay below 2**53, past which the
+# evaluator's ints are exact and float64 is not. The errors are the same too:
+# reading a variable that a running row has not assigned raises KeyError,
+# and dividing by zero in a running row raises the ZeroDivisionError that
+# evaluate() raises for that row, for the whole batch. Inputs become floats.
+#
+# NumPy is optional; without it, evaluate_batch() raises ImportError.
+
+class BatchResult:
+    def __init__(self, rows, environment, defined, ints, result, has_result, result_ints, printed):
+        self.rows = rows
+        # name -> array of values, name -> mask of the rows that have one,
+        # and name -> mask of the rows where it is an int
+        self.environment = environment
+        self.defined = defined
+        self.ints = ints
+        # the value of the program for each row, where has_result is set
+        self.result = result
+        self.has_result = has_result
+        self.result_ints = result_ints
+        # (mask, values, ints) for every print statement run, in order
+        self.printed = printed
+
+    # The environment, printed values and result row i would have got from
+    # evaluate().
+    def row(self, i):
+        environment = {name: number(values[i], self.ints[name][i])
+                       for name, values in self.environment.items() if self.defined[name][i]}
+        printed = [number(values[i], ints[i]) for mask, values, ints in self.printed if mask[i]]
+        result = number(self.result[i], self.result_ints[i]) if self.has_result[i] else None
+        return environment, printed, result
+
+def number(value, is_int):
+    return int(value) if is_int else float(value)
+
+class BatchEvaluator:
+    def __init__(self, bindings, rows=None):
+        if numpy is None:
+            raise ImportError("batch evaluation needs NumPy")
+        columns = {name: numpy.asarray(values, dtype=numpy.float64)
+                   for name, values in bindings.items()}
+        if rows is None:
+            lengths = {len(values) for values in columns.values() if values.ndim}
+            if len(lengths) != 1:
+                raise ValueError("Expected bindings of one length, or rows")
+            rows = lengths.pop()
+        self.rows = rows
+        self.environment = {name: numpy.broadcast_to(values, (rows,)).copy()
+                            for name, values in columns.items()}
+        self.defined = {name: numpy.ones(rows, dtype=bool) for name in columns}
+        self.ints = {name: numpy.zeros(rows, dtype=bool) for name in columns}
+        self.printed = []
+
+    def run(self, ast):
+        mask = numpy.ones(self.rows, dtype=bool)
+        with numpy.errstate(all="ignore"):
+            result, has_result, result_ints = self.execute(ast, mask)
+        return BatchResult(self.rows, self.environment, self.defined, self.ints,
+                           self.full(result), self.full(has_result) & mask,
+                           self.full(result_ints), self.printed)
+
+    def full(self, values):
+        return numpy.broadcast_to(values, (self.rows,)).copy()
+
+    # Run a statement for the rows in mask. Returns its value, a mask of the
+    # rows where it has one and a mask of the rows where it is an int;
+    # outside mask, all three are meaningless.
+    def execute(self, node, mask):
+        t = node["type"] if type(node) is dict else None
+
+        if t == "program" or t == "block":
+            value, has_value, is_int = numpy.nan, False, False
+            for statement in node["statements"]:
+                value, has_value, is_int = self.execute(statement, mask)
+            return value, has_value, is_int
+
+        if t == "assignment":
+            name = node["name"]
+            value, is_int = self.evaluate(node["expression"], mask)
+            if name in self.environment:
+                numpy.copyto(self.environment[name], value, where=mask)
+                numpy.copyto(self.ints[name], is_int, where=mask)
+                self.defined[name] |= mask
+            else:
+                self.environment[name] = numpy.where(mask, value, numpy.nan)
+                self.ints[name] = self.full(is_int)
+                self.defined[name] = mask.copy()
+            return value, True, is_int
+
+        if t == "print":
+            value, is_int = self.evaluate(node["expression"], mask)
+            self.printed.append((mask.copy(), self.full(value), self.full(is_int)))
+            return value, True, is_int
+
+        if t == "if":
+            taken = self.evaluate(node["condition"], mask)[0] != 0
+            then_mask = mask & taken
+            else_mask = mask & ~then_mask
+            value, has_value, is_int = numpy.nan, False, False
+            if then_mask.any():
+                value, has_value, is_int = self.execute(node["then"], then_mask)
+            if node["else"] and else_mask.any():
+                else_value, else_has_value, else_is_int = self.execute(node["else"], else_mask)
+                value = numpy.where(then_mask, value, else_value)
+                has_value = numpy.where(then_mask, has_value, else_has_value)
+                is_int = numpy.where(then_mask, is_int, else_is_int)
+            else:
+                has_value = then_mask & has_value
+            return value, has_value, is_int
+
+        if t == "while":
+            value = numpy.full(self.rows, numpy.nan)
+            has_value = numpy.zeros(self.rows, dtype=bool)
+            is_int = numpy.zeros(self.rows, dtype=bool)
+            active = mask & (self.evaluate(node["condition"], mask)[0] != 0)
+            while active.any():
+                body_value, body_has_value, body_is_int = self.execute(node["do"], active)
+                numpy.copyto(value, body_value, where=active)
+                numpy.copyto(has_value, body_has_value, where=active)
+                numpy.copyto(is_int, body_is_int, where=active)
+                active &= self.evaluate(node["condition"], active)[0] != 0
+            return value, has_value, is_int
+
+        # a bare expression as a statement
+        value, is_int = self.evaluate(node, mask)
+        return value, True, is_int
+
+    # The value of an expression for the rows in mask and whether it is an
+    # int: each an array, or a single value for every row.
+    def evaluate(self, node, mask):
+        if type(node) is not dict:
+            return node, type(node) is int
+        t = node["type"]
+        if t == "identifier":
+            name = node["name"]
+            defined = self.defined.get(name)
+            # mask > defined: a running row where the variable has no value
+            if defined is None or (mask > defined).any():
+                raise KeyError(name)
+            return self.environment[name], self.ints[name]
+        if t == "binary":
+            left, left_int = self.evaluate(node["left"], mask)
+            right, right_int = self.evaluate(node["right"], mask)
+            operator = node["operator"]
+            if operator == "+":
+                return left + right, left_int & right_int
+            if operator == "-":
+                return left - right, left_int & right_int
+            if operator == "*":
+                return left * right, left_int & right_int
+            if operator == "/":
+                zero = mask & (numpy.asarray(right) == 0)
+                if zero.any():
+                    # divide in Python for the first such row, to raise
+                    # evaluate()'s error
+                    i = zero.argmax()
+                    self.number(left, left_int, i) / self.number(right, right_int, i)
+                return left / right, False
+            if operator in comparisons:
+                return numpy.asarray(comparisons[operator](left, right), dtype=numpy.float64), True
+        if t == "logical":
+            truth = numpy.broadcast_to(self.evaluate(node["left"], mask)[0] != 0, (self.rows,))
+            if node["operator"] == "&&":
+                undecided = mask & truth
+            else:
+                undecided = mask & ~truth
+            if undecided.any():
+                truth = numpy.where(undecided, self.evaluate(node["right"], undecided)[0] != 0, truth)
+            return truth.astype(numpy.float64), True
+        if t == "unary" and node["operator"] == "-":
+            value, is_int = self.evaluate(node["expression"], mask)
+            return -value, is_int
+        if t == "unary" and node["operator"] == "!":
+            value = self.evaluate(node["expression"], mask)[0]
+            return numpy.asarray(value == 0, dtype=numpy.float64), True
+        raise Exception(f"Unknown content in AST={node}")
+
+    # Row i of an expression's value, as evaluate() would have it.
+    def number(self, values, ints, i):
+        return number(numpy.broadcast_to(values, (self.rows,))[i],
+                      numpy.broadcast_to(ints, (self.rows,))[i])
+
+# Run ast once for every row of bindings, a dict from variable name to the
+# column of that variable's starting values. rows is only needed when no
+# binding is an array.
+def evaluate_batch(ast, bindings, rows=None):
+    return BatchEvaluator(bindings, rows).run(ast)
+
+from tokenizer import scan
+from parser import parse
+from evaluator import Evaluator
+from output import ListOutput
+
+# What evaluate() gives each row, for comparison.
+def evaluate_rows(ast, bindings, rows):
+    results = []
+    for i in range(rows):
+        environment = {name: float(values[i]) for name, values in bindings.items()}
+        sink = ListOutput()
+        result = Evaluator(environment, sink).evaluate(ast)
+        results.append((environment, sink.values, result))
+    return results
+
+# Each number in a row, with its type, so that 0 and 0.0 differ.
+def typed(row):
+    environment, printed, result = row
+    return ({name: (type(value), value) for name, value in environment.items()},
+            [(type(value), value) for value in printed], (type(result), result))
+
+def check_batch(source, bindings, rows):
+    ast = parse(scan(source))
+    batch = evaluate_batch(ast, bindings, rows)
+    expected = evaluate_rows(ast, bindings, rows)
+    for i in range(rows):
+        assert typed(batch.row(i)) == typed(expected[i]), (i, batch.row(i), expected[i])
+
+def test_batch_matches_evaluate():
+    print("testing batch evaluation matches evaluate()")
+    if numpy is None:
+        print("skipped: NumPy is not installed")
+        return
+    rng = numpy.random.default_rng(5)
+    n = numpy.arange(40) % 7
+    x = rng.normal(size=40)
+    check_batch("k = n; s = 0; while (k) { s = s + k * x; k = k - 1; }\n"
+                "if (s) y = s / 2; else { y = 0; print n; }",
+                {"n": n, "x": x}, 40)
+    # a variable assigned on only some of the paths
+    check_batch("if (n) z = 1 / n; print -x * 3 + 1;", {"n": n, "x": x}, 40)
+    # ints stay ints, and a variable can be an int in some rows only
+    check_batch("i = 0; while (i < n) i = i + 1; if (n > 3) j = i; else j = 2.5; print i * 2 - 1;",
+                {"n": n}, 40)
+    # a while in some rows only, and the last statement's value
+    check_batch("r = x; if (n) while (n) { n = n - 1; r = r * 2; }", {"n": n, "x": x}, 40)
+    # comparisons and logical operators
+    check_batch("i = 0; s = 0; while (i < n) { if (x > 0 && i != 2 || !n) s = s + i; i = i + 1; }"
+                "print s >= 3; print n == 3 || 1 / (n - 3) > 0;", {"n": n, "x": x}, 40)
+    with open("example.t") as f:
+        check_batch(f.read(), {}, 3)
+
+def test_batch_errors():
+    print("testing batch evaluation errors")
+    if numpy is None:
+        print("skipped: NumPy is not installed")
+        return
+    n = numpy.array([0.0, 1.0, 2.0])
+    # rows that do not run the division cannot fail it
+    check_batch("if (n) y = 1 / n;", {"n": n}, 3)
+    for source, error in [("y = 1 / n;", ZeroDivisionError),
+                          ("k = 0; if (n) y = 1 / k;", ZeroDivisionError),
+                          ("if (n) z = 1; print z;", KeyError)]:
+        ast = parse(scan(source))
+        try:
+            evaluate_batch(ast, {"n": n})
+        except error as e:
+            # the same error as evaluate() gives the first row to fail
+            try:
+                evaluate_rows(ast, {"n": n}, 3)
+            except error as expected:
+                assert str(e) == str(expected), (e, expected)
+        else:
+            assert False, f"Expected {error.__name__}"
+
+if __name__ == "__main__":
+    test_batch_matches_evaluate()
+    test_batch_errors()
+    print("done")
@@ -0,0 +1,672 @@
+import argparse
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import tokenizer
+import token_table
+import parser
+import evaluator
+import closures
+import bytecode
+import slots
+import output
+import optimizer
+import transpiler
+import cache
+import incremental
+import session
+import interpreter
+import budget
+import batch
+import closed_form
+import inference
+import quickening
+
+# Benchmarks for the topic-05 interpreter.
+#
+#   python benchmark.py tokenize --sizes 1000000 2000000 4000000
+#   python benchmark.py memory
+#   python benchmark.py tokens
+#   python benchmark.py loops --iterations 1000000 3000000
+#   python benchmark.py variables --iterations 1000000
+#   python benchmark.py output --iterations 1000000
+#   python benchmark.py optimize --iterations 1000000
+#   python benchmark.py nesting --depths 100 10000 100000
+#   python benchmark.py cache --sizes 100000 1000000
+#   python benchmark.py incremental --lines 100000 --edits 100
+#   python benchmark.py repl --lines 10000 100000
+#   python benchmark.py concurrency --programs 64 --iterations 20000 --workers 4
+#   python benchmark.py budget --iterations 1000000
+#   python benchmark.py batch --rows 100 1000 10000 100000
+#   python benchmark.py closed-form --iterations 1000 1000000 1000000000 1000000000000
+#   python benchmark.py types --iterations 1000000
+#   python benchmark.py conditions --iterations 1000000
+#   python benchmark.py quickening --iterations 1000000
+#
+# Each benchmark prints one line per measurement so results are easy to
+# compare between runs.
+
+# A generated program made of about `size` characters of ordinary statements.
+# Every variable is assigned before it is read and every loop terminates, so
+# the same workload can be tokenized, parsed and evaluated.
+def generate_program(size):
+    chunks = []
+    length = 0
+    i = 0
+    while length < size:
+        name = f"v{i % 1000}"
+        chunk = (
+            f"{name} = {i} + {i % 7} * ({i % 13} - 2.5) / 4;\n"
+            f"print {name} - 1;\n"
+            f"if ({name}) {{ w = {name} * 2; }} else w = 0;\n"
+            f"k = 3;\n"
+            f"while (k) {{ k = k - 1; }}\n"
+        )
+        chunks.append(chunk)
+        length += len(chunk)
+        i += 1
+    return "".join(chunks)
+
+# The while (k) countdown from example.t, with an accumulator, run for
+# `iterations` iterations.
+def generate_loop(iterations):
+    return (f"k = {iterations}; s = 0;\n"
+            f"while (k) {{\n"
+            f"    s = s + k * 2;\n"
+            f"    k = k - 1;\n"
+            f"}}\n"
+            f"print s;\n")
+
+# generate_loop() over floats.
+def generate_float_loop(iterations):
+    return (f"k = {iterations}; s = 0.5;\n"
+            f"while (k) {{\n"
+            f"    s = s + k * 2.5;\n"
+            f"    k = k - 1;\n"
+            f"}}\n"
+            f"print s;\n")
+
+# A loop counting up to n, with the given while condition.
+def generate_compare_loop(iterations, condition="i < n"):
+    return (f"i = 0; n = {iterations}; s = 0;\n"
+            f"while ({condition}) {{\n"
+            f"    s = s + i;\n"
+            f"    i = i + 1;\n"
+            f"}}\n"
+            f"print s;\n")
+
+# A loop over a variable v that switches between the int 1 and the float 0.5
+# every `period` iterations.
+def generate_mixed_loop(iterations, period):
+    return (f"i = 0; n = {iterations}; c = 0; v = 1; s = 0;\n"
+            f"while (i < n) {{\n"
+            f"    if (c == {period}) {{ c = 0; if (v == 1) v = 0.5; else v = 1; }}\n"
+            f"    s = s + v * i;\n"
+            f"    c = c + 1;\n"
+            f"    i = i + 1;\n"
+            f"}}\n"
+            f"print s;\n")
+
+# A loop that reads and writes several variables on every iteration.
+def generate_variable_loop(iterations):
+    return (f"k = {iterations}; a = 1; b = 2; d = 0;\n"
+            f"while (k) {{\n"
+            f"    t = a; a = b; b = t;\n"
+            f"    d = d + a - b + t * k;\n"
+            f"    k = k - 1;\n"
+            f"}}\n"
+            f"print d;\n")
+
+# A loop that prints one line per iteration.
+def generate_print_loop(iterations):
+    return (f"k = {iterations};\n"
+            f"while (k) {{\n"
+            f"    print k;\n"
+            f"    k = k - 1;\n"
+            f"}}\n")
+
+# A loop full of constant subexpressions and identities, as a code generator
+# might write it.
+def generate_constant_loop(iterations):
+    return (f"k = {iterations}; s = 0;\n"
+            f"while (k) {{\n"
+            f"    s = s + (2 * 3 - 4 / 2) * k * 1 - -(-(k - 0));\n"
+            f"    k = k - (0 + 1);\n"
+            f"    if (0) print s;\n"
+            f"}}\n"
+            f"print s;\n")
+
+# Deeply nested programs of each shape, `depth` levels deep.
+nested_programs = {
+    "parens": lambda depth: "print " + "(" * depth + "1" + ")" * depth + ";",
+    "unary": lambda depth: "print " + "-" * depth + "1;",
+    "blocks": lambda depth: "{" * depth + "print 1;" + "}" * depth,
+    "ifs": lambda depth: "if (1) " * depth + "print 1;",
+    "mixed": lambda depth: "x = " + "(1 + -(2 * " * depth + "x" + "))" * depth + ";",
+}
+
+# Best of `repeat` runs, in seconds, together with the last result.
+def best_time(function, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def benchmark_tokenize(args):
+    engines = [("scan", tokenizer.scan)]
+    if not args.skip_reference:
+        engines.append(("scan_each_pattern", tokenizer.scan_each_pattern))
+    for size in args.sizes:
+        source = generate_program(size)
+        for name, engine in engines:
+            elapsed, tokens = best_time(engine, source, repeat=args.repeat)
+            print(f"tokenize {name:18} {len(source):>10} chars "
+                  f"{len(tokens):>9} tokens {elapsed:8.3f}s "
+                  f"{len(tokens) / elapsed:>12,.0f} tokens/s")
+
+# Peak traced memory, in bytes, while running function(*args).
+def peak_memory(function, *args):
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def front_end_whole_file(filename):
+    with open(filename) as f:
+        source = f.read()
+    parser.parse(tokenizer.scan(source))
+
+def front_end_stream(filename, chunk_size):
+    with open(filename) as f:
+        for statement in parser.parse_statements(tokenizer.scan_stream(f, chunk_size)):
+            pass
+
+def benchmark_memory(args):
+    for size in args.sizes:
+        with tempfile.NamedTemporaryFile("w", suffix=".t", delete=False) as f:
+            f.write(generate_program(size))
+        try:
+            whole = peak_memory(front_end_whole_file, f.name)
+            stream = peak_memory(front_end_stream, f.name, args.chunk_size)
+        finally:
+            os.remove(f.name)
+        print(f"memory {size:>10} chars  whole file {whole / 2**20:9.2f} MiB  "
+              f"stream {stream / 2**20:9.2f} MiB")
+
+# Memory held by the tokens of each layout, and parse throughput from each.
+def benchmark_tokens(args):
+    layouts = [("list", tokenizer.scan), ("table", token_table.scan_table)]
+    for size in args.sizes:
+        source = generate_program(size)
+        for name, scan in layouts:
+            tracemalloc.start()
+            tokens = scan(source)
+            held = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            elapsed, ast = best_time(parser.parse, tokens, repeat=args.repeat)
+            print(f"tokens {name:5} {len(source):>10} chars {len(tokens):>9} tokens "
+                  f"{held / len(tokens):6.1f} bytes/token  parse "
+                  f"{len(tokens) / elapsed:>12,.0f} tokens/s")
+            del tokens, ast
+
+# Turn closed-form execution off, for benchmarks that time loops going round:
+# evaluate() and the closure backend would solve their counting loops in one
+# step.
+@contextlib.contextmanager
+def every_iteration():
+    closed_form.enabled = False
+    try:
+        yield
+    finally:
+        closed_form.enabled = True
+
+# Run an evaluator with its output thrown away, starting from an empty
+# environment.
+def run_quietly(run, ast):
+    evaluator.environment.clear()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return run(ast)
+
+def benchmark_loops(args):
+    engines = [
+        ("evaluate", evaluator.evaluate),
+        ("closures", closures.evaluate_compiled),
+        ("bytecode", bytecode.evaluate_bytecode),
+        ("python", transpiler.evaluate_transpiled),
+    ]
+    with every_iteration():
+        compare_engines("loops", engines, generate_loop, args)
+
+# Compare engines running the program made by generate for each iteration
+# count.
+def compare_engines(label, engines, generate, args):
+    for iterations in args.iterations:
+        ast = parser.parse(tokenizer.scan(generate(iterations)))
+        baseline = None
+        for name, run in engines:
+            elapsed, result = best_time(run_quietly, run, ast, repeat=args.repeat)
+            baseline = baseline or elapsed
+            print(f"{label} {name:10} {iterations:>12,} iterations {elapsed:8.3f}s "
+                  f"{iterations / elapsed:>12,.0f} iterations/s "
+                  f"{baseline / elapsed:6.2f}x")
+
+def benchmark_variables(args):
+    engines = [
+        ("evaluate", evaluator.evaluate),
+        ("slots", slots.evaluate_with_slots),
+        ("python", transpiler.evaluate_transpiled),
+    ]
+    with every_iteration():
+        compare_engines("variables", engines, generate_variable_loop, args)
+
+# Print throughput of each output sink, through the closure backend so the
+# interpreter itself takes as little of the time as possible. stdout goes to
+# the null device.
+def benchmark_output(args):
+    sinks = [
+        ("stdout", output.StandardOutput),
+        ("buffered", output.BufferedOutput),
+        ("null", output.NullOutput),
+    ]
+    def run_with_sink(sink, ast):
+        evaluator.set_output(sink)
+        try:
+            closures.evaluate_compiled(ast)
+            sink.flush()
+        finally:
+            evaluator.set_output(output.StandardOutput())
+    for iterations in args.iterations:
+        ast = parser.parse(tokenizer.scan(generate_print_loop(iterations)))
+        for name, sink in sinks:
+            with every_iteration():
+                elapsed, result = best_time(
+                    lambda: run_quietly(lambda ast: run_with_sink(sink(), ast), ast),
+                    repeat=args.repeat)
+            print(f"output {name:10} {iterations:>12,} lines {elapsed:8.3f}s "
+                  f"{iterations / elapsed:>12,.0f} lines/s")
+
+def benchmark_optimize(args):
+    engines = [
+        (f"-O{level}", lambda ast, level=level: evaluator.evaluate(optimizer.optimize(ast, level)))
+        for level in [0, 1, 2]
+    ]
+    with every_iteration():
+        compare_engines("optimize", engines, generate_constant_loop, args)
+
+def benchmark_nesting(args):
+    for shape, generate in nested_programs.items():
+        for depth in args.depths:
+            table = token_table.scan_table(generate(depth))
+            for name, iterative in [("recursive", False), ("iterative", True)]:
+                try:
+                    elapsed, ast = best_time(parser.parse, table, iterative, repeat=args.repeat)
+                except RecursionError:
+                    print(f"nesting {shape:6} {name:9} depth {depth:>8,}  RecursionError")
+                    continue
+                print(f"nesting {shape:6} {name:9} depth {depth:>8,} {elapsed:8.4f}s "
+                      f"{len(table) / elapsed:>12,.0f} tokens/s")
+
+# Time from start until the first statement has run: load the program
+# (tokenize and parse, or read the cache) and run its first statement.
+def first_statement_latency(filename, use_cache):
+    start = time.perf_counter()
+    ast = cache.load_program(filename, use_cache=use_cache)
+    evaluator.set_output(output.NullOutput())
+    try:
+        evaluator.evaluate(ast["statements"][0])
+    finally:
+        evaluator.set_output(output.StandardOutput())
+    return time.perf_counter() - start
+
+def benchmark_cache(args):
+    for size in args.sizes:
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "program.t")
+            with open(filename, "w") as f:
+                f.write(generate_program(size))
+            cache_directory = os.path.join(directory, cache.CACHE_DIRECTORY)
+            cold = warm = uncached = None
+            for _ in range(args.repeat):
+                shutil.rmtree(cache_directory, ignore_errors=True)
+                elapsed = first_statement_latency(filename, True)
+                cold = min(cold or elapsed, elapsed)
+                elapsed = first_statement_latency(filename, True)
+                warm = min(warm or elapsed, elapsed)
+                elapsed = first_statement_latency(filename, False)
+                uncached = min(uncached or elapsed, elapsed)
+        finally:
+            shutil.rmtree(directory)
+        print(f"cache {size:>10} chars  no cache {uncached * 1000:9.1f}ms  "
+              f"cold {cold * 1000:9.1f}ms  warm {warm * 1000:9.1f}ms  "
+              f"{uncached / warm:6.1f}x")
+
+# Single character edits that keep the program valid: the first digit of a
+# number is replaced, a digit is inserted after it, or a space before it.
+def random_edit(generator, source):
+    while True:
+        offset = generator.randrange(1, len(source))
+        if source[offset].isdigit() and source[offset - 1] in " (+-*/":
+            break
+    digit = str(generator.randrange(1, 10))
+    return generator.choice([(offset, 1, digit), (offset + 1, 0, digit), (offset, 0, " ")])
+
+def benchmark_incremental(args):
+    import random
+    for lines in args.lines:
+        # every line of a generated program is a whole statement
+        source = "".join(generate_program(lines * 25).splitlines(keepends=True)[:lines])
+        document = incremental.Document(source)
+        generator = random.Random(13)
+        edit_time = full_time = 0.0
+        for _ in range(args.edits):
+            offset, deleted, inserted = random_edit(generator, document.source)
+            start = time.perf_counter()
+            document.edit(offset, deleted, inserted)
+            edit_time += time.perf_counter() - start
+            if not args.skip_reference:
+                start = time.perf_counter()
+                ast = parser.parse(token_table.scan_table(document.source))
+                full_time += time.perf_counter() - start
+        if not args.skip_reference:
+            assert document.ast == ast
+        line = (f"incremental {lines:>8} lines  edit {edit_time / args.edits * 1000:8.2f}ms")
+        if not args.skip_reference:
+            line += (f"  full parse {full_time / args.edits * 1000:8.1f}ms"
+                     f"  {full_time / edit_time:7.1f}x")
+        print(line)
+
+# A script pasted into the REPL, one line at a time, against running it as a
+# file. 'old repl' is the loop runner.py had before sessions: tokenize with
+# the echo, parse, print the AST and evaluate each line. 'repeated' pastes
+# the first 100 lines over and over, so most snippets come from the cache.
+def benchmark_repl(args):
+    def old_repl(lines):
+        for line in lines:
+            ast = parser.parse(tokenizer.tokenize(line))
+            print(ast)
+            evaluator.evaluate(ast)
+    def pasted(lines):
+        repl = session.Session()
+        for line in lines:
+            repl.feed(line)
+    def whole_file(lines):
+        evaluator.evaluate(parser.parse(token_table.scan_table("\n".join(lines))))
+    for count in args.lines:
+        lines = generate_program(count * 25).splitlines()[:count]
+        engines = [("file", whole_file, lines), ("session", pasted, lines),
+                   ("repeated", pasted, (lines[:100] * (count // 100 + 1))[:count])]
+        if not args.skip_reference:
+            engines.append(("old repl", old_repl, lines))
+        evaluator.set_output(output.NullOutput())
+        try:
+            for name, run, script in engines:
+                elapsed, _ = best_time(run_quietly, run, script, repeat=args.repeat)
+                print(f"repl {name:10} {count:>10,} lines {elapsed:8.3f}s "
+                      f"{count / elapsed:>12,.0f} lines/s")
+        finally:
+            evaluator.set_output(output.StandardOutput())
+
+# Parse and run one program on its own Interpreter. At module level so a
+# process pool can pickle it.
+def run_program(source):
+    return interpreter.Interpreter(output.NullOutput()).run(source)
+
+# Throughput of N independent programs run one after another, on a thread
+# pool and on a process pool. The threads share one GIL, so they show what
+# concurrency costs rather than a speed-up.
+def benchmark_concurrency(args):
+    from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+    for iterations in args.iterations:
+        programs = [generate_loop(iterations + i) for i in range(args.programs)]
+        def serial():
+            return [run_program(program) for program in programs]
+        def pooled(executor):
+            with executor(args.workers) as pool:
+                return list(pool.map(run_program, programs))
+        engines = [
+            ("serial", serial),
+            ("threads", lambda: pooled(ThreadPoolExecutor)),
+            ("processes", lambda: pooled(ProcessPoolExecutor)),
+        ]
+        expected = None
+        for name, run in engines:
+            # the process pool's workers are forked inside, so they inherit it
+            with every_iteration():
+                elapsed, results = best_time(run, repeat=args.repeat)
+            assert expected is None or results == expected
+            expected = results
+            print(f"concurrency {name:10} {args.programs} programs x {iterations:,} iterations "
+                  f"{args.workers} workers {elapsed:8.3f}s "
+                  f"{args.programs / elapsed:8.1f} programs/s")
+
+# The cost of enforcing a budget: each backend runs the loop benchmark with no
+# budget and with iteration, time and memory limits that are never reached.
+def benchmark_budget(args):
+    engines = [
+        ("evaluate", evaluator.evaluate),
+        ("closures", closures.evaluate_compiled),
+        ("bytecode", bytecode.evaluate_bytecode),
+        ("slots", slots.evaluate_with_slots),
+        ("python", transpiler.evaluate_transpiled),
+    ]
+    for iterations in args.iterations:
+        ast = parser.parse(tokenizer.scan(generate_loop(iterations)))
+        for name, run in engines:
+            def budgeted(ast):
+                evaluator.set_budget(budget.Budget(iterations * 2, 3600, 1 << 30))
+                try:
+                    return run(ast)
+                finally:
+                    evaluator.set_budget(None)
+            # alternate so that drift in the machine's speed hits both alike
+            plain = limited = None
+            # a budget turns closed-form loops off, so the run without one
+            # has to go round too
+            with every_iteration():
+                for _ in range(args.repeat):
+                    elapsed, _ = best_time(run_quietly, run, ast, repeat=1)
+                    plain = min(plain or elapsed, elapsed)
+                    elapsed, _ = best_time(run_quietly, budgeted, ast, repeat=1)
+                    limited = min(limited or elapsed, elapsed)
+            print(f"budget {name:10} {iterations:>12,} iterations  none {plain:8.3f}s  "
+                  f"budget {limited:8.3f}s  {(limited / plain - 1) * 100:+6.1f}%")
+
+# A program whose rows go round their loops a different number of times and
+# take different branches.
+batch_program = """
+k = n; s = 0;
+while (k) {
+    s = s + k * x;
+    k = k - 1;
+}
+if (s) y = s / 2 + x * x; else y = -x;
+"""
+
+# One program over a table of inputs: one evaluate() per row, each with its
+# own environment, against a single batch evaluation of every row.
+def benchmark_batch(args):
+    if batch.numpy is None:
+        print("batch: NumPy is not installed")
+        return
+    ast = parser.parse(tokenizer.scan(batch_program))
+    rng = batch.numpy.random.default_rng(0)
+    for rows in args.rows:
+        bindings = {"n": rng.integers(0, 20, rows), "x": rng.normal(size=rows)}
+        def per_row():
+            return batch.evaluate_rows(ast, bindings, rows)
+        row_time, _ = best_time(per_row, repeat=args.repeat)
+        batch_time, _ = best_time(batch.evaluate_batch, ast, bindings, repeat=args.repeat)
+        print(f"batch {rows:>9,} rows  per row {row_time:8.4f}s  batch {batch_time:8.4f}s  "
+              f"speedup {row_time / batch_time:8.1f}x")
+
+# A counting loop whose values stay small enough for closed-form execution
+# to be exact in floats at any of the benchmark's iteration counts.
+def generate_distance_loop(iterations):
+    return (f"k = {iterations}; speed = 3; distance = 0; steps = 0;\n"
+            f"while (k) {{\n"
+            f"    distance = distance + speed * 2;\n"
+            f"    steps = steps + 1;\n"
+            f"    k = k - 1;\n"
+            f"}}\n"
+            f"print distance;\n")
+
+# Counting loops solved in closed form, against going round. Loops longer
+# than --measure-limit are not run one iteration at a time; their time is
+# estimated from the rate of the longest one that was.
+def benchmark_closed_form(args):
+    rate = None
+    for iterations in args.iterations:
+        ast = parser.parse(tokenizer.scan(generate_distance_loop(iterations)))
+        solved, result = best_time(run_quietly, evaluator.evaluate, ast, repeat=args.repeat)
+        solved_environment = dict(evaluator.environment)
+        if iterations <= args.measure_limit:
+            closed_form.enabled = False
+            try:
+                looped, looped_result = best_time(run_quietly, evaluator.evaluate, ast, repeat=1)
+            finally:
+                closed_form.enabled = True
+            assert (result, solved_environment) == (looped_result, evaluator.environment)
+            rate = looped / iterations
+            label = "loop"
+        elif rate is not None:
+            looped = rate * iterations
+            label = "loop (estimated)"
+        else:
+            looped, label = None, "loop not run"
+        line = f"closed-form {iterations:>19,} iterations  closed form {solved * 1000:8.3f}ms"
+        if looped is not None:
+            line += f"  {label} {looped:14.3f}s  speedup {looped / solved:16,.0f}x"
+        print(line)
+
+# The evaluator and the closure compiler on loops over ints and over floats,
+# with and without the types inference.py proves. Closed-form execution is
+# turned off so that every iteration runs.
+def benchmark_types(args):
+    engines = [
+        ("evaluate", evaluator.evaluate),
+        ("eval+types", lambda ast: evaluator.evaluate(inference.infer(ast))),
+        ("closures", closures.evaluate_compiled),
+        ("clos+types", lambda ast: closures.evaluate_compiled(inference.infer(ast))),
+    ]
+    with every_iteration():
+        compare_engines("types int", engines, generate_loop, args)
+        compare_engines("types float", engines, generate_float_loop, args)
+
+# while (i < n) on every backend, with the comparison fused into the branch,
+# against while (n - i), the non-zero test loops had to use before there
+# were comparisons: one subtraction whose value is then tested. Closed-form
+# execution, which would solve the second loop, is turned off.
+def benchmark_conditions(args):
+    engines = [
+        ("evaluate", evaluator.evaluate),
+        ("closures", closures.evaluate_compiled),
+        ("bytecode", bytecode.evaluate_bytecode),
+        ("slots", slots.evaluate_with_slots),
+        ("python", transpiler.evaluate_transpiled),
+    ]
+    with every_iteration():
+        for iterations in args.iterations:
+            compare = parser.parse(tokenizer.scan(generate_compare_loop(iterations)))
+            subtract = parser.parse(tokenizer.scan(generate_compare_loop(iterations, "n - i")))
+            for name, run in engines:
+                compare_time, _ = best_time(run_quietly, run, compare, repeat=args.repeat)
+                subtract_time, _ = best_time(run_quietly, run, subtract, repeat=args.repeat)
+                print(f"conditions {name:10} {iterations:>12,} iterations  i < n {compare_time:8.3f}s "
+                      f"{iterations / compare_time:>12,.0f} iterations/s  n - i {subtract_time:8.3f}s  "
+                      f"{subtract_time / compare_time:6.2f}x")
+
+# Self-specialising nodes against the evaluator and the other tree-walking
+# backends, on loops over ints, over floats, and over a variable whose type
+# changes every iteration or every thousand, followed by the quickening
+# statistics for each loop. Closed-form execution is turned off so that
+# every iteration runs.
+def benchmark_quickening(args):
+    engines = [
+        ("evaluate", evaluator.evaluate),
+        ("closures", closures.evaluate_compiled),
+        ("slots", slots.evaluate_with_slots),
+        ("quickened", quickening.evaluate_quickened),
+    ]
+    workloads = [
+        ("int", generate_loop),
+        ("float", generate_float_loop),
+        ("mixed 1", lambda iterations: generate_mixed_loop(iterations, 1)),
+        ("mixed 1000", lambda iterations: generate_mixed_loop(iterations, 1000)),
+    ]
+    with every_iteration():
+        for label, generate in workloads:
+            compare_engines(f"quickening {label:10}", engines, generate, args)
+        for label, generate in workloads:
+            statistics = quickening.Statistics()
+            ast = parser.parse(tokenizer.scan(generate(args.iterations[0])))
+            run_quietly(lambda ast: quickening.evaluate_quickened(ast, statistics), ast)
+            print(f"quickening statistics, {label}:")
+            statistics.report()
+
+benchmarks = {
+    "tokenize": benchmark_tokenize,
+    "memory": benchmark_memory,
+    "tokens": benchmark_tokens,
+    "loops": benchmark_loops,
+    "variables": benchmark_variables,
+    "output": benchmark_output,
+    "optimize": benchmark_optimize,
+    "nesting": benchmark_nesting,
+    "cache": benchmark_cache,
+    "incremental": benchmark_incremental,
+    "repl": benchmark_repl,
+    "concurrency": benchmark_concurrency,
+    "budget": benchmark_budget,
+    "batch": benchmark_batch,
+    "closed-form": benchmark_closed_form,
+    "types": benchmark_types,
+    "conditions": benchmark_conditions,
+    "quickening": benchmark_quickening,
+}
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="topic-05 benchmarks")
+    argument_parser.add_argument("benchmark", choices=sorted(benchmarks))
+    argument_parser.add_argument("--sizes", type=int, nargs="+",
+                                 default=[1_000_000, 2_000_000, 4_000_000],
+                                 help="workload sizes")
+    argument_parser.add_argument("--iterations", type=int, nargs="+",
+                                 default=[1_000_000, 3_000_000],
+                                 help="loop iteration counts")
+    argument_parser.add_argument("--depths", type=int, nargs="+",
+                                 default=[100, 300, 10_000, 100_000],
+                                 help="nesting depths")
+    argument_parser.add_argument("--lines", type=int, nargs="+", default=[100_000],
+                                 help="program sizes in lines")
+    argument_parser.add_argument("--edits", type=int, default=100,
+                                 help="edits per program")
+    argument_parser.add_argument("--measure-limit", type=int, default=1_000_000,
+                                 help="longest loop to run one iteration at a time")
+    argument_parser.add_argument("--rows", type=int, nargs="+",
+                                 default=[100, 1000, 10_000, 100_000],
+                                 help="input rows for batch evaluation")
+    argument_parser.add_argument("--programs", type=int, default=64,
+                                 help="programs per concurrency run")
+    argument_parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                                 help="pool size for concurrency runs")
+    argument_parser.add_argument("--repeat", type=int, default=3)
+    argument_parser.add_argument("--skip-reference", action="store_true",
+                                 help="only run the new engine")
+    argument_parser.add_argument("--chunk-size", type=int, default=65536,
+                                 help="read size for streaming benchmarks")
+    args = argument_parser.parse_args()
+    benchmarks[args.benchmark](args)
+
+if __name__ == "__main__":
+    main()
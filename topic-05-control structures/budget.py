@@ -0,0 +1,222 @@
+import sys
+import time
+from itertools import repeat
+from operator import length_hint
+
+# Execution budgets. A Budget limits how long a program may run, counted in
+# loop iterations and in wall-clock seconds, and roughly how much memory its
+# variables may take. Only loops can make a program run long, so the budget is
+# only charged at loop back-edges: every backend adds one to budget.count
+# each time a while loop goes round and calls check() once the count reaches
+# budget.next_check. check() looks at the clock and the variables only every
+# `interval` iterations, so the bookkeeping costs an increment and a compare
+# per iteration.
+#
+# In the closure and Python backends even that is a large part of a small
+# loop body, so they count without arithmetic: a loop goes round with
+# `for _ in budget.ticks`, an iterator that yields once for each iteration
+# left before the next check. Nested loops share it, and when it runs out
+# tick() checks the budget and makes the next one.
+#
+# The deadline starts when the budget is made, or reset(). Going over any of
+# the limits raises BudgetExceeded, which leaves the environment as it was at
+# that point.
+
+class BudgetExceeded(Exception):
+    "Raised when a program runs past one of its budget's limits."
+    def __init__(self, message, limit):
+        super().__init__(message)
+        # "iterations", "seconds" or "memory"
+        self.limit = limit
+
+class Budget:
+    def __init__(self, iterations=None, seconds=None, memory=None, interval=1024):
+        self.iterations = iterations
+        self.seconds = seconds
+        self.memory = memory
+        self.interval = interval
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.deadline = None if self.seconds is None else time.monotonic() + self.seconds
+        self.next_check = self.schedule()
+        self.start_ticks()
+
+    def schedule(self):
+        next_check = self.count + self.interval
+        if self.iterations is not None:
+            next_check = min(next_check, self.iterations + 1)
+        return next_check
+
+    # Raise BudgetExceeded if a limit has been passed. variables is the
+    # environment, or whatever else holds the program's values. Backends that
+    # keep the count themselves pass it in. Returns the count for the next
+    # check.
+    def check(self, variables, count=None):
+        if count is not None:
+            self.count = count
+        if self.iterations is not None and self.count > self.iterations:
+            raise BudgetExceeded(f"Iteration budget of {self.iterations} exceeded", "iterations")
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise BudgetExceeded(f"Time budget of {self.seconds}s exceeded", "seconds")
+        if self.memory is not None and approximate_size(variables) > self.memory:
+            raise BudgetExceeded(f"Memory budget of {self.memory} bytes exceeded", "memory")
+        self.next_check = self.schedule()
+        return self.next_check
+
+    # Ticks for the iterations after the count, up to the one that reaches
+    # the next check.
+    def start_ticks(self):
+        self.ticks = repeat(None, self.next_check - 1 - self.count)
+        return self.ticks
+
+    # Set the count from what is left of ticks.
+    def stop_ticks(self, ticks):
+        self.count = self.next_check - 1 - length_hint(ticks)
+
+    # Called when the ticks have run out, which is when the iteration that
+    # reaches the next check starts. Returns the ticks for that iteration and
+    # the ones after it, up to the check after that.
+    def tick(self, variables):
+        self.check(variables, self.next_check)
+        self.ticks = repeat(None, self.next_check - self.count)
+        return self.ticks
+
+# Bytes taken by a dict of variables, or a list of values, and the values in it.
+def approximate_size(variables):
+    size = sys.getsizeof(variables)
+    if type(variables) is dict:
+        for name, value in variables.items():
+            size += sys.getsizeof(name) + sys.getsizeof(value)
+    else:
+        for value in variables:
+            size += sys.getsizeof(value)
+    return size
+
+def test_iteration_budget():
+    print("testing iteration budget")
+    budget = Budget(iterations=2500, interval=1000)
+    for count in range(1, 2501):
+        budget.count = count
+        if count >= budget.next_check:
+            budget.check({})
+    assert budget.next_check == 2501
+    budget.count += 1
+    try:
+        budget.check({})
+    except BudgetExceeded as e:
+        assert e.limit == "iterations"
+    else:
+        assert False, "Expected BudgetExceeded"
+
+def test_ticks():
+    print("testing ticks")
+    budget = Budget(iterations=2500, interval=1000)
+    iterations = 0
+    ticks = budget.ticks
+    try:
+        while True:
+            for _ in ticks:
+                iterations += 1
+            ticks = budget.tick({})
+    except BudgetExceeded as e:
+        assert e.limit == "iterations"
+    assert iterations == budget.iterations and budget.count == 2501
+    budget.reset()
+    ticks = budget.start_ticks()
+    for _ in zip(range(10), ticks):
+        pass
+    budget.stop_ticks(ticks)
+    assert budget.count == 10
+
+def test_time_budget():
+    print("testing time budget")
+    budget = Budget(seconds=0.01)
+    assert budget.check({}) == 1024
+    time.sleep(0.02)
+    try:
+        budget.check({})
+    except BudgetExceeded as e:
+        assert e.limit == "seconds"
+    else:
+        assert False, "Expected BudgetExceeded"
+    budget.reset()
+    budget.check({})
+
+def test_memory_budget():
+    print("testing memory budget")
+    budget = Budget(memory=1000)
+    budget.check({"x": 1.0})
+    try:
+        budget.check({f"v{i}": float(i) for i in range(100)})
+    except BudgetExceeded as e:
+        assert e.limit == "memory"
+    else:
+        assert False, "Expected BudgetExceeded"
+    assert approximate_size([1.0, 2.0]) > approximate_size([])
+
+import evaluator
+from tokenizer import scan
+from parser import parse
+from closures import evaluate_compiled
+from bytecode import evaluate_bytecode
+from slots import evaluate_with_slots
+from quickening import evaluate_quickened
+from transpiler import evaluate_transpiled
+
+backends = [evaluator.evaluate, evaluate_compiled, evaluate_bytecode,
+            evaluate_with_slots, evaluate_quickened, evaluate_transpiled]
+
+# Run source with each backend under the budget, expecting it to be exceeded.
+# Returns the environment each one stopped with.
+def run_over_budget(source, limit, **limits):
+    environments = []
+    for run in backends:
+        evaluator.environment.clear()
+        evaluator.set_budget(Budget(**limits))
+        try:
+            run(parse(scan(source)))
+        except BudgetExceeded as e:
+            assert e.limit == limit, run
+        else:
+            assert False, f"Expected BudgetExceeded from {run}"
+        finally:
+            evaluator.set_budget(None)
+        environments.append(dict(evaluator.environment))
+    return environments
+
+def test_backends_stop_at_the_budget():
+    print("testing every backend stops at the budget")
+    environments = run_over_budget("x = 0; while (1) x = x + 1;", "iterations", iterations=100)
+    assert environments == [{"x": 100}] * len(backends)
+    # loops on comparisons are charged like any other
+    environments = run_over_budget("x = 0; while (x < 1000) x = x + 1;", "iterations", iterations=100)
+    assert environments == [{"x": 100}] * len(backends)
+    # nested loops share the count
+    environments = run_over_budget(
+        "n = 0; i = 10; while (i) { j = 10; while (j) { n = n + 1; j = j - 1; } i = i - 1; }",
+        "iterations", iterations=50)
+    assert environments == [environments[0]] * len(backends)
+    run_over_budget("while (1) {}", "seconds", seconds=0.05, interval=64)
+
+def test_within_budget():
+    print("testing programs within their budget")
+    for run in backends:
+        evaluator.environment.clear()
+        limits = Budget(iterations=10, seconds=10, memory=10000)
+        evaluator.set_budget(limits)
+        try:
+            assert run(parse(scan("k = 10; while (k) k = k - 1;"))) == 0
+            assert limits.count == 10, run
+        finally:
+            evaluator.set_budget(None)
+
+if __name__ == "__main__":
+    test_iteration_budget()
+    test_ticks()
+    test_time_budget()
+    test_memory_budget()
+    test_backends_stop_at_the_budget()
+    test_within_budget()
+    print("done")
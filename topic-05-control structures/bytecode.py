@@ -0,0 +1,472 @@
+import evaluator
+from evaluator import binary_operations, unary_operations, comparisons
+
+# A bytecode compiler and stack-based virtual machine for the AST.
+#
+# The compiler flattens the tree into one list of integers, an opcode followed
+# by its argument for every instruction, so each instruction takes two slots.
+# Constants and variable names live in side tables and are referred to by
+# index. if and while become jumps to offsets in the same list, so a loop is
+# just a backward jump instead of a recursive walk over dicts.
+#
+# if conditions use JUMP_IF_FALSE and while conditions JUMP_IF_TRUE, so when
+# the evaluator's trace hook is set those jumps report "if" and "while"
+# branch events. A taken JUMP_IF_TRUE is a loop's back-edge, where the
+# evaluator's budget, if any, is charged. When the condition is a comparison
+# they are fused with it into COMPARE_JUMP_IF_FALSE and COMPARE_JUMP_IF_TRUE,
+# which compare the top two values and branch on the answer, so the 1 or 0
+# the comparison would have as a value is never made. Their argument packs
+# the jump target and the comparison together, as target * 8 + the
+# comparison's index in comparison_operators.
+#
+# && and || jump over their right operand with AND_JUMP and OR_JUMP when the
+# left one decides the result; those jumps are not branches of the program,
+# so they report no events.
+#
+# Like evaluate(), every statement leaves its value behind, here in a result
+# register, and the program returns the value of the last statement.
+
+LOAD_CONST = 0       # push constants[arg]
+LOAD_NAME = 1        # push environment[names[arg]]
+STORE_NAME = 2       # pop a value into environment[names[arg]], set result
+BINARY_ADD = 3       # pop y, pop x, push x + y
+BINARY_SUBTRACT = 4
+BINARY_MULTIPLY = 5
+BINARY_DIVIDE = 6
+BINARY_OP = 7        # pop y, pop x, push binary_operations[operators[arg]](x, y)
+UNARY_NEGATIVE = 8   # pop x, push -x
+UNARY_OP = 9         # pop x, push unary_operations[operators[arg]](x)
+PRINT = 10           # pop a value, print it, set result
+JUMP = 11            # continue at offset arg
+JUMP_IF_FALSE = 12   # pop a value, continue at offset arg if it is false
+JUMP_IF_TRUE = 13    # pop a value, continue at offset arg if it is true
+CLEAR_RESULT = 14    # set result to None
+SET_RESULT = 15      # pop a value into result
+RETURN = 16          # stop, returning result
+COMPARE_JUMP_IF_FALSE = 17  # pop y, pop x, continue at target unless x op y
+COMPARE_JUMP_IF_TRUE = 18   # pop y, pop x, continue at target if x op y
+AND_JUMP = 19        # if the top value is false, make it 0 and continue at arg, else pop it
+OR_JUMP = 20         # if the top value is true, make it 1 and continue at arg, else pop it
+TO_BOOL = 21         # pop x, push 1 if x is true and 0 if not
+
+opcode_names = [
+    "LOAD_CONST", "LOAD_NAME", "STORE_NAME",
+    "BINARY_ADD", "BINARY_SUBTRACT", "BINARY_MULTIPLY", "BINARY_DIVIDE", "BINARY_OP",
+    "UNARY_NEGATIVE", "UNARY_OP",
+    "PRINT", "JUMP", "JUMP_IF_FALSE", "JUMP_IF_TRUE", "CLEAR_RESULT", "SET_RESULT", "RETURN",
+    "COMPARE_JUMP_IF_FALSE", "COMPARE_JUMP_IF_TRUE", "AND_JUMP", "OR_JUMP", "TO_BOOL",
+]
+
+comparison_operators = list(comparisons)
+comparison_functions = [comparisons[op] for op in comparison_operators]
+compare_jumps = [COMPARE_JUMP_IF_FALSE, COMPARE_JUMP_IF_TRUE]
+jumps = [JUMP, JUMP_IF_FALSE, JUMP_IF_TRUE, AND_JUMP, OR_JUMP] + compare_jumps
+
+binary_opcodes = {
+    "+": BINARY_ADD,
+    "-": BINARY_SUBTRACT,
+    "*": BINARY_MULTIPLY,
+    "/": BINARY_DIVIDE,
+}
+
+class Code:
+    "A compiled program: flat instructions plus the tables they index into."
+    def __init__(self):
+        self.instructions = []
+        self.constants = []
+        self.names = []
+        self.operators = []
+        # each table's entries, keyed by (type, value) so that 1, 1.0 and
+        # True get entries of their own
+        self.indices = {id(table): {} for table in (self.constants, self.names, self.operators)}
+
+    def emit(self, opcode, argument=0):
+        self.instructions.extend((opcode, argument))
+        return len(self.instructions) - 2
+
+    # Point the jump emitted at offset to target.
+    def patch(self, offset, target):
+        if self.instructions[offset] in compare_jumps:
+            target = target * 8 + self.instructions[offset + 1] % 8
+        self.instructions[offset + 1] = target
+
+    def index(self, table, value):
+        indices = self.indices[id(table)]
+        key = (type(value), value)
+        i = indices.get(key)
+        if i is None:
+            i = indices[key] = len(table)
+            table.append(value)
+        return i
+
+statement_types = ["program", "block", "print", "assignment", "if", "while"]
+
+def compile_bytecode(ast):
+    code = Code()
+    compile_node(code, ast)
+    if type(ast) is not dict or ast["type"] not in statement_types:
+        # a bare expression, such as an evaluator test's operand tree
+        code.emit(SET_RESULT)
+    code.emit(RETURN)
+    return code
+
+def compile_node(code, node):
+    if type(node) is dict:
+        t = node["type"]
+
+        if t == "program" or t == "block":
+            if not node["statements"]:
+                # an empty block's value is None
+                code.emit(CLEAR_RESULT)
+            for statement in node["statements"]:
+                compile_node(code, statement)
+            return
+
+        if t == "print":
+            compile_node(code, node["expression"])
+            code.emit(PRINT)
+            return
+
+        if t == "assignment":
+            compile_node(code, node["expression"])
+            code.emit(STORE_NAME, code.index(code.names, node["name"]))
+            return
+
+        if t == "if":
+            to_else = compile_jump(code, node["condition"], JUMP_IF_FALSE)
+            compile_node(code, node["then"])
+            to_end = code.emit(JUMP)
+            code.patch(to_else, len(code.instructions))
+            if node["else"]:
+                compile_node(code, node["else"])
+            else:
+                code.emit(CLEAR_RESULT)
+            code.patch(to_end, len(code.instructions))
+            return
+
+        if t == "while":
+            # The condition is compiled after the body, so each iteration
+            # takes a single conditional jump back to the top of the body.
+            code.emit(CLEAR_RESULT)
+            to_condition = code.emit(JUMP)
+            body = len(code.instructions)
+            compile_node(code, node["do"])
+            code.patch(to_condition, len(code.instructions))
+            to_body = compile_jump(code, node["condition"], JUMP_IF_TRUE)
+            code.patch(to_body, body)
+            return
+
+        if t == "logical":
+            op = node["operator"]
+            compile_node(code, node["left"])
+            if op == "&&":
+                to_end = code.emit(AND_JUMP)
+            elif op == "||":
+                to_end = code.emit(OR_JUMP)
+            else:
+                raise Exception(f"Unknown logical operator {op}")
+            compile_node(code, node["right"])
+            code.emit(TO_BOOL)
+            code.patch(to_end, len(code.instructions))
+            return
+
+        if t == "binary":
+            op = node["operator"]
+            assert op in binary_operations
+            compile_node(code, node["left"])
+            compile_node(code, node["right"])
+            if op in binary_opcodes:
+                code.emit(binary_opcodes[op])
+            else:
+                code.emit(BINARY_OP, code.index(code.operators, op))
+            return
+
+        if t == "unary":
+            op = node["operator"]
+            assert op in unary_operations
+            compile_node(code, node["expression"])
+            if op == "-":
+                code.emit(UNARY_NEGATIVE)
+            else:
+                code.emit(UNARY_OP, code.index(code.operators, op))
+            return
+
+        if t == "identifier":
+            code.emit(LOAD_NAME, code.index(code.names, node["name"]))
+            return
+
+    if type(node) in [float, int]:
+        code.emit(LOAD_CONST, code.index(code.constants, node))
+        return
+    raise Exception(f"Unknown content in AST={node}")
+
+# Compile condition and the conditional jump of an if (JUMP_IF_FALSE) or a
+# while (JUMP_IF_TRUE), fused when the condition is a comparison. Returns the
+# offset of the jump for patching.
+def compile_jump(code, condition, jump):
+    if (type(condition) is dict and condition["type"] == "binary"
+            and condition["operator"] in comparisons):
+        compile_node(code, condition["left"])
+        compile_node(code, condition["right"])
+        compare_jump = COMPARE_JUMP_IF_FALSE if jump == JUMP_IF_FALSE else COMPARE_JUMP_IF_TRUE
+        return code.emit(compare_jump, comparison_operators.index(condition["operator"]))
+    compile_node(code, condition)
+    return code.emit(jump)
+
+def run(code, environment):
+    instructions = code.instructions
+    constants = code.constants
+    names = code.names
+    operators = code.operators
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    trace = evaluator.trace
+    write = evaluator.output.write
+    budget = evaluator.budget
+    result = None
+    pc = 0
+    while True:
+        opcode = instructions[pc]
+        argument = instructions[pc + 1]
+        pc += 2
+        if opcode == LOAD_NAME:
+            push(environment[names[argument]])
+        elif opcode == LOAD_CONST:
+            push(constants[argument])
+        elif opcode == STORE_NAME:
+            result = pop()
+            environment[names[argument]] = result
+            if trace is not None:
+                trace("assignment", names[argument], result)
+        elif opcode == BINARY_SUBTRACT:
+            y = pop()
+            stack[-1] = stack[-1] - y
+        elif opcode == BINARY_ADD:
+            y = pop()
+            stack[-1] = stack[-1] + y
+        elif opcode == BINARY_MULTIPLY:
+            y = pop()
+            stack[-1] = stack[-1] * y
+        elif opcode == BINARY_DIVIDE:
+            y = pop()
+            stack[-1] = stack[-1] / y
+        elif opcode == COMPARE_JUMP_IF_TRUE:
+            y = pop()
+            if comparison_functions[argument % 8](pop(), y):
+                pc = argument // 8
+                if trace is not None:
+                    trace("branch", "while", True)
+                if budget is not None:
+                    budget.count += 1
+                    if budget.count >= budget.next_check:
+                        budget.check(environment)
+            elif trace is not None:
+                trace("branch", "while", False)
+        elif opcode == COMPARE_JUMP_IF_FALSE:
+            y = pop()
+            if not comparison_functions[argument % 8](pop(), y):
+                pc = argument // 8
+                if trace is not None:
+                    trace("branch", "if", False)
+            elif trace is not None:
+                trace("branch", "if", True)
+        elif opcode == JUMP_IF_TRUE:
+            if pop():
+                pc = argument
+                if trace is not None:
+                    trace("branch", "while", True)
+                if budget is not None:
+                    budget.count += 1
+                    if budget.count >= budget.next_check:
+                        budget.check(environment)
+            elif trace is not None:
+                trace("branch", "while", False)
+        elif opcode == JUMP_IF_FALSE:
+            if not pop():
+                pc = argument
+                if trace is not None:
+                    trace("branch", "if", False)
+            elif trace is not None:
+                trace("branch", "if", True)
+        elif opcode == JUMP:
+            pc = argument
+        elif opcode == UNARY_NEGATIVE:
+            stack[-1] = -stack[-1]
+        elif opcode == PRINT:
+            result = pop()
+            write(result)
+            if trace is not None:
+                trace("print", None, result)
+        elif opcode == BINARY_OP:
+            y = pop()
+            stack[-1] = binary_operations[operators[argument]](stack[-1], y)
+        elif opcode == UNARY_OP:
+            stack[-1] = unary_operations[operators[argument]](stack[-1])
+        elif opcode == AND_JUMP:
+            if stack[-1]:
+                pop()
+            else:
+                stack[-1] = 0
+                pc = argument
+        elif opcode == OR_JUMP:
+            if stack[-1]:
+                stack[-1] = 1
+                pc = argument
+            else:
+                pop()
+        elif opcode == TO_BOOL:
+            stack[-1] = 1 if stack[-1] else 0
+        elif opcode == CLEAR_RESULT:
+            result = None
+        elif opcode == SET_RESULT:
+            result = pop()
+        elif opcode == RETURN:
+            return result
+        else:
+            raise Exception(f"Unknown opcode {opcode} at offset {pc - 2}")
+
+# Compile and run a node against the evaluator's environment, giving the same
+# output and result as evaluate(node).
+def evaluate_bytecode(node):
+    return run(compile_bytecode(node), evaluator.environment)
+
+def disassemble(code):
+    lines = []
+    instructions = code.instructions
+    jump_targets = {instructions[pc + 1] // 8 if instructions[pc] in compare_jumps else instructions[pc + 1]
+                    for pc in range(0, len(instructions), 2) if instructions[pc] in jumps}
+    for pc in range(0, len(instructions), 2):
+        opcode, argument = instructions[pc], instructions[pc + 1]
+        line = f"{'>>' if pc in jump_targets else '  '} {pc:4} {opcode_names[opcode]:16}"
+        if opcode == LOAD_CONST:
+            line += f" {argument} ({code.constants[argument]!r})"
+        elif opcode in [LOAD_NAME, STORE_NAME]:
+            line += f" {argument} ({code.names[argument]})"
+        elif opcode in [BINARY_OP, UNARY_OP]:
+            line += f" {argument} ({code.operators[argument]})"
+        elif opcode in compare_jumps:
+            line += f" {argument // 8} ({comparison_operators[argument % 8]})"
+        elif opcode in jumps:
+            line += f" {argument}"
+        lines.append(line.rstrip())
+    return "\n".join(lines)
+
+from tokenizer import tokenize
+from parser import parse
+from evaluator import run_captured
+
+def test_bytecode_matches_evaluate():
+    print("testing bytecode against evaluate")
+    with open("example.t") as f:
+        source = f.read()
+    for program in [
+        source,
+        "print 1+2*3-4/2;",
+        "print -2-2; print -(2-2); print -(2)-(2);",
+        "x = 23; x = x - 1; x = x - 1; y = x; x = x - 1 + y;",
+        "if (1) j = 2; else j = 0;",
+        "if (0) {j=1; k=2;} else {j=0; k=1;}",
+        "j = 5; if (0) j = 1;",
+        "k = 3; s = 0; while (k) { s = s + k * 2; k = k - 1; }",
+        "k = 0; while (k) k = k - 1;",
+        "k = 2; while (k) { j = 2; while (j) j = j - 1; k = k - 1; }",
+        "i = 0; n = 5; s = 0; while (i < n) { if (i >= 2 && !(i == 3) || s > 100) s = s + i; i = i + 1; }",
+        "x = 2.5; print x == 2.5; print x != x; print (x < 3) + (x <= 2) * 2 + !x;",
+        "x = 1; print 0 && 1 / 0; print 1 || q; print x && 0.5; print 0 || x - 1;",
+        "a = 1; b = 2; if (a < b) print 1; if (a >= b) print 2; else print 3; if (a > b) print 4;",
+    ]:
+        expected = run_captured(evaluator.evaluate, program)
+        assert run_captured(evaluate_bytecode, program) == expected, program
+
+def test_bytecode_trace_events():
+    print("testing bytecode trace events")
+    from tracing import EventBuffer, traced
+    for program in ["k = 2; while (k) k = k - 1; if (k) print 1; else print 2;",
+                    "k = 0; while (k < 2) k = k + 1; if (k == 2) print 1; if (k > 2 || 0) print 2;"]:
+        with traced(EventBuffer()) as expected:
+            evaluator.evaluate(parse(tokenize(program)))
+        with traced(EventBuffer()) as events:
+            evaluate_bytecode(parse(tokenize(program)))
+        assert events.events == expected.events
+
+def test_while_jumps():
+    print("testing while loop jumps")
+    code = compile_bytecode(parse(tokenize("k = 3; while (k) k = k - 1;")))
+    assert disassemble(code) == "\n".join([
+        "      0 LOAD_CONST       0 (3)",
+        "      2 STORE_NAME       0 (k)",
+        "      4 CLEAR_RESULT",
+        "      6 JUMP             16",
+        ">>    8 LOAD_NAME        0 (k)",
+        "     10 LOAD_CONST       1 (1)",
+        "     12 BINARY_SUBTRACT",
+        "     14 STORE_NAME       0 (k)",
+        ">>   16 LOAD_NAME        0 (k)",
+        "     18 JUMP_IF_TRUE     8",
+        "     20 RETURN",
+    ])
+
+def test_fused_comparison_jumps():
+    print("testing fused comparison jumps")
+    code = compile_bytecode(parse(tokenize("i = 0; while (i < n) i = i + 1; if (i != 3) print i;")))
+    assert disassemble(code) == "\n".join([
+        "      0 LOAD_CONST       0 (0)",
+        "      2 STORE_NAME       0 (i)",
+        "      4 CLEAR_RESULT",
+        "      6 JUMP             16",
+        ">>    8 LOAD_NAME        0 (i)",
+        "     10 LOAD_CONST       1 (1)",
+        "     12 BINARY_ADD",
+        "     14 STORE_NAME       0 (i)",
+        ">>   16 LOAD_NAME        0 (i)",
+        "     18 LOAD_NAME        1 (n)",
+        "     20 COMPARE_JUMP_IF_TRUE 8 (<)",
+        "     22 LOAD_NAME        0 (i)",
+        "     24 LOAD_CONST       2 (3)",
+        "     26 COMPARE_JUMP_IF_FALSE 34 (!=)",
+        "     28 LOAD_NAME        0 (i)",
+        "     30 PRINT",
+        "     32 JUMP             36",
+        ">>   34 CLEAR_RESULT",
+        ">>   36 RETURN",
+    ])
+
+def test_empty_blocks():
+    print("testing empty blocks and programs")
+    for program in ["", "x = 5; {}", "x = 5; if (1) {}", "x = 5; if (0) x = 1; else {}",
+                    "x = 5; k = 2; while (k) { k = k - 1; {} }"]:
+        ast = parse(tokenize(program))
+        evaluator.environment.clear()
+        expected = evaluator.evaluate(ast)
+        assert run(compile_bytecode(ast), {}) == expected, program
+
+def test_constant_table():
+    print("testing the constant table")
+    code = Code()
+    assert [code.index(code.constants, value) for value in [1, 1.0, True, 1, True, 1.0]] == [0, 1, 2, 0, 2, 1]
+    assert [type(value) for value in code.constants] == [int, float, bool]
+    # compiling stays linear in the number of distinct constants
+    program = "".join(f"x{i} = {i};" for i in range(5000))
+    code = compile_bytecode(parse(tokenize(program)))
+    assert len(code.constants) == len(code.names) == 5000
+
+def test_generic_operators():
+    print("testing generic operators")
+    binary_operations["%"] = lambda x, y: x % y
+    try:
+        code = compile_bytecode({"type": "binary", "operator": "%", "left": 7, "right": 4})
+        assert "BINARY_OP        0 (%)" in disassemble(code)
+        assert run(code, {}) == 3
+    finally:
+        del binary_operations["%"]
+
+if __name__ == "__main__":
+    test_bytecode_matches_evaluate()
+    test_bytecode_trace_events()
+    test_while_jumps()
+    test_fused_comparison_jumps()
+    test_empty_blocks()
+    test_constant_table()
+    test_generic_operators()
+    print(disassemble(compile_bytecode(parse(tokenize(open("example.t").read())))))
@@ -0,0 +1,175 @@
+import gc
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+
+import tokenizer
+import token_table
+import parser
+import optimizer
+import inference
+import evaluator
+
+# An on-disk cache of parsed programs, in the spirit of __pycache__.
+#
+# The AST for dir/name.t at optimisation level N is kept in
+# dir/__tcache__/name.t-ON.cache as a marshalled tuple of
+#
+#   (magic, source hash, ast)
+#
+# The magic number covers the Python version (marshal's format can change
+# between versions) and the source of the front end modules, so editing the
+# tokenizer, parser, optimizer or type inference invalidates every entry, just
+# as editing the program invalidates its own. So does editing the evaluator,
+# whose operations the optimizer folds constants with. A new entry is written
+# to a temporary file in the same directory and renamed into place, so
+# readers only ever see a complete file and concurrent writers cannot corrupt
+# each other: the last rename wins, and every version is valid. A cache that
+# cannot be read or written is treated as a miss.
+
+CACHE_DIRECTORY = "__tcache__"
+
+front_end_modules = [tokenizer, token_table, parser, optimizer, inference, evaluator]
+
+magic = None
+
+def cache_magic():
+    global magic
+    if magic is None:
+        digest = hashlib.sha256(sys.version.encode())
+        for module in front_end_modules:
+            with open(module.__file__, "rb") as f:
+                digest.update(f.read())
+        magic = digest.hexdigest()
+    return magic
+
+def cache_path(filename, level):
+    directory, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, CACHE_DIRECTORY, f"{name}-O{level}.cache")
+
+def read_cache(path, source_hash):
+    # Loading creates a great many dicts at once, none of them garbage, so
+    # the cyclic garbage collector is paused rather than left to scan them
+    # over and over.
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        entry_magic, entry_hash, ast = marshal.loads(data)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    finally:
+        if collecting:
+            gc.enable()
+    if entry_magic != cache_magic() or entry_hash != source_hash:
+        return None
+    return ast
+
+def write_cache(path, source_hash, ast):
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                f.write(marshal.dumps((cache_magic(), source_hash, ast)))
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+    except (OSError, ValueError):
+        # an unwritable directory, or an AST marshal cannot store
+        pass
+
+def parse_source(source, level=0, iterative=False):
+    return optimizer.optimize(parser.parse(token_table.scan_table(source), iterative), level)
+
+# The parsed, and optimised, program in filename, from the cache when the
+# cached entry is still valid.
+def load_program(filename, level=0, iterative=False, use_cache=True):
+    with open(filename, "rb") as f:
+        data = f.read()
+    source = data.decode()
+    if not use_cache:
+        return parse_source(source, level, iterative)
+    source_hash = hashlib.sha256(data).hexdigest()
+    path = cache_path(filename, level)
+    ast = read_cache(path, source_hash)
+    if ast is None:
+        ast = parse_source(source, level, iterative)
+        write_cache(path, source_hash, ast)
+    return ast
+
+def test_load_program():
+    print("testing program cache")
+    import shutil
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "example.t")
+        shutil.copy("example.t", filename)
+        path = cache_path(filename, 1)
+        expected = parse_source(open("example.t").read(), 1)
+        assert load_program(filename, 1) == expected
+        assert os.path.exists(path)
+        # a warm load reads the cache without parsing
+        saved = parser.parse
+        parser.parse = None
+        try:
+            assert load_program(filename, 1) == expected
+        finally:
+            parser.parse = saved
+        # editing the source invalidates the entry
+        with open(filename, "a") as f:
+            f.write("print 99;\n")
+        ast = load_program(filename, 1)
+        assert ast["statements"][-1] == {"type": "print", "expression": 99}
+        assert read_cache(path, hashlib.sha256(open(filename, "rb").read()).hexdigest()) == ast
+        assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]
+    finally:
+        shutil.rmtree(directory)
+
+def test_corrupt_cache_is_a_miss():
+    print("testing corrupt cache entries")
+    import shutil
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "program.t")
+        with open(filename, "w") as f:
+            f.write("x = 1; print x;")
+        path = cache_path(filename, 0)
+        os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as f:
+            f.write(b"not a cache entry")
+        assert load_program(filename) == parse_source("x = 1; print x;")
+        assert read_cache(path, hashlib.sha256(b"x = 1; print x;").hexdigest()) is not None
+    finally:
+        shutil.rmtree(directory)
+
+def test_stale_magic_is_a_miss():
+    print("testing stale magic number")
+    import shutil
+    global magic
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, "program.t")
+        with open(filename, "w") as f:
+            f.write("x = 1;")
+        load_program(filename)
+        source_hash = hashlib.sha256(b"x = 1;").hexdigest()
+        assert read_cache(cache_path(filename, 0), source_hash) is not None
+        saved, magic = cache_magic(), "a different interpreter"
+        try:
+            assert read_cache(cache_path(filename, 0), source_hash) is None
+        finally:
+            magic = saved
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test_load_program()
+    test_corrupt_cache_is_a_miss()
+    test_stale_magic_is_a_miss()
+    print("done")
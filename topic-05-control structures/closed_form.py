@@ -0,0 +1,398 @@
+import math
+
+# Closed-form execution of counting loops.
+#
+# A loop like
+#
+#   while (k) { s = s + k * 2; n = n + 1; k = k - 1; }
+#
+# only ever updates its variables with affine arithmetic, that is, sums of
+# variables times constants plus a constant. One time round the body is then
+# an affine map of the variables, x -> M x, and n times round is M^n x, which
+# takes about log2(n) matrix products instead of n evaluations. analyze()
+# recognises such loops once, and run() executes one at the current values of
+# its variables, or declines so that the caller runs the loop as usual.
+#
+# A loop is recognised when:
+#
+#   - its body is assignments only, of expressions built from numbers,
+#     variables, +, -, unary minus, and * where one side is constant;
+#   - its numbers are whole;
+#   - the condition is affine and changes by the same non-zero step every
+#     time round, so the number of iterations follows from its starting value;
+#   - every variable depends, through one time round, on itself with a
+#     coefficient of 0 or 1 and otherwise only on variables that do not
+#     depend back on it. Values then grow like polynomials in the iteration
+#     count, not exponentially.
+#
+# run() declines unless the result is exactly what the loop would compute:
+# the variables the body reads must all be ints, or all be floats with whole
+# values, and the loop must run at least `minimum_trips` times. In floats,
+# arithmetic on whole numbers is exact up to 2**53, so run() bounds every
+# value the loop would compute along the way, in every iteration, and
+# declines if any could go past that. It also declines if a variable could
+# end up as -0.0 rather than 0.0, which the exact arithmetic cannot tell
+# apart. Divisions are never recognised.
+#
+# Loops whose count never reaches zero are left to run as usual.
+
+# Set to False to always run loops one iteration at a time.
+enabled = True
+
+# Shorter loops are cheaper to run than to solve.
+minimum_trips = 16
+
+# Whole numbers up to this size are exact as floats.
+LIMIT = 2 ** 53
+
+class Plan:
+    def __init__(self, names, needed, assigned, matrix, condition, step, bounds,
+                 literal_type, last, negative_zero):
+        # the variables, in the order their values are held in vectors and
+        # matrices, which have one more place for the constant 1
+        self.names = names
+        # indices of variables whose starting values the loop reads
+        self.needed = needed
+        # indices of variables the body assigns, in the order it first does
+        self.assigned = assigned
+        # one time round the body, as an augmented matrix
+        self.matrix = matrix
+        self.absolute_matrix = [[abs(a) for a in row] for row in matrix]
+        # the condition as an affine row vector, and its change per iteration
+        self.condition = condition
+        self.step = step
+        # |coefficients| of every value computed in an iteration, as a
+        # function of the variables at the start of that iteration
+        self.bounds = bounds
+        # int or float, or None if the body has no numbers
+        self.literal_type = literal_type
+        # index of the variable the body assigns last: the loop's value
+        self.last = last
+        # indices of the variables that could become -0.0
+        self.negative_zero = negative_zero
+
+# Affine form of an expression over the variables in index: a list of
+# coefficients with the constant term last. Appends the form of every node,
+# including this one, to forms, and the type of every number to literal_types.
+# Returns None if the expression is not affine.
+def affine(node, index, literal_types, forms):
+    size = len(index) + 1
+    if type(node) in (int, float):
+        if not float(node).is_integer():
+            return None
+        literal_types.add(type(node))
+        form = [0] * size
+        form[-1] = int(node)
+    elif type(node) is not dict:
+        return None
+    elif node["type"] == "identifier":
+        form = [0] * size
+        form[index[node["name"]]] = 1
+    elif node["type"] == "unary" and node["operator"] == "-":
+        inner = affine(node["expression"], index, literal_types, forms)
+        if inner is None:
+            return None
+        form = [-a for a in inner]
+    elif node["type"] == "binary" and node["operator"] in "+-*":
+        left = affine(node["left"], index, literal_types, forms)
+        right = affine(node["right"], index, literal_types, forms)
+        if left is None or right is None:
+            return None
+        operator = node["operator"]
+        if operator == "+":
+            form = [a + b for a, b in zip(left, right)]
+        elif operator == "-":
+            form = [a - b for a, b in zip(left, right)]
+        elif not any(left[:-1]):
+            form = [left[-1] * b for b in right]
+        elif not any(right[:-1]):
+            form = [a * right[-1] for a in left]
+        else:
+            return None
+    else:
+        return None
+    forms.append(form)
+    return form
+
+# Whether an expression could come out as -0.0, given the variables that
+# could be -0.0. With whole numbers, x + y is -0.0 only if both are, x - y
+# only if x is, c * x, for a positive constant c, only if x is.
+def may_be_negative_zero(node, index, negative):
+    if type(node) is not dict:
+        return is_negative_zero(node)
+    t = node["type"]
+    if t == "identifier":
+        return index[node["name"]] in negative
+    if t == "unary":
+        return True
+    left, right = node["left"], node["right"]
+    if node["operator"] == "+":
+        return (may_be_negative_zero(left, index, negative)
+                and may_be_negative_zero(right, index, negative))
+    if node["operator"] == "-":
+        return may_be_negative_zero(left, index, negative)
+    for constant, other in [(left, right), (right, left)]:
+        form = affine(constant, index, set(), [])
+        if not any(form[:-1]):
+            if form[-1] > 0 and not may_be_negative_zero(constant, index, negative):
+                return may_be_negative_zero(other, index, negative)
+            return True
+    return True
+
+def is_negative_zero(value):
+    return value == 0 and math.copysign(1.0, value) < 0
+
+def identifiers(node, found):
+    if type(node) is dict:
+        if node["type"] == "identifier":
+            found.append(node["name"])
+        for key in ("left", "right", "expression"):
+            if key in node:
+                identifiers(node[key], found)
+    return found
+
+# row * matrix, for an affine row vector and an augmented matrix
+def compose(row, matrix):
+    return [sum(a * matrix[i][j] for i, a in enumerate(row) if a) for j in range(len(row))]
+
+def multiply(a, b):
+    return [compose(row, b) for row in a]
+
+def apply(matrix, vector):
+    return [sum(a * x for a, x in zip(row, vector)) for row in matrix]
+
+def power(matrix, n):
+    result = [[int(i == j) for j in range(len(matrix))] for i in range(len(matrix))]
+    while n:
+        if n & 1:
+            result = multiply(result, matrix)
+        matrix = multiply(matrix, matrix)
+        n >>= 1
+    return result
+
+# True if every variable depends on itself with a coefficient of 0 or 1 and
+# there is no cycle through other variables.
+def triangular(matrix):
+    size = len(matrix) - 1
+    if any(matrix[i][i] not in (0, 1) for i in range(size)):
+        return False
+    state = [0] * size  # 0 unvisited, 1 on the current path, 2 done
+    def visit(i):
+        state[i] = 1
+        for j in range(size):
+            if j != i and matrix[i][j]:
+                if state[j] == 1 or (state[j] == 0 and not visit(j)):
+                    return False
+        state[i] = 2
+        return True
+    return all(state[i] == 2 or visit(i) for i in range(size))
+
+# A Plan for a while node, or None if the loop is not one this module can run.
+def analyze(node):
+    body = node["do"]
+    if type(body) is dict and body["type"] == "block":
+        statements = body["statements"]
+    else:
+        statements = [body]
+    if not statements or any(type(s) is not dict or s["type"] != "assignment" for s in statements):
+        return None
+    names = []
+    for statement in statements:
+        names.extend(identifiers(statement["expression"], []))
+        names.append(statement["name"])
+    names.extend(identifiers(node["condition"], []))
+    names = list(dict.fromkeys(names))
+    index = {name: i for i, name in enumerate(names)}
+    size = len(names) + 1
+    literal_types = set()
+    bounds = []
+    needed = set()
+    assigned = []
+    # the values of the variables so far through the body, as affine
+    # functions of their values at the start of the iteration
+    matrix = [[int(i == j) for j in range(size)] for i in range(size)]
+    negative = set()
+    for statement in statements:
+        forms = []
+        form = affine(statement["expression"], index, literal_types, forms)
+        if form is None:
+            return None
+        needed.update(index[name] for name in identifiers(statement["expression"], [])
+                      if index[name] not in assigned)
+        bounds.extend(compose(form, matrix) for form in forms)
+        target = index[statement["name"]]
+        matrix[target] = compose(form, matrix)
+        if target not in assigned:
+            assigned.append(target)
+    forms = []
+    condition = affine(node["condition"], index, literal_types, forms)
+    if condition is None or len(literal_types) > 1 or not triangular(matrix):
+        return None
+    needed.update(index[name] for name in identifiers(node["condition"], []))
+    bounds.extend(forms)
+    stepped = compose(condition, matrix)
+    step = stepped[-1] - condition[-1]
+    if stepped[:-1] != condition[:-1] or step == 0:
+        return None
+    # the variables that could be -0.0 after any number of iterations, when
+    # none is at the start
+    while True:
+        grown = set(negative)
+        for statement in statements:
+            if may_be_negative_zero(statement["expression"], index, negative):
+                grown.add(index[statement["name"]])
+        if grown == negative:
+            break
+        negative = grown
+    return Plan(names, sorted(needed), assigned, matrix, condition, step,
+                [[abs(a) for a in form] for form in bounds],
+                literal_types.pop() if literal_types else None,
+                index[statements[-1]["name"]], negative)
+
+# Run the loop planned by plan against environment in one step. Returns
+# (True, the loop's value) having updated environment, or (False, None)
+# having left it alone, when the loop has to be run as usual.
+def run(plan, environment):
+    values = []
+    for i in plan.needed:
+        name = plan.names[i]
+        if name not in environment:
+            return False, None
+        values.append(environment[name])
+    kinds = {type(value) for value in values}
+    if plan.literal_type is not None:
+        kinds.add(plan.literal_type)
+    if len(kinds) != 1 or kinds.pop() not in (int, float):
+        return False, None
+    floats = type(values[0]) is float if values else plan.literal_type is float
+    # whole numbers, and no -0.0
+    if floats and not all(value.is_integer() and not is_negative_zero(value) for value in values):
+        return False, None
+    start = [0] * len(plan.matrix)
+    start[-1] = 1
+    for i, value in zip(plan.needed, values):
+        start[i] = int(value)
+    remaining = -sum(a * x for a, x in zip(plan.condition, start))
+    if remaining % plan.step or remaining // plan.step < minimum_trips:
+        return False, None
+    trips = remaining // plan.step
+    if floats:
+        # Every value in an iteration is at most its form with absolute
+        # coefficients, applied to the absolute values at the start of the
+        # iteration, and these grow at most like the same loop run with
+        # absolute values. Each of those only goes up after the first
+        # len(names) iterations, so its largest value is in those or the last.
+        bound = [abs(x) for x in start]
+        largest = bound
+        for _ in range(min(len(plan.names), trips)):
+            bound = apply(plan.absolute_matrix, bound)
+            largest = [max(a, b) for a, b in zip(largest, bound)]
+        bound = apply(power(plan.absolute_matrix, trips), [abs(x) for x in start])
+        largest = [max(a, b) for a, b in zip(largest, bound)]
+        if max(largest) > LIMIT or any(sum(a * y for a, y in zip(form, largest)) > LIMIT
+                                      for form in plan.bounds):
+            return False, None
+    final = apply(power(plan.matrix, trips), start)
+    if floats and any(final[i] == 0 for i in plan.negative_zero):
+        return False, None
+    convert = float if floats else int
+    for i in plan.assigned:
+        environment[plan.names[i]] = convert(final[i])
+    return True, convert(final[plan.last])
+
+from tokenizer import scan
+from parser import parse
+# imported as a module, since evaluator.py imports this one
+import evaluator
+from output import ListOutput
+
+# The evaluator's results from source with and without closed-form loops.
+def run_both(source, environment=None):
+    # this module as the evaluator sees it, also when it runs as a script
+    import closed_form
+    ast = parse(scan(source))
+    results = []
+    for enabled in [True, False]:
+        saved, closed_form.enabled = closed_form.enabled, enabled
+        try:
+            walker = evaluator.Evaluator(dict(environment or {}), ListOutput())
+            results.append((walker.evaluate(ast), walker.environment, walker.output.values))
+        finally:
+            closed_form.enabled = saved
+    return results
+
+# Whether the last statement of source, a while loop, runs in closed form
+# after the statements before it.
+def closed_form_used(source, environment=None):
+    statements = parse(scan(source))["statements"]
+    walker = evaluator.Evaluator(dict(environment or {}), ListOutput())
+    for statement in statements[:-1]:
+        walker.evaluate(statement)
+    plan = analyze(statements[-1])
+    return plan is not None and run(plan, walker.environment)[0]
+
+def test_matches_loop():
+    print("testing closed-form loops match the loop")
+    from closures import evaluate_compiled
+    programs = [
+        "k = 1000; s = 0; while (k) { s = s + k * 2; k = k - 1; }",
+        "k = 100; a = 1; b = 0; c = 5; while (k) { c = c + b; b = b + a; a = a + 3; k = k - 1; }",
+        "i = 0; n = 50; t = 7; while (n - i) { t = i * 3 - -2; s = t + t; i = i + 1; }",
+        "k = 60; x = 10; while (k) { k = k - 2; x = 2 * (x - k) - x; }",
+        "k = 20; y = 0; while (-k + 0) { y = y - 1; k = k - 1; }",
+    ]
+    for source in programs:
+        assert closed_form_used(source), source
+        closed, looped = run_both(source)
+        assert closed == looped, (source, closed, looped)
+        assert all(str(value) == str(looped[1][name]) for name, value in closed[1].items())
+        # and compiled to closures
+        evaluator.environment.clear()
+        assert evaluate_compiled(parse(scan(source))) == looped[0]
+        assert evaluator.environment == looped[1]
+
+def test_falls_back():
+    print("testing closed-form loops fall back")
+    programs = [
+        # too short
+        "k = 3; s = 0; while (k) { s = s + k; k = k - 1; }",
+        # not affine, or not only assignments
+        "k = 100; s = 1; while (k) { s = s * k; k = k - 1; }",
+        "k = 100; s = 1; while (k) { s = s / 2; k = k - 1; }",
+        "k = 100; while (k) { print k; k = k - 1; }",
+        # exponential growth
+        "k = 100; s = 1; while (k) { s = s + s; k = k - 1; }",
+        # a fraction
+        "k = 100; s = 0.5; while (k) { s = s + k; k = k - 1; }",
+        # past 2**53
+        "k = 100000; s = 9007199254000000.0; while (k) { s = s + k; k = k - 1; }",
+        # could end as -0.0
+        "k = 100.0; s = 100.0; while (k) { s = -(k - 1); k = k - 1; }",
+        # never reaches zero
+        "k = 101; s = 0; while (k) { s = s + 1; k = k - 2; }",
+    ]
+    for source in programs:
+        assert not closed_form_used(source), source
+    closed, looped = run_both(programs[7])
+    assert closed == looped and str(closed[1]["s"]) == "-0.0"
+    closed, looped = run_both(programs[6])
+    assert closed == looped
+
+def test_integers():
+    print("testing closed-form loops over ints")
+    n = 10 ** 12
+    loop = parse(scan("while (k) { s = s + k * 3; k = k - 1; }"))["statements"][0]
+    plan = analyze(loop)
+    environment = {"k": n, "s": 0}
+    assert run(plan, environment) == (True, 0)
+    assert environment == {"k": 0, "s": 3 * n * (n + 1) // 2}
+    assert type(environment["s"]) is int
+    # mixed ints and floats run as usual
+    assert run(plan, {"k": 100, "s": 0.0}) == (False, None)
+    assert run(plan, {"k": 100.0, "s": 0.0}) == (False, None)
+
+if __name__ == "__main__":
+    test_matches_loop()
+    test_falls_back()
+    test_integers()
+    print("done")
@@ -0,0 +1,365 @@
+import evaluator
+import closed_form
+from evaluator import binary_operations, unary_operations
+
+# A compile step for the AST. Each node is turned, once, into a Python closure
+# that takes the environment and does that node's work, calling the closures
+# of its children directly. Running the program then never looks at
+# node["type"] or the operator again, so a while loop body costs only the
+# calls it actually needs.
+#
+# The evaluator's trace hook, output sink and budget are looked up when a
+# program is compiled. Without a hook or a budget the closures contain no
+# tracing or budget code at all, and counting loops that closed_form.py can
+# solve are solved at run time instead of going round.
+
+def compile_closures(node):
+    if type(node) is dict:
+        t = node["type"]
+        if t not in node_compilers:
+            raise Exception(f"Unknown content in AST={node}")
+        return node_compilers[t](node)
+    if type(node) in [float, int]:
+        value = node
+        return lambda env: value
+    raise Exception(f"Unknown content in AST={node}")
+
+def compile_statements(node):
+    statements = [compile_closures(statement) for statement in node["statements"]]
+    if len(statements) == 1:
+        return statements[0]
+    def run_statements(env):
+        most_recent_value = None
+        for statement in statements:
+            most_recent_value = statement(env)
+        return most_recent_value
+    return run_statements
+
+# A whole program hands its count back to the budget when it finishes.
+def compile_program(node):
+    run_statements = compile_statements(node)
+    budget = evaluator.budget
+    if budget is None:
+        return run_statements
+    def run_budgeted_program(env):
+        budget.start_ticks()
+        try:
+            return run_statements(env)
+        finally:
+            budget.stop_ticks(budget.ticks)
+    return run_budgeted_program
+
+def compile_print(node):
+    expression = compile_closures(node["expression"])
+    write = evaluator.output.write
+    trace = evaluator.trace
+    if trace is None:
+        def run_print(env):
+            x = expression(env)
+            write(x)
+            return x
+        return run_print
+    def run_traced_print(env):
+        x = expression(env)
+        write(x)
+        trace("print", None, x)
+        return x
+    return run_traced_print
+
+def compile_if(node):
+    condition = compile_condition(node["condition"])
+    then_statement = compile_closures(node["then"])
+    else_statement = compile_closures(node["else"]) if node["else"] else None
+    trace = evaluator.trace
+    if trace is not None:
+        untraced_condition = condition
+        def condition(env):
+            taken = untraced_condition(env)
+            trace("branch", "if", bool(taken))
+            return taken
+    if else_statement is None:
+        def run_if(env):
+            if condition(env):
+                return then_statement(env)
+            return None
+        return run_if
+    def run_if_else(env):
+        if condition(env):
+            return then_statement(env)
+        return else_statement(env)
+    return run_if_else
+
+def compile_while(node):
+    condition = compile_condition(node["condition"])
+    do_statement = compile_closures(node["do"])
+    trace = evaluator.trace
+    if trace is not None:
+        untraced_condition = condition
+        def condition(env):
+            taken = untraced_condition(env)
+            trace("branch", "while", bool(taken))
+            return taken
+    budget = evaluator.budget
+    plan = None
+    if closed_form.enabled and trace is None and budget is None:
+        plan = closed_form.analyze(node)
+    if plan is not None:
+        def run_closed_form_while(env):
+            done, value = closed_form.run(plan, env)
+            if done:
+                return value
+            result = None
+            while condition(env):
+                result = do_statement(env)
+            return result
+        return run_closed_form_while
+    if budget is None:
+        def run_while(env):
+            result = None
+            while condition(env):
+                result = do_statement(env)
+            return result
+        return run_while
+    def run_budgeted_while(env):
+        if not condition(env):
+            return None
+        while True:
+            ticks = budget.ticks
+            for _ in ticks:
+                result = do_statement(env)
+                if not condition(env):
+                    return result
+            # out of ticks, unless a nested loop ran them out first and has
+            # already checked
+            if ticks is budget.ticks:
+                budget.tick(env)
+    return run_budgeted_while
+
+def compile_assignment(node):
+    name = node["name"]
+    expression = compile_closures(node["expression"])
+    trace = evaluator.trace
+    if trace is None:
+        def run_assignment(env):
+            x = expression(env)
+            env[name] = x
+            return x
+        return run_assignment
+    def run_traced_assignment(env):
+        x = expression(env)
+        env[name] = x
+        trace("assignment", name, x)
+        return x
+    return run_traced_assignment
+
+def compile_identifier(node):
+    name = node["name"]
+    return lambda env: env[name]
+
+# Closures for the common operators, with variants for a constant right
+# operand such as 'k - 1'. Any other operator goes through binary_operations.
+specialised_binary = {
+    "+": (lambda left, right: lambda env: left(env) + right(env),
+          lambda left, value: lambda env: left(env) + value),
+    "-": (lambda left, right: lambda env: left(env) - right(env),
+          lambda left, value: lambda env: left(env) - value),
+    "*": (lambda left, right: lambda env: left(env) * right(env),
+          lambda left, value: lambda env: left(env) * value),
+    "/": (lambda left, right: lambda env: left(env) / right(env),
+          lambda left, value: lambda env: left(env) / value),
+}
+
+# Closures for typed nodes (see inference.py) whose left operand is a
+# variable: it is read from the environment inside the node's own closure,
+# with variants for a variable and for a constant on the right.
+typed_binary = {
+    "+": (lambda name, other: lambda env: env[name] + env[other],
+          lambda name, value: lambda env: env[name] + value),
+    "-": (lambda name, other: lambda env: env[name] - env[other],
+          lambda name, value: lambda env: env[name] - value),
+    "*": (lambda name, other: lambda env: env[name] * env[other],
+          lambda name, value: lambda env: env[name] * value),
+    "/": (lambda name, other: lambda env: env[name] / env[other],
+          lambda name, value: lambda env: env[name] / value),
+}
+
+def compile_binary(node):
+    op = node["operator"]
+    assert op in binary_operations
+    if "value_type" in node and op in typed_binary and is_variable(node["left"]):
+        variables, constant_right = typed_binary[op]
+        name = node["left"]["name"]
+        if type(node["right"]) in [float, int]:
+            return constant_right(name, node["right"])
+        if is_variable(node["right"]):
+            return variables(name, node["right"]["name"])
+    left = compile_closures(node["left"])
+    if op in specialised_binary:
+        generic, constant_right = specialised_binary[op]
+        if type(node["right"]) in [float, int]:
+            return constant_right(left, node["right"])
+        return generic(left, compile_closures(node["right"]))
+    right = compile_closures(node["right"])
+    operation = binary_operations[op]
+    return lambda env: operation(left(env), right(env))
+
+def is_variable(node):
+    return type(node) is dict and node["type"] == "identifier"
+
+# Closures for a comparison that is an if or while condition: they give the
+# comparison's True or False for the branch, rather than its value 1 or 0.
+# Besides the general case there are variants for a constant right operand,
+# and for a variable left operand with a variable or a constant on the right,
+# such as 'i < n' and 'k > 0'.
+compare_closures = {
+    "==": (lambda left, right: lambda env: left(env) == right(env),
+           lambda left, value: lambda env: left(env) == value,
+           lambda name, other: lambda env: env[name] == env[other],
+           lambda name, value: lambda env: env[name] == value),
+    "!=": (lambda left, right: lambda env: left(env) != right(env),
+           lambda left, value: lambda env: left(env) != value,
+           lambda name, other: lambda env: env[name] != env[other],
+           lambda name, value: lambda env: env[name] != value),
+    "<": (lambda left, right: lambda env: left(env) < right(env),
+          lambda left, value: lambda env: left(env) < value,
+          lambda name, other: lambda env: env[name] < env[other],
+          lambda name, value: lambda env: env[name] < value),
+    "<=": (lambda left, right: lambda env: left(env) <= right(env),
+           lambda left, value: lambda env: left(env) <= value,
+           lambda name, other: lambda env: env[name] <= env[other],
+           lambda name, value: lambda env: env[name] <= value),
+    ">": (lambda left, right: lambda env: left(env) > right(env),
+          lambda left, value: lambda env: left(env) > value,
+          lambda name, other: lambda env: env[name] > env[other],
+          lambda name, value: lambda env: env[name] > value),
+    ">=": (lambda left, right: lambda env: left(env) >= right(env),
+           lambda left, value: lambda env: left(env) >= value,
+           lambda name, other: lambda env: env[name] >= env[other],
+           lambda name, value: lambda env: env[name] >= value),
+}
+
+# A closure that tells whether condition holds. It only has to be true or
+# false, not 1 or 0, so comparisons are fused with the branch, and &&, ||
+# and ! become Python's and, or and not over conditions.
+def compile_condition(node):
+    t = node["type"] if type(node) is dict else None
+    if t == "binary" and node["operator"] in compare_closures:
+        generic, constant_right, variables, variable_constant = compare_closures[node["operator"]]
+        left, right = node["left"], node["right"]
+        constant = type(right) in [float, int]
+        if is_variable(left) and constant:
+            return variable_constant(left["name"], right)
+        if is_variable(left) and is_variable(right):
+            return variables(left["name"], right["name"])
+        if constant:
+            return constant_right(compile_closures(left), right)
+        return generic(compile_closures(left), compile_closures(right))
+    if t == "logical":
+        left = compile_condition(node["left"])
+        right = compile_condition(node["right"])
+        if node["operator"] == "&&":
+            return lambda env: left(env) and right(env)
+        if node["operator"] == "||":
+            return lambda env: left(env) or right(env)
+    if t == "unary" and node["operator"] == "!":
+        expression = compile_condition(node["expression"])
+        return lambda env: not expression(env)
+    return compile_closures(node)
+
+def compile_logical(node):
+    op = node["operator"]
+    left = compile_condition(node["left"])
+    right = compile_condition(node["right"])
+    if op == "&&":
+        return lambda env: 1 if left(env) and right(env) else 0
+    if op == "||":
+        return lambda env: 1 if left(env) or right(env) else 0
+    raise Exception(f"Unknown logical operator {op}")
+
+def compile_unary(node):
+    op = node["operator"]
+    assert op in unary_operations
+    expression = compile_closures(node["expression"])
+    if op == "-":
+        return lambda env: -expression(env)
+    operation = unary_operations[op]
+    return lambda env: operation(expression(env))
+
+node_compilers = {
+    "program": compile_program,
+    "block": compile_statements,
+    "print": compile_print,
+    "if": compile_if,
+    "while": compile_while,
+    "assignment": compile_assignment,
+    "identifier": compile_identifier,
+    "binary": compile_binary,
+    "unary": compile_unary,
+    "logical": compile_logical,
+}
+
+# Compile and run a node against the evaluator's environment, giving the same
+# result as evaluate(node).
+def evaluate_compiled(node):
+    return compile_closures(node)(evaluator.environment)
+
+from tokenizer import tokenize
+from parser import parse
+from evaluator import run_captured
+from inference import infer
+
+def test_compiled_matches_evaluate():
+    print("testing compiled closures against evaluate")
+    with open("example.t") as f:
+        source = f.read()
+    for program in [
+        source,
+        "print 1+2*3-4/2;",
+        "print -2-2; print -(2-2); print -(2)-(2);",
+        "x = 23; x = x - 1; x = x - 1; y = x; x = x - 1 + y;",
+        "if (0) {j=1; k=2;} else {j=0; k=1;}",
+        "if (0) j = 1;",
+        "k = 3; s = 0; while (k) { s = s + k * 2; k = k - 1; }",
+        "k = 0; while (k) k = k - 1;",
+        "i = 0; n = 5; s = 0; while (i < n) { if (i >= 2 && !(i == 3) || s > 100) s = s + i; i = i + 1; }",
+        "x = 2.5; print x == 2.5; print x != x; print (x < 3) + (x <= 2) * 2 + !x;",
+        "x = 1; print 0 && 1 / 0; print 1 || q; if (!(2 > 3) && (1 || q)) print 7; if (x * 2 > 1 || q) print 8;",
+        "a = 1; b = 2; if (a < b) print 1; if (a >= b) print 2; else print 3; if (a + 1 == b) print 4;",
+    ]:
+        expected = run_captured(evaluator.evaluate, program)
+        assert run_captured(evaluate_compiled, program) == expected, program
+        typed = run_captured(lambda ast: evaluate_compiled(infer(ast)), program)
+        assert typed == expected, program
+
+def test_compiled_trace_events():
+    print("testing compiled closures trace events")
+    from tracing import EventBuffer, traced
+    for program in ["k = 2; while (k) k = k - 1; if (k) print 1; else print 2;",
+                    "k = 0; while (k < 2) k = k + 1; if (k == 2) print 1; if (k > 2 || 0) print 2;"]:
+        with traced(EventBuffer()) as expected:
+            evaluator.evaluate(parse(tokenize(program)))
+        with traced(EventBuffer()) as events:
+            evaluate_compiled(parse(tokenize(program)))
+        assert events.events == expected.events
+
+def test_compiled_values():
+    print("testing compiled closure values")
+    assert compile_closures({"type":"binary", "operator":"-", "left":9, "right":2})({}) == 7
+    assert compile_closures({"type":"unary", "operator":"-", "expression":4})({}) == -4
+    assert compile_closures({"type":"identifier", "name":"x"})({"x": 5}) == 5
+
+def test_unknown_node():
+    print("testing unknown node")
+    try:
+        compile_closures({"type": "nonsense"})
+    except Exception as e:
+        assert "Unknown content" in str(e)
+    else:
+        assert False, "Expected an exception"
+
+if __name__ == "__main__":
+    test_compiled_matches_evaluate()
+    test_compiled_trace_events()
+    test_compiled_values()
+    test_unknown_node()
+    print("done")
@@ -1,111 +1,289 @@
+import operator
+
+from output import StandardOutput
+import closed_form
+
 # binary operation dictionary
 binary_operations = {
     "+": lambda x, y: x + y,
     "-": lambda x, y: x - y,
     "*": lambda x, y: x * y,
     "/": lambda x, y: x / y,
+    # comparisons, and the logical operators below, give 1 for true and 0
+    # for false
+    "==": lambda x, y: 1 if x == y else 0,
+    "!=": lambda x, y: 1 if x != y else 0,
+    "<": lambda x, y: 1 if x < y else 0,
+    "<=": lambda x, y: 1 if x <= y else 0,
+    ">": lambda x, y: 1 if x > y else 0,
+    ">=": lambda x, y: 1 if x >= y else 0,
 }
 
-def evaluate_binary_operation(op, x, y):
-    assert op in binary_operations
-    x = evaluate(x)
-    y = evaluate(y)
-    return binary_operations[op](x,y)
-
 unary_operations = {
     "-": lambda x: -x,
+    "!": lambda x: 0 if x else 1,
 }
 
-def evaluate_unary_operation(op, x):
-    assert op in unary_operations
-    x = evaluate(x)
-    return unary_operations[op](x)
+# The comparisons as C functions giving True or False. An if or while whose
+# condition is a comparison branches on these directly, without making the
+# 1 or 0 a comparison has as a value.
+comparisons = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+# The arithmetic as C functions, for the nodes inference.py has typed.
+typed_operations = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+}
+for op in comparisons:
+    typed_operations[op] = binary_operations[op]
 
 environment = {}
 
-def evaluate_assignment(name, x):
-    x = evaluate(x)
-    environment[name] = x
-    print(environment)
-    return x
-
-def evaluate_print(x):
-    x = evaluate(x)
-    print(x)
-    return x
-
-def evaluate_if(condition, then_statement, else_statement):
-    if evaluate(condition):
-        return evaluate(then_statement)
-    else:
-        if else_statement:
-            return evaluate(else_statement)
+# Tracing hook, off by default. When it is set, it is called as
+# trace(event, subject, value) for these events:
+#   "assignment"  subject is the variable name, value is the new value
+#   "print"       subject is None, value is the printed value
+#   "branch"      subject is "if" or "while", value is True if the branch was taken
+# tracing.py has ready-made sinks, including the old environment printout.
+trace = None
+
+def set_trace(hook):
+    global trace
+    trace = hook
+
+# Where print statements send their values; see output.py for the sinks.
+output = StandardOutput()
+
+def set_output(sink):
+    global output
+    output = sink
+
+# Execution budget, none by default; see budget.py. It is charged once per
+# loop iteration.
+budget = None
+
+def set_budget(limits):
+    global budget
+    budget = limits
+
+# An Evaluator walks the AST with its own environment, output sink and trace
+# hook, so separate evaluators can run at the same time in different threads.
+# Counting loops that closed_form.py can solve are run in one step, unless
+# there is a trace hook or a budget, which need every iteration, or a
+# subclass that watches every iteration sets solves_loops to False.
+class Evaluator:
+    solves_loops = True
+
+    def __init__(self, environment=None, output=None, trace=None, budget=None):
+        self.environment = {} if environment is None else environment
+        self.output = StandardOutput() if output is None else output
+        self.trace = trace
+        self.budget = budget
+        # id(while node) -> (node, its closed-form plan or None), for the
+        # program running now; emptied when it finishes so that a long-lived
+        # evaluator does not keep every program it ran alive
+        self.plans = {}
+
+    def run_closed_form(self, node):
+        entry = self.plans.get(id(node))
+        if entry is None:
+            entry = self.plans[id(node)] = (node, closed_form.analyze(node))
+        plan = entry[1]
+        if plan is None:
+            return False, None
+        return closed_form.run(plan, self.environment)
+
+    def evaluate_binary_operation(self, op, x, y):
+        assert op in binary_operations
+        x = self.evaluate(x)
+        y = self.evaluate(y)
+        return binary_operations[op](x,y)
+
+    # A binary node with a "value_type" is arithmetic on numbers that
+    # inference.py has checked, so it skips the generic path: operands that are
+    # variables or literals are read here rather than through evaluate(), and
+    # the operator is applied by a C function instead of a lambda.
+    def evaluate_typed_binary_operation(self, op, x, y):
+        if type(x) is dict:
+            x = self.environment[x["name"]] if x["type"] == "identifier" else self.evaluate(x)
+        if type(y) is dict:
+            y = self.environment[y["name"]] if y["type"] == "identifier" else self.evaluate(y)
+        return typed_operations[op](x, y)
+
+    def evaluate_unary_operation(self, op, x):
+        assert op in unary_operations
+        x = self.evaluate(x)
+        return unary_operations[op](x)
+
+    # && and || only evaluate their right operand when the left one leaves
+    # the result open.
+    def evaluate_logical_operation(self, op, x, y):
+        x = self.evaluate(x)
+        if op == "&&":
+            return 1 if x and self.evaluate(y) else 0
+        if op == "||":
+            return 1 if x or self.evaluate(y) else 0
+        raise Exception(f"Unknown logical operator {op}")
+
+    # Whether condition holds. A comparison is a fused compare-and-branch:
+    # its operands are compared and the answer used as it is, never turned
+    # into 1 or 0.
+    def evaluate_condition(self, condition):
+        if type(condition) is dict and condition["type"] == "binary" and condition["operator"] in comparisons:
+            return comparisons[condition["operator"]](
+                self.evaluate(condition["left"]), self.evaluate(condition["right"]))
+        return self.evaluate(condition)
+
+    def evaluate_assignment(self, name, x):
+        x = self.evaluate(x)
+        self.environment[name] = x
+        if self.trace is not None:
+            self.trace("assignment", name, x)
+        return x
+
+    def evaluate_print(self, x):
+        x = self.evaluate(x)
+        self.output.write(x)
+        if self.trace is not None:
+            self.trace("print", None, x)
+        return x
+
+    def evaluate_if(self, condition, then_statement, else_statement):
+        taken = self.evaluate_condition(condition)
+        if self.trace is not None:
+            self.trace("branch", "if", bool(taken))
+        if taken:
+            return self.evaluate(then_statement)
         else:
-            return None
+            if else_statement:
+                return self.evaluate(else_statement)
+            else:
+                return None
+
+    def evaluate_while(self, condition, do_statement):
+        result = None
+        budget = self.budget
+        compare = None
+        if type(condition) is dict and condition["type"] == "binary":
+            compare = comparisons.get(condition["operator"])
+        while True:
+            if compare is not None:
+                taken = compare(self.evaluate(condition["left"]), self.evaluate(condition["right"]))
+            else:
+                taken = self.evaluate(condition)
+            if self.trace is not None:
+                self.trace("branch", "while", bool(taken))
+            if not taken:
+                return result
+            if budget is not None:
+                budget.count += 1
+                if budget.count >= budget.next_check:
+                    budget.check(self.environment)
+            result = self.evaluate(do_statement)
+
+    def evaluate(self, node):
+        if type(node) is dict:
+            # op = node[0]
+            t = node["type"]
+
+            if t == "program":
+                most_recent_value = None
+                try:
+                    for statement in node["statements"]:
+                        most_recent_value = self.evaluate(statement)
+                finally:
+                    self.plans.clear()
+                return most_recent_value
+
+            if t == "block":
+                most_recent_value = None
+                for statement in node["statements"]:
+                    most_recent_value = self.evaluate(statement)
+                return most_recent_value
+
+            if t == "print":
+                return self.evaluate_print(node["expression"])
 
-def evaluate_while(condition, do_statement):
-    result = None
-    while evaluate(condition):
-        result = evaluate(do_statement)
-    return result
+            if t == "if":
+                return self.evaluate_if(
+                    node["condition"],
+                    node["then"],
+                    node["else"]
+                )
 
+            if t == "while":
+                if (closed_form.enabled and self.solves_loops
+                        and self.trace is None and self.budget is None):
+                    done, value = self.run_closed_form(node)
+                    if done:
+                        return value
+                return self.evaluate_while(
+                    node["condition"],
+                    node["do"]
+                )
+
+            if t == "binary":
+                if "value_type" in node:
+                    return self.evaluate_typed_binary_operation(
+                            node["operator"],
+                            node["left"],
+                            node["right"])
+                return self.evaluate_binary_operation(
+                        node["operator"], 
+                        node["left"], 
+                        node["right"])
+            if t == "logical":
+                return self.evaluate_logical_operation(
+                        node["operator"],
+                        node["left"],
+                        node["right"])
+            if t == "unary":
+                return self.evaluate_unary_operation(
+                        node["operator"], 
+                        node["expression"] 
+                )
+            if t == "assignment":
+                return self.evaluate_assignment(
+                        node["name"],
+                        node["expression"]
+                )
+            if t == "identifier":
+                name = node["name"]
+                return self.environment[name]
+        if type(node) in [float, int]:
+            return node
+        raise Exception(f"Unknown content in AST={node}")
+
+# The module-level evaluate() runs against the module's environment, output
+# sink, trace hook and budget above.
 def evaluate(node):
-    if type(node) is dict:
-        # op = node[0]
-        t = node["type"]
-
-        if t == "program":
-            for statement in node["statements"]:
-                most_recent_value = evaluate(statement)
-            return most_recent_value
-
-        if t == "block":
-            for statement in node["statements"]:
-                most_recent_value = evaluate(statement)
-            return most_recent_value
-
-        if t == "print":
-            return evaluate_print(node["expression"])
-
-        if t == "if":
-            return evaluate_if(
-                node["condition"],
-                node["then"],
-                node["else"]
-            )
-
-        if t == "while":
-            return evaluate_while(
-                node["condition"],
-                node["do"]
-            )
-
-        if t == "binary":
-            return evaluate_binary_operation(
-                    node["operator"], 
-                    node["left"], 
-                    node["right"])
-        if t == "unary":
-            return evaluate_unary_operation(
-                    node["operator"], 
-                    node["expression"] 
-            )
-        if t == "assignment":
-            return evaluate_assignment(
-                    node["name"],
-                    node["expression"]
-            )
-        if t == "identifier":
-            name = node["name"]
-            return environment[name]
-    if type(node) in [float, int]:
-        return node
-    raise Exception(f"Unknown content in AST={node}")
+    return Evaluator(environment, output, trace, budget).evaluate(node)
 
 from tokenizer import tokenize
 from parser import parse
 from pprint import pprint
 
+# Output, result and final environment of running source from an empty
+# environment with run, which is evaluate or another backend's equivalent.
+def run_captured(run, source):
+    import io
+    from contextlib import redirect_stdout
+    ast = parse(tokenize(source))
+    environment.clear()
+    output = io.StringIO()
+    with redirect_stdout(output):
+        result = run(ast)
+    return output.getvalue(), result, dict(environment)
+
 def test_evaluate_operations():
     print("test evaluate operations")
     assert evaluate({"type":"binary", "operator":"+", "left":1, "right":2}) == 3
@@ -183,6 +361,64 @@ def test_evaluate_while():
     print(evaluate(parse(tokens)))
     assert evaluate(parse(tokens)) == 0
 
+def test_output_sink():
+    from output import ListOutput
+    sink = ListOutput()
+    set_output(sink)
+    try:
+        evaluate(parse(tokenize("k = 2; while (k) { print k; k = k - 1; }")))
+    finally:
+        set_output(StandardOutput())
+    assert sink.values == [2, 1] and type(sink.values[0]) is int
+
+def test_trace_events():
+    events = []
+    set_trace(lambda event, subject, value: events.append((event, subject, value)))
+    try:
+        evaluate(parse(tokenize("k = 1; while (k) k = k - 1; if (k) print 1; else print 2;")))
+    finally:
+        set_trace(None)
+    assert events == [
+        ("assignment", "k", 1.0),
+        ("branch", "while", True),
+        ("assignment", "k", 0.0),
+        ("branch", "while", False),
+        ("branch", "if", False),
+        ("print", None, 2.0),
+    ]
+
+def test_integer_arithmetic():
+    print("testing exact integer arithmetic")
+    # 25! is past 2**53, where floats lose digits
+    environment.clear()
+    assert evaluate(parse(tokenize("n = 25; f = 1; while (n) { f = f * n; n = n - 1; }"))) == 0
+    assert environment["f"] == 15511210043330985984000000
+    assert evaluate(parse(tokenize("x = 7 / 2; y = 7 - 2.0;"))) == 5.0
+    assert type(environment["x"]) is float and type(environment["y"]) is float
+
+def test_typed_nodes():
+    print("testing typed nodes")
+    from inference import infer
+    program = "k = 4; s = 1; while (k) { s = s * 2 + k / 2; t = -k * 3; k = k - 1; } print s + t;"
+    ast = parse(tokenize(program))
+    assert infer(ast) != ast
+    assert run_captured(lambda ast: evaluate(infer(ast)), program) == run_captured(evaluate, program)
+
+def test_comparisons_and_logic():
+    print("testing comparisons and logical operators")
+    environment.clear()
+    program = "a = 2 < 3; b = 2.5 >= 3; c = 1 == 1.0; d = !a + !0 * 2; e = 1 != 2 && 3 > 2 || 0;"
+    evaluate(parse(tokenize(program)))
+    assert environment == {"a": 1, "b": 0, "c": 1, "d": 2, "e": 1}
+    assert all(type(value) is int for value in environment.values())
+    # the right operand only runs when it is needed
+    assert evaluate(parse(tokenize("x = 0 && 1 / 0; y = 1 || undefined;"))) == 1
+    assert environment["x"] == 0
+    # a loop and a branch on comparisons
+    environment.clear()
+    evaluate(parse(tokenize("i = 0; s = 0; while (i < 10) { if (i >= 5 && i != 7) s = s + i; i = i + 1; }")))
+    assert environment == {"i": 10, "s": 5 + 6 + 8 + 9}
+
 if __name__ == "__main__":
     # test_evaluate_operations()
     # test_evaluate_print()
@@ -191,4 +427,9 @@ if __name__ == "__main__":
     # test_evaluate_if()
     # test_mutable_environment()
     test_evaluate_while()
+    test_trace_events()
+    test_output_sink()
+    test_integer_arithmetic()
+    test_typed_nodes()
+    test_comparisons_and_logic()
 
@@ -0,0 +1,240 @@
+import sys
+from array import array
+from bisect import bisect_right
+from itertools import chain
+
+import parser
+from parser import parse
+from tokenizer import master_pattern, number
+from token_table import TokenTable, scan_table, group_kinds, IDENTIFIER, NUMBER, STRING, ERROR
+
+# An incremental front end for an editor-style workflow. A Document holds the
+# source, its tokens and its top-level statements, and applies edits: replace
+# `deleted` characters at offset with `inserted`.
+#
+# Only the top-level statements around an edit are looked at again. Starting
+# from the statement before the one that holds the edit (an if statement
+# looks one token ahead for 'else', and a token just before the edit can
+# grow into it), the new text is re-lexed until a token starts where an old
+# statement used to start, past the edit. From there on the text, and so the
+# tokens and statements, are the same as before. The re-lexed tokens are
+# parsed on their own; if they do not make whole statements (say a '{' was
+# typed) the region is doubled and tried again. Every statement outside the
+# region is kept as the very same object, so later passes can tell what
+# changed.
+#
+# Token offsets are not kept, only the character offset and token index of
+# each top-level statement, so an edit costs one pass over the statement
+# list plus the work for the statements it touches.
+
+class Document:
+    def __init__(self, source):
+        table = scan_table(source)
+        self.source = source
+        self.kinds = table.kinds
+        self.values = table.values
+        self.statements = []
+        # character offset and token index where each statement starts
+        self.statement_offsets = array("I")
+        self.statement_tokens = array("I")
+        for start, statement in parse_from(table):
+            self.statement_offsets.append(table.starts[start])
+            self.statement_tokens.append(start)
+            self.statements.append(statement)
+
+    @property
+    def ast(self):
+        return {"type": "program", "statements": self.statements}
+
+    # If the new text does not parse, the exception propagates and the
+    # document is unchanged.
+    def edit(self, offset, deleted, inserted):
+        source = self.source[:offset] + inserted + self.source[offset + deleted:]
+        delta = len(inserted) - deleted
+        offsets = self.statement_offsets
+        count = len(offsets)
+
+        # statements k up to, but not including, j are re-lexed and re-parsed
+        k = max(bisect_right(offsets, offset) - 2, 0)
+        j = bisect_right(offsets, offset + deleted)
+        region = TokenTable()
+        matches = master_pattern.finditer(source, offsets[k] if k else 0)
+        while True:
+            j, pending = lex_region(region, matches, offsets, j, delta)
+            try:
+                region_starts = []
+                region_statements = []
+                for start, statement in parse_from(region):
+                    region_starts.append(start)
+                    region_statements.append(statement)
+                break
+            except Exception:
+                if j == count:
+                    raise
+                j = min(j + max(j - k, 1), count)
+                matches = chain([pending], matches)
+
+        # Everything parsed, so commit the new state.
+        # an empty document has no statement k; its tokens start at the end
+        first_token = self.statement_tokens[k] if k < count else len(self.kinds)
+        last_token = self.statement_tokens[j] if j < count else len(self.kinds)
+        token_delta = len(region) - (last_token - first_token)
+        self.source = source
+        self.kinds[first_token:last_token] = region.kinds
+        self.values[first_token:last_token] = region.values
+        self.statements[k:j] = region_statements
+        self.statement_offsets = (offsets[:k]
+                                  + array("I", [region.starts[i] for i in region_starts])
+                                  + array("I", map(delta.__add__, offsets[j:])))
+        tokens = self.statement_tokens
+        self.statement_tokens = (tokens[:k]
+                                 + array("I", [first_token + i for i in region_starts])
+                                 + array("I", map(token_delta.__add__, tokens[j:])))
+
+# Add tokens from matches to region until one starts where an old statement,
+# j or a later one, started, moved by delta. Returns that statement and its
+# first match, which is not added in case the region has to grow past it, or
+# the statement count and None when the text runs out first.
+def lex_region(region, matches, offsets, j, delta):
+    for match in matches:
+        kind = group_kinds[match.lastgroup]
+        if kind is None:
+            continue
+        start = match.start()
+        while j < len(offsets) and offsets[j] + delta < start:
+            j += 1
+        if j < len(offsets) and offsets[j] + delta == start:
+            return j, match
+        if kind == IDENTIFIER:
+            region.values.append(sys.intern(match.group()))
+        elif kind == NUMBER:
+            region.values.append(number(match.group()))
+        elif kind == STRING:
+            region.values.append(match.group()[1:-1].replace('""', '"'))
+        elif kind == ERROR:
+            raise AssertionError("Syntax error: illegal character at " + match.group())
+        else:
+            region.values.append(None)
+        region.kinds.append(kind)
+        region.starts.append(start)
+        region.ends.append(match.end())
+    return len(offsets), None
+
+# (start token index, statement) for each top-level statement in the table.
+def parse_from(table):
+    table_parser = parser.Parser()
+    start = 0
+    for statement in table_parser.parse_statements(table):
+        yield start, statement
+        start = table_parser.current_token_index
+
+def check_edit(source, offset, deleted, inserted):
+    document = Document(source)
+    document.edit(offset, deleted, inserted)
+    expected_source = source[:offset] + inserted + source[offset + deleted:]
+    assert document.source == expected_source
+    expected = scan_table(expected_source)
+    assert document.kinds == expected.kinds, (source, offset, inserted)
+    assert document.values == expected.values
+    assert document.ast == parse(expected), (source, offset, inserted)
+    fresh = Document(expected_source)
+    assert document.statement_offsets == fresh.statement_offsets
+    assert document.statement_tokens == fresh.statement_tokens
+    return document
+
+def test_edits_match_full_parse():
+    print("testing incremental edits against a full parse")
+    with open("example.t") as f:
+        source = f.read()
+    for offset, deleted, inserted in [
+        (0, 0, "x = 1; "),              # insert a statement at the start
+        (len(source), 0, "print 5;"),   # append a statement
+        (6, 1, "4"),                    # change a digit
+        (source.index("x = 4"), 1, "xyz"),  # grow an identifier
+        (source.index("print 1;"), 8, ""),  # delete a whole statement
+        (source.index("if (1)"), 0, "if (0) print 2; else "),  # statement in front of an if
+        (source.index("k = 10"), 0, "  \n  "),  # whitespace only
+        (source.index("k = k - 1"), 9, "k = k - 2"),  # inside a loop body
+    ]:
+        check_edit(source, offset, deleted, inserted)
+
+def test_else_lookahead():
+    print("testing an edit that adds an else to the previous statement")
+    document = check_edit("if (x) print 1; print 2; print 3;", 16, 0, "else ")
+    assert document.ast["statements"][0]["else"] == {"type": "print", "expression": 2}
+
+def test_token_merging():
+    print("testing edits that merge and split tokens")
+    check_edit("x = a * b; print 1;", 5, 3, "")  # 'a * b' becomes 'ab'
+    check_edit("x = ab; print 1;", 5, 0, " + ")  # 'ab' splits into 'a + b'
+    check_edit("x = 12; print 1;", 5, 0, ".5")   # '12' grows into '1.52'
+    check_edit("x = 1; y = 2;", 0, 0, "z = 3;")
+
+def test_unchanged_statements_are_reused():
+    print("testing unchanged statements are reused")
+    source = "a = 1;\nb = 2;\nc = 3;\nd = 4;\n"
+    document = Document(source)
+    before = list(document.statements)
+    document.edit(source.index("3"), 1, "33")
+    after = document.statements
+    assert after[0] is before[0] and after[3] is before[3]
+    assert after[2] == {"type": "assignment", "name": "c", "expression": 33}
+
+def test_random_edits():
+    print("testing random single character edits")
+    import random
+    generator = random.Random(5)
+    with open("example.t") as f:
+        source = f.read()
+    checked = 0
+    for _ in range(500):
+        offset = generator.randrange(len(source) + 1)
+        deleted = generator.choice([0, 1])
+        inserted = generator.choice(["", " ", "1", "x", ";", "}", "-", "(", "\n"])
+        deleted = min(deleted, len(source) - offset)
+        edited = source[:offset] + inserted + source[offset + deleted:]
+        try:
+            parse(scan_table(edited))
+        except Exception:
+            # an edit that breaks a full parse must fail incrementally too
+            document = Document(source)
+            try:
+                document.edit(offset, deleted, inserted)
+            except Exception:
+                continue
+            assert False, edited
+        check_edit(source, offset, deleted, inserted)
+        checked += 1
+    assert checked > 100
+
+def test_empty_document():
+    print("testing edits to an empty document")
+    check_edit("", 0, 0, "x = 1;")
+    check_edit("  \n", 1, 0, "print 2;")
+    document = Document("x = 1; print x;")
+    document.edit(0, len(document.source), "")
+    assert document.statements == [] and len(document.kinds) == 0
+    document.edit(0, 0, "y = 2;")
+    assert document.ast == parse(scan_table("y = 2;"))
+
+def test_failed_edit_leaves_document_unchanged():
+    print("testing a failed edit")
+    document = Document("x = 1; y = 2;")
+    try:
+        document.edit(2, 1, "")
+    except Exception:
+        pass
+    else:
+        assert False, "Expected a syntax error"
+    assert document.source == "x = 1; y = 2;"
+    assert document.ast == parse(scan_table("x = 1; y = 2;"))
+
+if __name__ == "__main__":
+    test_edits_match_full_parse()
+    test_else_lookahead()
+    test_token_merging()
+    test_unchanged_statements_are_reused()
+    test_random_edits()
+    test_empty_document()
+    test_failed_edit_leaves_document_unchanged()
+    print("done")
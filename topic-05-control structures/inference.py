@@ -0,0 +1,224 @@
+# Type inference for the AST: which expressions are proven to give an int,
+# and which a float.
+#
+# Number literals keep the type they were written with, so 3 is an int and
+# 3.0 or 2.5 a float, and arithmetic follows Python: +, - and * give an int
+# when both operands are ints and a float when either one is a float, / always
+# gives a float, and - keeps the type of its operand. Ints are exact at any
+# size. Comparisons, &&, || and ! always give the int 1 or 0.
+#
+# infer() walks the program in order, keeping the type each variable is known
+# to have at that point. A variable has no known type when the program reads
+# it before assigning it, or when it was given different types on different
+# paths: the two branches of an if, or the first and a later time round a
+# while. A while's body is gone over again until the types at its top stop
+# changing, which takes at most one more time round than there are variables
+# whose type it changes.
+#
+# It returns a new AST in which every binary, unary and identifier node whose
+# type is proven carries "value_type": "int" or "float". Nothing else is
+# changed, so an annotated AST runs on every backend exactly as the original
+# does. The optimizer uses the types to decide which identities are safe, and
+# the evaluator and the closure compiler take shorter paths for typed nodes.
+
+INT = "int"
+FLOAT = "float"
+
+# The type of an expression: the type of a literal, or the "value_type" of a
+# node, or None when it is not known.
+def value_type(node):
+    if type(node) is int:
+        return INT
+    if type(node) is float:
+        return FLOAT
+    if type(node) is dict:
+        return node.get("value_type")
+    return None
+
+def binary_type(op, left, right):
+    if op in ["==", "!=", "<", "<=", ">", ">="]:
+        return INT
+    if op == "/":
+        return FLOAT
+    if left == FLOAT or right == FLOAT:
+        return FLOAT
+    if left == INT and right == INT:
+        return INT
+    return None
+
+# The variables two paths agree on.
+def join(a, b):
+    return {name: t for name, t in a.items() if b.get(name) == t}
+
+class Inference:
+    def __init__(self):
+        # (id(while node), its starting types) -> (annotated node, types after)
+        # so that nested loops are only gone over once for each way in
+        self.loops = {}
+
+    # Returns the annotated statement and the variable types after it.
+    def statement(self, node, types):
+        t = node["type"] if type(node) is dict else None
+
+        if t == "program" or t == "block":
+            statements = []
+            for statement in node["statements"]:
+                statement, types = self.statement(statement, types)
+                statements.append(statement)
+            return {"type": t, "statements": statements}, types
+
+        if t == "if":
+            condition = self.expression(node["condition"], types)
+            then_statement, then_types = self.statement(node["then"], types)
+            else_statement, else_types = None, types
+            if node["else"]:
+                else_statement, else_types = self.statement(node["else"], types)
+            return {"type": "if",
+                "condition": condition,
+                "then": then_statement,
+                "else": else_statement,
+            }, join(then_types, else_types)
+
+        if t == "while":
+            key = (id(node), frozenset(types.items()))
+            if key not in self.loops:
+                self.loops[key] = self.loop(node, types)
+            return self.loops[key]
+
+        if t == "print":
+            annotated = dict(node)
+            annotated["expression"] = self.expression(node["expression"], types)
+            return annotated, types
+
+        if t == "assignment":
+            annotated = dict(node)
+            expression = annotated["expression"] = self.expression(node["expression"], types)
+            types = dict(types)
+            if value_type(expression) is None:
+                types.pop(node["name"], None)
+            else:
+                types[node["name"]] = value_type(expression)
+            return annotated, types
+
+        # a bare expression as a statement
+        return self.expression(node, types), types
+
+    def loop(self, node, types):
+        while True:
+            do_statement, after = self.statement(node["do"], types)
+            joined = join(types, after)
+            if joined == types:
+                break
+            types = joined
+        return {"type": "while",
+            "condition": self.expression(node["condition"], types),
+            "do": do_statement,
+        }, types
+
+    def expression(self, node, types):
+        if type(node) is not dict:
+            return node
+        annotated = dict(node)
+        t = node["type"]
+        if t == "identifier":
+            result = types.get(node["name"])
+        elif t == "binary":
+            left = annotated["left"] = self.expression(node["left"], types)
+            right = annotated["right"] = self.expression(node["right"], types)
+            result = binary_type(node["operator"], value_type(left), value_type(right))
+        elif t == "logical":
+            annotated["left"] = self.expression(node["left"], types)
+            annotated["right"] = self.expression(node["right"], types)
+            result = INT
+        elif t == "unary":
+            expression = annotated["expression"] = self.expression(node["expression"], types)
+            result = INT if node["operator"] == "!" else value_type(expression)
+        else:
+            raise Exception(f"Unknown content in AST={node}")
+        annotated.pop("value_type", None)
+        if result is not None:
+            annotated["value_type"] = result
+        return annotated
+
+# Annotate ast with the types of its expressions. Given the environment the
+# program will start from, the variables already in it have the types of
+# their values; otherwise nothing is assumed about them.
+def infer(ast, environment=None):
+    types = {}
+    for name, value in (environment or {}).items():
+        if value_type(value) is not None:
+            types[name] = value_type(value)
+    return Inference().statement(ast, types)[0]
+
+from tokenizer import tokenize
+from parser import parse
+
+# The types of the expressions in the last statement of source, outermost
+# first.
+def last_statement_types(source, environment=None):
+    statement = infer(parse(tokenize(source)), environment)["statements"][-1]
+    node = statement.get("expression", statement.get("condition"))
+    types = []
+    while node is not None:
+        types.append(value_type(node))
+        node = node.get("left", node.get("expression")) if type(node) is dict else None
+    return types
+
+def test_literals_and_operators():
+    print("testing literal and operator types")
+    assert last_statement_types("print 2 * 3 + 1;") == [INT, INT, INT]
+    assert last_statement_types("print 2.0 * 3 + 1;") == [FLOAT, FLOAT, FLOAT]
+    assert last_statement_types("print 2 * 3 + 1.0;") == [FLOAT, INT, INT]
+    assert last_statement_types("print 4 / 2 - 1;") == [FLOAT, FLOAT, INT]
+    assert last_statement_types("print -(1 - 2);") == [INT, INT, INT]
+    # a float makes the result a float whatever x is
+    assert last_statement_types("print x * 1.5;") == [FLOAT, None]
+    assert last_statement_types("print x * 2;") == [None, None]
+    assert last_statement_types("print x < 2.5;") == [INT, None]
+    assert last_statement_types("print x && y;") == [INT, None]
+    assert last_statement_types("print !x;") == [INT, None]
+
+def test_variables():
+    print("testing variable types")
+    assert last_statement_types("x = 2; y = x * 3; print y;") == [INT]
+    assert last_statement_types("x = 2; x = x / 2; print x;") == [FLOAT]
+    assert last_statement_types("print x;", {"x": 2.5}) == [FLOAT]
+    # both branches of an if have to agree
+    assert last_statement_types("if (c) x = 1; else x = 2; print x;") == [INT]
+    assert last_statement_types("if (c) x = 1; else x = 2.0; print x;") == [None]
+    assert last_statement_types("x = 1.0; if (c) x = 2; print x;") == [None]
+
+def test_loops():
+    print("testing types round loops")
+    assert last_statement_types("k = 3; s = 0; while (k) { s = s + k; k = k - 1; } print s;") == [INT]
+    # s becomes a float the second time round
+    source = "k = 3; s = 0; while (k) { print s; s = s / 2; k = k - 1; }"
+    body = infer(parse(tokenize(source)))["statements"][-1]["do"]
+    assert value_type(body["statements"][0]["expression"]) is None
+    assert value_type(body["statements"][2]["expression"]) == INT
+    # nested loops
+    source = ("i = 3; t = 0; while (i) { j = i; while (j) { t = t + j * 0.5; j = j - 1; } i = i - 1; }"
+              "print t;")
+    assert last_statement_types(source) == [None]
+    assert last_statement_types(source.replace("t = 0;", "t = 0.0;")) == [FLOAT]
+
+def test_annotation():
+    print("testing annotated ASTs")
+    from evaluator import run_captured, evaluate
+    with open("example.t") as f:
+        source = f.read()
+    ast = parse(tokenize(source))
+    annotated = infer(ast)
+    assert annotated != ast and ast == parse(tokenize(source))
+    # inferring again gives the same annotations
+    assert infer(annotated) == annotated
+    assert infer(annotated, {"x": 1.5}) == infer(ast, {"x": 1.5})
+    for program in [source, "k = 3; s = 0; while (k) { s = s + k / 2; k = k - 1; } print s;"]:
+        assert run_captured(lambda ast: evaluate(infer(ast)), program) == run_captured(evaluate, program)
+
+if __name__ == "__main__":
+    test_literals_and_operators()
+    test_variables()
+    test_loops()
+    test_annotation()
+    print("done")
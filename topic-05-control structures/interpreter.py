@@ -0,0 +1,112 @@
+from token_table import scan_table
+from parser import Parser
+from evaluator import Evaluator
+
+# An interpreter that owns all of its state: a parser with its own cursor and
+# an evaluator with its own environment, output sink, trace hook and budget.
+# Nothing is shared with the module-level parse() and evaluate(), or with any
+# other Interpreter, so separate interpreters can parse and run programs at
+# the same time in different threads. An interpreter holds no references to
+# itself, so it and everything it parsed and computed are freed as soon as it
+# is dropped.
+
+class Interpreter:
+    def __init__(self, output=None, trace=None, iterative=False, budget=None):
+        self.parser = Parser()
+        self.evaluator = Evaluator({}, output, trace, budget)
+        self.iterative = iterative
+
+    @property
+    def environment(self):
+        return self.evaluator.environment
+
+    def parse(self, source):
+        return self.parser.parse(scan_table(source), self.iterative)
+
+    def evaluate(self, ast):
+        return self.evaluator.evaluate(ast)
+
+    # Parse and run source, returning the value of its last statement. Each
+    # run gets the whole of the budget, if there is one.
+    def run(self, source):
+        ast = self.parse(source)
+        if self.evaluator.budget is not None:
+            self.evaluator.budget.reset()
+        return self.evaluate(ast)
+
+from output import ListOutput
+import evaluator
+
+def test_separate_environments():
+    print("testing separate environments")
+    evaluator.environment.clear()
+    first, second = Interpreter(ListOutput()), Interpreter(ListOutput())
+    first.run("x = 1; print x;")
+    second.run("x = 2;")
+    assert first.run("x = x + 10; print x;") == 11
+    assert first.environment == {"x": 11}
+    assert second.environment == {"x": 2}
+    assert first.evaluator.output.values == [1, 11]
+    assert second.evaluator.output.values == []
+    assert evaluator.environment == {}
+
+def test_interleaved_parsing():
+    print("testing interleaved parsing")
+    first, second = Parser(), Parser()
+    statements = first.parse_statements(scan_table("a = 1; b = 2; c = 3;"))
+    assert next(statements)["name"] == "a"
+    assert second.parse(scan_table("print 5;"))["statements"] == [
+        {"type": "print", "expression": 5.0}]
+    assert [statement["name"] for statement in statements] == ["b", "c"]
+
+def test_threads():
+    print("testing interpreters on a thread pool")
+    from concurrent.futures import ThreadPoolExecutor
+    def run(n):
+        interpreter = Interpreter(ListOutput())
+        interpreter.run(f"k = {n}; s = 0; while (k) {{ s = s + k; k = k - 1; print s; }}")
+        return interpreter.environment["s"], len(interpreter.evaluator.output.values)
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(run, range(200, 232)))
+    assert results == [(n * (n + 1) / 2, n) for n in range(200, 232)]
+
+def test_budget_per_run():
+    print("testing a budget for each run")
+    from budget import Budget, BudgetExceeded
+    interpreter = Interpreter(ListOutput(), budget=Budget(iterations=10))
+    for _ in range(3):
+        interpreter.run("k = 10; while (k) k = k - 1;")
+    try:
+        interpreter.run("k = 11; while (k) k = k - 1;")
+    except BudgetExceeded:
+        pass
+    else:
+        assert False, "Expected BudgetExceeded"
+    assert interpreter.environment == {"k": 1}
+
+def test_dropped_interpreter_is_freed():
+    print("testing a dropped interpreter is freed")
+    import weakref
+    interpreter = Interpreter(ListOutput())
+    interpreter.run("x = 1; while (x) x = x - 1;")
+    references = [weakref.ref(interpreter), weakref.ref(interpreter.evaluator),
+                  weakref.ref(interpreter.parser)]
+    del interpreter
+    assert all(reference() is None for reference in references)
+
+def test_programs_are_not_kept():
+    print("testing an interpreter does not keep the programs it ran")
+    interpreter = Interpreter(ListOutput())
+    interpreter.run("k = 3; s = 0; while (k) { s = s + k; k = k - 1; }")
+    assert interpreter.environment == {"k": 0, "s": 6}
+    # the closed-form plan for the loop, which holds the loop's node, is gone
+    assert interpreter.evaluator.plans == {}
+
+if __name__ == "__main__":
+    test_separate_environments()
+    test_interleaved_parsing()
+    test_threads()
+    test_budget_per_run()
+    test_dropped_interpreter_is_freed()
+    test_programs_are_not_kept()
+    print("done")
@@ -0,0 +1,95 @@
+import argparse
+import asyncio
+import time
+
+from server import Server, submit
+
+# A load generator for server.py. Each of --connections clients sends its
+# share of --requests programs one after another on its own connection, and
+# the latency of every request is recorded, from sending the program until
+# its final message arrives.
+#
+#   python server.py --port 8765 &
+#   python loadgen.py --port 8765 --connections 16 --requests 2000
+#
+# Without --port or --unix a server is started in the same process.
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+# A loop that goes round `iterations` times. Summing squares keeps it out of
+# closed_form.py's reach, which would otherwise run it in one step whatever
+# the count.
+def default_program(iterations):
+    return (f"k = {iterations}; s = 0;\n"
+            f"while (k) {{ s = s + k * k; k = k - 1; }}\n"
+            f"print s;\n")
+
+async def client(open_connection, source, count, latencies, errors):
+    reader, writer = await open_connection()
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            _, final = await submit(reader, writer, source)
+            latencies.append(time.perf_counter() - start)
+            if "error" in final:
+                errors.append(final["error"])
+    finally:
+        writer.close()
+
+async def generate_load(args, source):
+    server = listener = None
+    if args.unix:
+        open_connection = lambda: asyncio.open_unix_connection(args.unix)
+    else:
+        port = args.port
+        if port is None:
+            server = Server(args.workers, args.limit)
+            listener = await server.serve_tcp(args.host, 0)
+            port = listener.sockets[0].getsockname()[1]
+        open_connection = lambda: asyncio.open_connection(args.host, port)
+    latencies = []
+    errors = []
+    shares = [args.requests // args.connections + (i < args.requests % args.connections)
+              for i in range(args.connections)]
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*[client(open_connection, source, share, latencies, errors)
+                               for share in shares])
+    finally:
+        elapsed = time.perf_counter() - start
+        if server:
+            listener.close()
+            await server.close()
+    print(f"{len(latencies)} requests on {args.connections} connections in {elapsed:.3f}s, "
+          f"{len(errors)} errors")
+    print(f"p50 {percentile(latencies, 0.50) * 1000:8.2f}ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:8.2f}ms  "
+          f"max {max(latencies) * 1000:8.2f}ms  "
+          f"{len(latencies) / elapsed:10.1f} requests/s")
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Load generator for server.py.")
+    argument_parser.add_argument("--host", default="127.0.0.1")
+    argument_parser.add_argument("--port", type=int, help="server port (default: start a server here)")
+    argument_parser.add_argument("--unix", help="server Unix socket")
+    argument_parser.add_argument("--connections", type=int, default=8)
+    argument_parser.add_argument("--requests", type=int, default=1000)
+    argument_parser.add_argument("--iterations", type=int, default=100,
+        help="loop iterations in the default program")
+    argument_parser.add_argument("--program", help="file whose program is sent instead")
+    argument_parser.add_argument("--workers", type=int, default=4,
+        help="workers for a server started here")
+    argument_parser.add_argument("--limit", type=int,
+        help="concurrency limit for a server started here")
+    args = argument_parser.parse_args()
+    if args.program:
+        with open(args.program) as f:
+            source = f.read()
+    else:
+        source = default_program(args.iterations)
+    asyncio.run(generate_load(args, source))
+
+if __name__ == "__main__":
+    main()
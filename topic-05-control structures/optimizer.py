@@ -0,0 +1,252 @@
+from evaluator import binary_operations, unary_operations
+from inference import infer, value_type, binary_type, INT, FLOAT
+
+# An optimisation pass between parse() and evaluate(). It returns a new AST
+# and leaves the one it was given alone.
+#
+# level 0  no changes
+# level 1  fold constant subtrees, such as 2*3-1 into 5 or 1<2 into 1, and
+#          && and || whose left operand decides them, and drop the if and
+#          while statements whose conditions are constant and false
+# level 2  also simplify -(-x), x*1, 1*x, x/1, x-0 and x+0 into x where that
+#          keeps x's value and type, and mark every expression whose type
+#          inference.py can prove
+#
+# Which identities hold depends on the type of x, so level 2 infers types
+# first. x*1, 1*x and x-0 with an int constant give x back whatever x is; with
+# 1.0 or 0.0 they only do when x is a float, since they turn an int into a
+# float. x/1 always gives a float, so it only becomes x when x is a float. x+0
+# only becomes x when x is an int: when x is -0.0 the sum is 0.0, which prints
+# differently. Division by a constant zero is left for the evaluator to report
+# when, and if, it actually runs.
+#
+# A statement list can come out shorter, so the value a program returns to
+# its caller can change, but everything it prints and assigns stays the same.
+
+def optimize(ast, level=2):
+    if level <= 0:
+        return ast
+    if level >= 2:
+        ast = infer(ast)
+    ast = optimize_node(ast, level)
+    if level >= 2:
+        # with the dead branches gone, more of the types can be proven
+        ast = infer(ast)
+    return ast
+
+def is_constant(node):
+    return type(node) in [float, int]
+
+def empty_block():
+    return {"type": "block", "statements": []}
+
+# Optimize a node. None means a statement that can be dropped.
+def optimize_node(node, level):
+    if type(node) is not dict:
+        return node
+    t = node["type"]
+
+    if t == "program" or t == "block":
+        statements = []
+        for statement in node["statements"]:
+            statement = optimize_node(statement, level)
+            if statement is not None:
+                statements.append(statement)
+        return {"type": t, "statements": statements}
+
+    if t == "if":
+        condition = optimize_node(node["condition"], level)
+        then_statement = optimize_node(node["then"], level)
+        else_statement = optimize_node(node["else"], level) if node["else"] else None
+        if is_constant(condition):
+            return then_statement if condition else else_statement
+        return {"type": "if",
+            "condition": condition,
+            "then": then_statement or empty_block(),
+            "else": else_statement,
+        }
+
+    if t == "while":
+        condition = optimize_node(node["condition"], level)
+        if is_constant(condition) and not condition:
+            return None
+        return {"type": "while",
+            "condition": condition,
+            "do": optimize_node(node["do"], level) or empty_block(),
+        }
+
+    if t == "print" or t == "assignment":
+        optimized = dict(node)
+        optimized["expression"] = optimize_node(node["expression"], level)
+        return optimized
+
+    if t == "binary":
+        return optimize_binary(node["operator"],
+                               optimize_node(node["left"], level),
+                               optimize_node(node["right"], level),
+                               level)
+
+    if t == "logical":
+        return optimize_logical(node["operator"],
+                                optimize_node(node["left"], level),
+                                optimize_node(node["right"], level),
+                                level)
+
+    if t == "unary":
+        return optimize_unary(node["operator"],
+                              optimize_node(node["expression"], level),
+                              level)
+
+    return node
+
+def optimize_binary(op, left, right, level):
+    if is_constant(left) and is_constant(right):
+        try:
+            return binary_operations[op](left, right)
+        except (ZeroDivisionError, OverflowError):
+            # left for the program to raise, if it ever runs this
+            pass
+    if level >= 2:
+        if op == "*" and is_constant(right) and right == 1 and keeps_type(left, right):
+            return left
+        if op == "*" and is_constant(left) and left == 1 and keeps_type(right, left):
+            return right
+        if op == "/" and is_constant(right) and right == 1 and value_type(left) == FLOAT:
+            return left
+        if op == "-" and is_constant(right) and right == 0 and keeps_type(left, right):
+            return left
+        if (op == "+" and is_constant(right) and right == 0
+                and type(right) is int and value_type(left) == INT):
+            return left
+        if (op == "+" and is_constant(left) and left == 0
+                and type(left) is int and value_type(right) == INT):
+            return right
+        return typed({"type": "binary", "left": left, "operator": op, "right": right},
+                     binary_type(op, value_type(left), value_type(right)))
+    return {"type": "binary", "left": left, "operator": op, "right": right}
+
+# A constant left operand decides 0 && x and 1 || x without x; otherwise,
+# only once both sides are constant. A constant right operand cannot drop
+# the left one, which might fail when it runs.
+def optimize_logical(op, left, right, level):
+    if is_constant(left):
+        if op == "&&" and not left:
+            return 0
+        if op == "||" and left:
+            return 1
+        if is_constant(right):
+            return 1 if right else 0
+    node = {"type": "logical", "left": left, "operator": op, "right": right}
+    return typed(node, INT) if level >= 2 else node
+
+# Whether combining x with the constant gives a value of x's own type.
+def keeps_type(x, constant):
+    return type(constant) is int or value_type(x) == FLOAT
+
+def optimize_unary(op, expression, level):
+    if is_constant(expression):
+        return unary_operations[op](expression)
+    if (level >= 2 and op == "-" and type(expression) is dict
+            and expression["type"] == "unary" and expression["operator"] == "-"):
+        return expression["expression"]
+    node = {"type": "unary", "operator": op, "expression": expression}
+    return typed(node, value_type(expression)) if level >= 2 else node
+
+def typed(node, result):
+    if result is not None:
+        node["value_type"] = result
+    return node
+
+from tokenizer import tokenize
+from parser import parse
+from evaluator import evaluate, run_captured
+
+def optimized_at(level):
+    return lambda ast: evaluate(optimize(ast, level))
+
+def test_constant_folding():
+    print("testing constant folding")
+    ast = optimize(parse(tokenize("print 1+2*3; x = -(4-1) * y;")), 1)
+    assert ast == {"type": "program", "statements": [
+        {"type": "print", "expression": 7},
+        {"type": "assignment", "name": "x", "expression":
+            {"type": "binary", "left": -3, "operator": "*",
+             "right": {"type": "identifier", "name": "y"}}}]}
+
+def test_dead_branches():
+    print("testing dead branches")
+    ast = optimize(parse(tokenize(
+        "if (0) print 1; if (1-1) print 2; else print 3; while (2*0) x = 1; if (1) while (0) y = 2;")))
+    assert ast == {"type": "program", "statements": [{"type": "print", "expression": 3}]}
+    ast = optimize(parse(tokenize("if (x) while (0) y = 2;")))
+    assert ast["statements"][0]["then"] == {"type": "block", "statements": []}
+
+def test_simplification():
+    print("testing simplification")
+    x = {"type": "identifier", "name": "x"}
+    for source in ["print -(-x);", "print x*1;", "print 1*x;", "print x-0;", "print --x*(3-2);"]:
+        assert optimize(parse(tokenize(source)), 2)["statements"][0]["expression"] == x, source
+    assert optimize(parse(tokenize("print x+0;")), 2)["statements"][0]["expression"] != x
+    assert optimize(parse(tokenize("print x*1;")), 1)["statements"][0]["expression"] != x
+    # identities that depend on the type of x
+    float_x = dict(x, value_type="float")
+    int_x = dict(x, value_type="int")
+    for source, simplified in [
+        ("x = 1.5; print x/1;", float_x), ("x = 3; print x/1;", None),
+        ("x = 1.5; print x*1.0;", float_x), ("print x*1.0;", None),
+        ("x = 1.5; print 1.0*x;", float_x), ("x = 3; print x-0.0;", None),
+        ("x = 3; print x+0;", int_x), ("x = 3; print 0+x;", int_x),
+        ("x = -0.0; print x+0;", None), ("x = 3; print x+0.0;", None),
+    ]:
+        expression = optimize(parse(tokenize(source)), 2)["statements"][-1]["expression"]
+        assert (expression == simplified) if simplified else (expression["type"] == "binary"), source
+
+def test_optimized_output_matches():
+    print("testing optimized output against evaluate")
+    with open("example.t") as f:
+        source = f.read()
+    for program in [
+        source,
+        "x = -0; print x + 0; print x - 0; print x * 1; print -(-x);",
+        "x = 2; if (0) print 1/0; print x/1; y = x * 0.5; print y/1 + 0 - 0.0;",
+        "x = 2; print x+0; print x*1.0; print 1.0*x; print x-0.0; x = -0.0; print x+0;",
+        "k = 3; s = 0; while (k) { s = s + (2*3 - 4/2) * k * 1; k = k - (0+1); if (0) print s; }",
+        "k = 0; while (k) k = k - 1; while (0) {} if (1) {} else print 1;",
+    ]:
+        expected = run_captured(evaluate, program)
+        for level in [1, 2]:
+            assert run_captured(optimized_at(level), program)[0::2] == expected[0::2], program
+
+def test_conditions():
+    print("testing comparisons and logical operators")
+    for source, expected in [
+        ("print 1 < 2;", 1), ("print 2.5 == 2;", 0), ("print !(3 - 3);", 1),
+        ("print 0 && x;", 0), ("print 2 || 1 / 0;", 1), ("print 1 && 0.5;", 1),
+        ("print 0 || 0 > 1;", 0),
+    ]:
+        assert optimize(parse(tokenize(source)), 1)["statements"][0]["expression"] == expected, source
+    # the left operand stays whenever it is not a constant
+    expression = optimize(parse(tokenize("print x && 0;")))["statements"][0]["expression"]
+    assert expression["type"] == "logical" and expression["value_type"] == "int"
+    ast = optimize(parse(tokenize("if (1 > 2 || 0) print 1; while (2 <= 1) print 2;")))
+    assert ast == {"type": "program", "statements": []}
+    program = "x = 3; if (x >= 3 && !(x == 4)) print x < 5 || 1 / 0; print 1 * (x != 3);"
+    assert run_captured(optimized_at(2), program)[0::2] == run_captured(evaluate, program)[0::2]
+
+def test_division_by_zero_not_folded():
+    print("testing division by zero is not folded")
+    ast = optimize(parse(tokenize("if (x) print 1/0;")))
+    assert ast["statements"][0]["then"]["expression"]["operator"] == "/"
+    # nor is an int too large to divide as a float
+    program = f"if (0) print {'9' * 400} / 3; print 1;"
+    for level in [1, 2]:
+        assert run_captured(optimized_at(level), program) == run_captured(evaluate, program)
+
+if __name__ == "__main__":
+    test_constant_folding()
+    test_dead_branches()
+    test_simplification()
+    test_optimized_output_matches()
+    test_division_by_zero_not_folded()
+    test_conditions()
+    print("done")
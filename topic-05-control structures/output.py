@@ -0,0 +1,107 @@
+import sys
+
+# Output sinks for print statements. The evaluator hands every printed value
+# to its sink's write() method, and calls flush() when a run is over.
+# See evaluator.set_output().
+
+class StandardOutput:
+    "Prints every value straight away, exactly like the print builtin."
+    def write(self, value):
+        print(value)
+
+    def flush(self):
+        pass
+
+class BufferedOutput:
+    "Collects printed lines and writes them out once threshold characters are waiting."
+    def __init__(self, stream=None, threshold=65536):
+        # stream defaults to whatever sys.stdout is at the time of the flush
+        self.stream = stream
+        self.threshold = threshold
+        self.lines = []
+        self.size = 0
+
+    def write(self, value):
+        line = f"{value}\n"
+        self.lines.append(line)
+        self.size += len(line)
+        if self.size >= self.threshold:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            stream = self.stream or sys.stdout
+            stream.write("".join(self.lines))
+            stream.flush()
+            self.lines = []
+            self.size = 0
+
+class ListOutput:
+    "Keeps the printed values in a list, for tests."
+    def __init__(self):
+        self.values = []
+
+    def write(self, value):
+        self.values.append(value)
+
+    def flush(self):
+        pass
+
+class NullOutput:
+    "Throws the printed values away, for benchmarks."
+    def write(self, value):
+        pass
+
+    def flush(self):
+        pass
+
+# sinks that can be picked by name, for runner.py --output
+output_sinks = {
+    "stdout": StandardOutput,
+    "buffered": BufferedOutput,
+    "list": ListOutput,
+    "null": NullOutput,
+}
+
+def test_buffered_output():
+    print("testing buffered output")
+    import io
+    stream = io.StringIO()
+    sink = BufferedOutput(stream, threshold=10)
+    sink.write(1.0)
+    sink.write(22)
+    assert stream.getvalue() == ""
+    sink.write(333.5)
+    assert stream.getvalue() == "1.0\n22\n333.5\n"
+    sink.write(-4)
+    sink.flush()
+    assert stream.getvalue() == "1.0\n22\n333.5\n-4\n"
+
+def test_buffered_output_matches_print():
+    print("testing buffered output against print")
+    import io
+    from contextlib import redirect_stdout
+    values = [1, 2.5, -0.0, 1e100, 10 / 3, "text"]
+    printed = io.StringIO()
+    with redirect_stdout(printed):
+        for value in values:
+            print(value)
+    buffered = io.StringIO()
+    sink = BufferedOutput(buffered)
+    for value in values:
+        sink.write(value)
+    sink.flush()
+    assert buffered.getvalue() == printed.getvalue()
+
+def test_list_output():
+    print("testing list output")
+    sink = ListOutput()
+    sink.write(1.0)
+    sink.write(2.0)
+    assert sink.values == [1.0, 2.0]
+
+if __name__ == "__main__":
+    test_buffered_output()
+    test_buffered_output_matches_print()
+    test_list_output()
+    print("done")
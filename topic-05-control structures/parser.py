@@ -1,147 +1,353 @@
-# Assuming the tokens are generated and stored in a list called 'tokens'.
-# We'll use a global pointer 'current_token_index' to keep track of the current token being processed.
-# testing comment
-tokens = []  # Example: ["print", ["number", 1], "+", ["number", 2], ";", "{", ...]
-current_token_index = 0
-
-def get_current_token():
-    global current_token_index
-    if current_token_index < len(tokens):
-        return tokens[current_token_index]
-    return None
-
-def consume_token():
-    global current_token_index
-    current_token_index += 1
-
-def parse(program_tokens):
-    global tokens
-    global current_token_index
-    current_token_index = 0
-    tokens = program_tokens
-    statements = []
-    while get_current_token() is not None:
-        statements.append(parse_statement())
-    # return ["program", statements]
-    return {"type":"program","statements":statements}
-
-def parse_statement():
-    current_token = get_current_token()
-    if current_token == "print":
-        consume_token()  # Consume 'print'
-        expression = parse_expression()
-        if get_current_token() != ";":
-            raise Exception("Expected ';'")
-        consume_token()
-        # return ["print", expression]
-        return {"type": "print", "expression": expression}
-
-    if current_token == "if":
-        consume_token()  # Consume 'if'
-        if get_current_token() != "(":
-            raise Exception("Expected '('")
-        consume_token()
-        condition = parse_expression()
-        if get_current_token() != ")":
-            raise Exception("Expected ')'")
-        consume_token()
-        then_statement = parse_statement()
+from token_table import (
+    TokenTable, kind_names, kind_value_pairs,
+    END, PRINT, IF, ELSE, WHILE, PLUS, MINUS, TIMES, DIVIDE,
+    LEFT_PAREN, RIGHT_PAREN, LEFT_BRACE, RIGHT_BRACE, SEMICOLON, ASSIGN,
+    NUMBER, IDENTIFIER,
+    EQUAL, NOT_EQUAL, LESS, LESS_EQUAL, GREATER, GREATER_EQUAL, AND, OR, NOT,
+)
 
-        if get_current_token() == "else":
-            consume_token()
-            else_statement = parse_statement()
-        else:
-            else_statement = None
-
-        return {"type": "if", 
-            "condition": condition,
-            "then" : then_statement,            
-            "else" : else_statement,
-        }
-
-    if current_token == "while":
-        consume_token()  # Consume 'while'
-        if get_current_token() != "(":
-            raise Exception("Expected '('")
-        consume_token()
-        condition = parse_expression()
-        if get_current_token() != ")":
-            raise Exception("Expected ')'")
-        consume_token()
-        do_statement = parse_statement()
-        return {"type": "while", 
-            "condition": condition,
-            "do" : do_statement,            
-        }
-    
-    if type(current_token) is list and current_token[0] == "identifier":
-        name = current_token[1]
-        consume_token()
-        if get_current_token() != "=":
-            raise Exception("Expected '=' for assignment statement")
-        consume_token()
-        expression = parse_expression()
-        if get_current_token() != ";":
-            raise Exception("Expected ';'")
-        consume_token()
-        return {"type": "assignment", "name": name, "expression": expression}
-
-    if current_token == "{":
-        return parse_block()
+# Precedence of the operators looser than arithmetic, as in C: || below &&
+# below the comparisons. Comparisons give 1 or 0 and are binary nodes;
+# && and || are "logical" nodes, since they only evaluate their right
+# operand when the left one has not already decided the result.
+condition_precedence = {OR: 1, AND: 2,
+                        EQUAL: 3, NOT_EQUAL: 3, LESS: 3, LESS_EQUAL: 3, GREATER: 3, GREATER_EQUAL: 3}
+
+# Operator precedence for the iterative expression parser. UNARY marks a
+# unary minus; it and ! apply to the factor right after them and so bind
+# tighter than any binary operator.
+UNARY = -1
+precedence = dict(condition_precedence)
+precedence.update({UNARY: 6, NOT: 6, TIMES: 5, DIVIDE: 5, PLUS: 4, MINUS: 4})
+
+def binary_node(operator, left, right):
+    t = "logical" if operator == AND or operator == OR else "binary"
+    return {"type": t, "left": left, "operator": kind_names[operator], "right": right}
+
+def reduce_operator(operator, operands):
+    if operator == UNARY or operator == NOT:
+        expression = operands.pop()
+        operands.append({"type": "unary", "operator": "-" if operator == UNARY else "!",
+                         "expression": expression})
     else:
-        raise Exception("Unexpected token in statement")
-
-def parse_block():
-    consume_token()  # Consume '{'
-    statements = []
-    while get_current_token() != "}":
-        statements.append(parse_statement())
-    consume_token()  # Consume '}'
-    # return ["block", statements]
-    return {"type": "block", "statements": statements}
-
-def parse_expression():
-    left_term = parse_term()
-    while get_current_token() in ["+", "-"]:
-        operator = get_current_token()
-        consume_token()
-        right_term = parse_term()
-        # left_term = [op, left_term, right_term]
-        left_term = {"type": "binary", "left": left_term, "operator": operator, "right": right_term}
-    return left_term
-
-def parse_term():
-    left_factor = parse_factor()
-    while get_current_token() in ["*", "/"]:
-        operator = get_current_token()
-        consume_token()
-        right_factor = parse_factor()
-        # left_factor = [op, left_factor, right_factor]
-        left_factor = {"type": "binary", "left": left_factor, "operator": operator, "right": right_factor}
-    return left_factor
-
-def parse_factor():
-    current_token = get_current_token()
-    if isinstance(current_token, list) and current_token[0] == "number":
-        consume_token()
-        return float(current_token[1])
-    elif isinstance(current_token, list) and current_token[0] == "identifier":
-        consume_token()
-        return {"type": "identifier", "name": current_token[1]}
-    elif current_token == "-":
-        operator = get_current_token()
-        consume_token()  # Consume '-'
-        factor = parse_factor()
-        return {"type": "unary", "operator": operator, "expression": factor}
-    elif current_token == "(":
-        consume_token()  # Consume '('
-        expression = parse_expression()
-        if get_current_token() != ")":
+        right = operands.pop()
+        left = operands.pop()
+        operands.append(binary_node(operator, left, right))
+
+# A Parser owns its cursor: the token stream and the current token, kept in
+# 'current_kind' and 'current_value', and 'current_token_index', the count of
+# tokens consumed so far. The tokens can be a TokenTable, a list in the
+# original token shape, or any other iterable such as the lazy stream from
+# tokenizer.scan_stream(). The parser pulls one (kind code, value) pair at a
+# time and only ever looks at the current token. Separate parsers share
+# nothing, so they can run at the same time in different threads.
+class Parser:
+    def __init__(self):
+        self.tokens = iter([])  # Example: ["print", ["number", 1], "+", ["number", 2], ";", "{", ...]
+        self.current_kind = END
+        self.current_value = None
+        self.current_token_index = 0
+
+    def consume_token(self):
+        self.current_kind, self.current_value = next(self.tokens, (END, None))
+        self.current_token_index += 1
+
+    # With iterative=True, statements and expressions are parsed with explicit
+    # stacks instead of recursion (see parse_statement_iterative() below), so
+    # deeply nested input cannot hit Python's recursion limit. Both give the
+    # same AST.
+    def parse(self, program_tokens, iterative=False):
+        statements = list(self.parse_statements(program_tokens, iterative))
+        # return ["program", statements]
+        return {"type":"program","statements":statements}
+
+    # Parse top-level statements one at a time, so a caller can run each
+    # statement before the rest of the input has been read.
+    def parse_statements(self, program_tokens, iterative=False):
+        if isinstance(program_tokens, TokenTable):
+            self.tokens = program_tokens.pairs()
+        else:
+            self.tokens = kind_value_pairs(program_tokens)
+        self.consume_token()
+        self.current_token_index = 0
+        statement_parser = self.parse_statement_iterative if iterative else self.parse_statement
+        while self.current_kind != END:
+            yield statement_parser()
+        # let go of the tokens
+        self.tokens = iter([])
+
+    def parse_statement(self):
+        if self.current_kind == PRINT:
+            self.consume_token()  # Consume 'print'
+            expression = self.parse_expression()
+            if self.current_kind != SEMICOLON:
+                raise Exception("Expected ';'")
+            self.consume_token()
+            # return ["print", expression]
+            return {"type": "print", "expression": expression}
+
+        if self.current_kind == IF:
+            self.consume_token()  # Consume 'if'
+            if self.current_kind != LEFT_PAREN:
+                raise Exception("Expected '('")
+            self.consume_token()
+            condition = self.parse_expression()
+            if self.current_kind != RIGHT_PAREN:
+                raise Exception("Expected ')'")
+            self.consume_token()
+            then_statement = self.parse_statement()
+
+            if self.current_kind == ELSE:
+                self.consume_token()
+                else_statement = self.parse_statement()
+            else:
+                else_statement = None
+
+            return {"type": "if", 
+                "condition": condition,
+                "then" : then_statement,            
+                "else" : else_statement,
+            }
+
+        if self.current_kind == WHILE:
+            self.consume_token()  # Consume 'while'
+            if self.current_kind != LEFT_PAREN:
+                raise Exception("Expected '('")
+            self.consume_token()
+            condition = self.parse_expression()
+            if self.current_kind != RIGHT_PAREN:
+                raise Exception("Expected ')'")
+            self.consume_token()
+            do_statement = self.parse_statement()
+            return {"type": "while", 
+                "condition": condition,
+                "do" : do_statement,            
+            }
+
+        if self.current_kind == IDENTIFIER:
+            name = self.current_value
+            self.consume_token()
+            if self.current_kind != ASSIGN:
+                raise Exception("Expected '=' for assignment statement")
+            self.consume_token()
+            expression = self.parse_expression()
+            if self.current_kind != SEMICOLON:
+                raise Exception("Expected ';'")
+            self.consume_token()
+            return {"type": "assignment", "name": name, "expression": expression}
+
+        if self.current_kind == LEFT_BRACE:
+            return self.parse_block()
+        else:
+            raise Exception("Unexpected token in statement")
+
+    def parse_block(self):
+        self.consume_token()  # Consume '{'
+        statements = []
+        while self.current_kind != RIGHT_BRACE:
+            statements.append(self.parse_statement())
+        self.consume_token()  # Consume '}'
+        # return ["block", statements]
+        return {"type": "block", "statements": statements}
+
+    # The comparisons, && and || by precedence climbing: every operator at
+    # `level` or looser is taken here, and its right operand is parsed at the
+    # next level up. A parenthesised expression then costs one call more than
+    # the arithmetic inside it, not one per level.
+    def parse_expression(self, level=1):
+        left = self.parse_sum()
+        while condition_precedence.get(self.current_kind, 0) >= level:
+            operator = self.current_kind
+            self.consume_token()
+            right = self.parse_expression(condition_precedence[operator] + 1)
+            left = binary_node(operator, left, right)
+        return left
+
+    def parse_sum(self):
+        left_term = self.parse_term()
+        while self.current_kind == PLUS or self.current_kind == MINUS:
+            operator = kind_names[self.current_kind]
+            self.consume_token()
+            right_term = self.parse_term()
+            # left_term = [op, left_term, right_term]
+            left_term = {"type": "binary", "left": left_term, "operator": operator, "right": right_term}
+        return left_term
+
+    def parse_term(self):
+        left_factor = self.parse_factor()
+        while self.current_kind == TIMES or self.current_kind == DIVIDE:
+            operator = kind_names[self.current_kind]
+            self.consume_token()
+            right_factor = self.parse_factor()
+            # left_factor = [op, left_factor, right_factor]
+            left_factor = {"type": "binary", "left": left_factor, "operator": operator, "right": right_factor}
+        return left_factor
+
+    def parse_factor(self):
+        if self.current_kind == NUMBER:
+            value = self.current_value
+            self.consume_token()
+            return value
+        elif self.current_kind == IDENTIFIER:
+            name = self.current_value
+            self.consume_token()
+            return {"type": "identifier", "name": name}
+        elif self.current_kind == MINUS or self.current_kind == NOT:
+            operator = kind_names[self.current_kind]
+            self.consume_token()  # Consume '-' or '!'
+            factor = self.parse_factor()
+            return {"type": "unary", "operator": operator, "expression": factor}
+        elif self.current_kind == LEFT_PAREN:
+            self.consume_token()  # Consume '('
+            expression = self.parse_expression()
+            if self.current_kind != RIGHT_PAREN:
+                raise Exception("Expected ')'")
+            self.consume_token()  # Consume ')'
+            return expression
+        else:
+            raise Exception("Unexpected token in factor")
+
+    # The iterative parser. Statements that contain other statements push a frame
+    # on an explicit stack and go on to parse the inner statement; every finished
+    # statement is then handed to the frames above it until one of them needs
+    # another statement or the stack is empty.
+    def parse_statement_iterative(self):
+        stack = []
+        while True:
+            node = None
+            if self.current_kind == PRINT:
+                self.consume_token()  # Consume 'print'
+                expression = self.parse_expression_iterative()
+                if self.current_kind != SEMICOLON:
+                    raise Exception("Expected ';'")
+                self.consume_token()
+                node = {"type": "print", "expression": expression}
+
+            elif self.current_kind == IF or self.current_kind == WHILE:
+                kind = self.current_kind
+                self.consume_token()  # Consume 'if' or 'while'
+                if self.current_kind != LEFT_PAREN:
+                    raise Exception("Expected '('")
+                self.consume_token()
+                condition = self.parse_expression_iterative()
+                if self.current_kind != RIGHT_PAREN:
+                    raise Exception("Expected ')'")
+                self.consume_token()
+                stack.append(["if" if kind == IF else "while", condition])
+
+            elif self.current_kind == IDENTIFIER:
+                name = self.current_value
+                self.consume_token()
+                if self.current_kind != ASSIGN:
+                    raise Exception("Expected '=' for assignment statement")
+                self.consume_token()
+                expression = self.parse_expression_iterative()
+                if self.current_kind != SEMICOLON:
+                    raise Exception("Expected ';'")
+                self.consume_token()
+                node = {"type": "assignment", "name": name, "expression": expression}
+
+            elif self.current_kind == LEFT_BRACE:
+                self.consume_token()  # Consume '{'
+                if self.current_kind == RIGHT_BRACE:
+                    self.consume_token()  # Consume '}'
+                    node = {"type": "block", "statements": []}
+                else:
+                    stack.append(["block", []])
+
+            else:
+                raise Exception("Unexpected token in statement")
+
+            # hand the finished statement to the frames waiting for it
+            while node is not None:
+                if not stack:
+                    return node
+                frame = stack[-1]
+                if frame[0] == "block":
+                    frame[1].append(node)
+                    node = None
+                    if self.current_kind == RIGHT_BRACE:
+                        self.consume_token()  # Consume '}'
+                        stack.pop()
+                        node = {"type": "block", "statements": frame[1]}
+                elif frame[0] == "if":
+                    if self.current_kind == ELSE:
+                        self.consume_token()
+                        stack[-1] = ["else", frame[1], node]
+                        node = None
+                    else:
+                        stack.pop()
+                        node = {"type": "if",
+                            "condition": frame[1],
+                            "then" : node,
+                            "else" : None,
+                        }
+                elif frame[0] == "else":
+                    stack.pop()
+                    node = {"type": "if",
+                        "condition": frame[1],
+                        "then" : frame[2],
+                        "else" : node,
+                    }
+                else:
+                    stack.pop()
+                    node = {"type": "while",
+                        "condition": frame[1],
+                        "do" : node,
+                    }
+
+    # Operator precedence parsing with an operand stack and an operator stack.
+    # Operators of equal precedence are reduced left to right, as in
+    # parse_expression() and parse_term().
+    def parse_expression_iterative(self):
+        operands = []
+        operators = []
+        open_parens = 0
+        while True:
+            while self.current_kind in [MINUS, NOT, LEFT_PAREN]:
+                if self.current_kind == MINUS:
+                    operators.append(UNARY)
+                elif self.current_kind == NOT:
+                    operators.append(NOT)
+                else:
+                    operators.append(LEFT_PAREN)
+                    open_parens += 1
+                self.consume_token()
+            if self.current_kind == NUMBER:
+                operands.append(self.current_value)
+            elif self.current_kind == IDENTIFIER:
+                operands.append({"type": "identifier", "name": self.current_value})
+            else:
+                raise Exception("Unexpected token in factor")
+            self.consume_token()
+
+            while self.current_kind == RIGHT_PAREN and open_parens:
+                while operators[-1] != LEFT_PAREN:
+                    reduce_operator(operators.pop(), operands)
+                operators.pop()
+                open_parens -= 1
+                self.consume_token()  # Consume ')'
+
+            if self.current_kind not in precedence or self.current_kind == NOT:
+                break
+            while (operators and operators[-1] != LEFT_PAREN
+                   and precedence[operators[-1]] >= precedence[self.current_kind]):
+                reduce_operator(operators.pop(), operands)
+            operators.append(self.current_kind)
+            self.consume_token()
+
+        if open_parens:
             raise Exception("Expected ')'")
-        consume_token()  # Consume ')'
-        return expression
-    else:
-        raise Exception("Unexpected token in factor")
+        while operators:
+            reduce_operator(operators.pop(), operands)
+        return operands[0]
+
+# The module-level functions parse with a new Parser each time.
+def parse(program_tokens, iterative=False):
+    return Parser().parse(program_tokens, iterative)
+
+def parse_statements(program_tokens, iterative=False):
+    return Parser().parse_statements(program_tokens, iterative)
 
 # Example usage:
 
@@ -157,9 +363,9 @@ def test_parse():
     pprint(ast, sort_dicts=False)   
     assert ast == {'type': 'program', 'statements': [
         {'type': 'print', 'expression': 
-            {'type': 'binary', 'left': 1.0, 'operator': '+', 'right': 2.0}
+            {'type': 'binary', 'left': 1, 'operator': '+', 'right': 2}
         }, 
-        {'type': 'block', 'statements': [{'type': 'print', 'expression': 3.0}, {'type': 'print', 'expression': 4.0}]}]}
+        {'type': 'block', 'statements': [{'type': 'print', 'expression': 3}, {'type': 'print', 'expression': 4}]}]}
 
 def test_parse_with_identifier():
     print("testing parse with identifier")
@@ -183,9 +389,9 @@ def test_parse_unary_negation():
                  'expression': {'type': 'binary',
                                 'left': {'type': 'unary',
                                          'operator': '-',
-                                         'expression': 2.0},
+                                         'expression': 2},
                                 'operator': '-',
-                                'right': 2.0}}]}
+                                'right': 2}}]}
 
 def test_if_statement():
     tokens = tokenize("if (1) j = 2;")
@@ -196,11 +402,11 @@ def test_if_statement():
         'type': 'program',
         'statements': [{
             'type': 'if',
-            'condition': 1.0,
+            'condition': 1,
             'then': {
                 'type': 'assignment', 
                 'name':  'j', 
-                'expression': 2.0},
+                'expression': 2},
             'else': None }]}
     tokens = tokenize("if (1) j = 2; else j = 0;")
     print(tokens)
@@ -210,15 +416,15 @@ def test_if_statement():
         'type': 'program',
         'statements': [{
             'type': 'if',
-            'condition': 1.0,
+            'condition': 1,
             'then': {
                 'type': 'assignment', 
                 'name':  'j', 
-                'expression': 2.0},
+                'expression': 2},
             'else': {
                 'type': 'assignment', 
                 'name':  'j', 
-                'expression': 0.0}}]}
+                'expression': 0}}]}
     tokens = tokenize("if (1) {j=1; k=2;} else {j=0; k=1;}")
     print(tokens)
     ast = parse(tokens)
@@ -226,21 +432,21 @@ def test_if_statement():
     assert ast == {
         'type': 'program',
         'statements': [{'type': 'if',
-                 'condition': 1.0,
+                 'condition': 1,
                  'then': {'type': 'block',
                           'statements': [{'type': 'assignment',
                                           'name': 'j',
-                                          'expression': 1.0},
+                                          'expression': 1},
                                          {'type': 'assignment',
                                           'name': 'k',
-                                          'expression': 2.0}]},
+                                          'expression': 2}]},
                  'else': {'type': 'block',
                           'statements': [{'type': 'assignment',
                                           'name': 'j',
-                                          'expression': 0.0},
+                                          'expression': 0},
                                          {'type': 'assignment',
                                           'name': 'k',
-                                          'expression': 1.0}]}}]}
+                                          'expression': 1}]}}]}
 
 def test_while_statement():
     tokens = tokenize("k = 3; while (k) k = k - 1;")
@@ -249,7 +455,7 @@ def test_while_statement():
     assert ast == {
         'type': 'program',
         'statements': [
-                {'type': 'assignment', 'name': 'k', 'expression': 3.0},
+                {'type': 'assignment', 'name': 'k', 'expression': 3},
                 {'type': 'while',
                  'condition': {'type': 'identifier', 'name': 'k'},
                  'do': {'type': 'assignment',
@@ -258,7 +464,102 @@ def test_while_statement():
                                        'left': {'type': 'identifier',
                                                 'name': 'k'},
                                        'operator': '-',
-                                       'right': 1.0}}}]}
+                                       'right': 1}}}]}
+
+def test_parse_statements_stream():
+    print("testing parse from a token stream")
+    import io
+    from tokenizer import scan_stream
+    with open("example.t") as f:
+        source = f.read()
+    expected = parse(tokenize(source))["statements"]
+    for chunk_size in [1, 5, 4096]:
+        statements = parse_statements(scan_stream(io.StringIO(source), chunk_size))
+        assert list(statements) == expected
+
+def test_parse_token_table():
+    print("testing parse from a token table")
+    from token_table import scan_table
+    with open("example.t") as f:
+        source = f.read()
+    assert parse(scan_table(source)) == parse(tokenize(source))
+    assert parse(scan_table(source).to_list()) == parse(tokenize(source))
+
+def test_iterative_parser():
+    print("testing iterative parser")
+    with open("example.t") as f:
+        source = f.read()
+    for program in [
+        source,
+        "print 1+2; {print 3; print 4;}",
+        "print -2-2; print -(2)-(2); print --x*-(3-y)/2+1*(2-(z));",
+        "print 2*-3+1; print a-b-c; print a/b*c-d+e; print -a*b;",
+        "if (1) j = 2; if (1) j = 2; else j = 0;",
+        "if (1) {j=1; k=2;} else {j=0; k=1;} {} {{}} if (x) {} else {}",
+        "k = 3; while (k) k = k - 1; while (k) { if (k) while (j) {j = 1;} else k = 0; }",
+        "if (a) if (b) x = 1; else x = 2;",
+    ]:
+        assert parse(tokenize(program), iterative=True) == parse(tokenize(program)), program
+
+def test_iterative_parser_errors():
+    print("testing iterative parser errors")
+    for program in ["print (1+2;", "print 1", "x 1;", "if 1) x = 1;", "{ print 1;", "print *;", "while (x x = 1;"]:
+        messages = []
+        for iterative in [False, True]:
+            try:
+                parse(tokenize(program), iterative)
+            except Exception as e:
+                messages.append(str(e))
+        assert len(messages) == 2 and messages[0] == messages[1], program
+
+def test_iterative_parser_deep_nesting():
+    print("testing iterative parser on deep nesting")
+    from tokenizer import scan
+    depth = 100000
+    ast = parse(scan("print " + "(" * depth + "1" + ")" * depth + ";"), iterative=True)
+    assert ast["statements"][0]["expression"] == 1
+    ast = parse(scan("{" * depth + "print 1;" + "}" * depth), iterative=True)
+    node = ast["statements"][0]
+    for _ in range(depth - 1):
+        node = node["statements"][0]
+    assert node == {"type": "block", "statements": [{"type": "print", "expression": 1}]}
+
+def test_literal_types():
+    print("testing number literals keep their type")
+    for iterative in [False, True]:
+        ast = parse(tokenize("print 2; print 2.5; print 3.0 * 12345678901234567890;"), iterative)
+        values = [statement["expression"] for statement in ast["statements"]]
+        assert type(values[0]) is int and type(values[1]) is float
+        assert values[2]["left"] == 3.0 and type(values[2]["left"]) is float
+        assert values[2]["right"] == 12345678901234567890
+
+def test_conditions():
+    print("testing comparisons and logical operators")
+    identifier = lambda name: {"type": "identifier", "name": name}
+    ast = parse(tokenize("while (a < b + 1 && !c || d == 2) x = 1;"))
+    assert ast["statements"][0]["condition"] == {"type": "logical",
+        "left": {"type": "logical",
+            "left": {"type": "binary", "left": identifier("a"), "operator": "<",
+                     "right": {"type": "binary", "left": identifier("b"), "operator": "+", "right": 1}},
+            "operator": "&&",
+            "right": {"type": "unary", "operator": "!", "expression": identifier("c")}},
+        "operator": "||",
+        "right": {"type": "binary", "left": identifier("d"), "operator": "==", "right": 2}}
+    for source in [
+        "print a < b < c; print a != b >= c;",
+        "print a || b || c && d; print !-a <= -!b;",
+        "print (a || b) && (c > d); print !(a == 1);",
+        "x = a<=1&&b>=2||c!=3&&!!d;",
+    ]:
+        assert parse(tokenize(source), iterative=True) == parse(tokenize(source)), source
+    for source in ["print 1 <;", "print a ! b;", "print && a;"]:
+        messages = []
+        for iterative in [False, True]:
+            try:
+                parse(tokenize(source), iterative)
+            except Exception as e:
+                messages.append(str(e))
+        assert len(messages) == 2 and messages[0] == messages[1], source
 
 if __name__ == "__main__":
     # test_parse()
@@ -267,6 +568,13 @@ if __name__ == "__main__":
     # test_parse_assignment() ### TODO ###
     # test_if_statement()
     test_while_statement()
+    test_parse_statements_stream()
+    test_parse_token_table()
+    test_iterative_parser()
+    test_iterative_parser_errors()
+    test_iterative_parser_deep_nesting()
+    test_literal_types()
+    test_conditions()
 
 
 
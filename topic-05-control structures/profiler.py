@@ -0,0 +1,294 @@
+import sys
+import time
+from bisect import bisect_right
+
+from token_table import scan_table
+from parser import Parser
+from evaluator import Evaluator
+from output import ListOutput
+
+# A profiler for programs run by the AST evaluator. cProfile only sees
+# evaluate() calling itself; this attributes the time to the program's own
+# statements and expressions instead.
+#
+# For every AST node that runs, a Profiler counts how often it ran and adds up
+# its inclusive time (the node and everything under it) and its exclusive
+# time (the node alone, less the nodes under it). It also adds up exclusive
+# time for every distinct stack of nodes from the program down, which
+# write_collapsed() writes in the collapsed-stack format that flamegraph.pl,
+# speedscope and similar tools read:
+#
+#   program;while (k) (line 2);k = k - 1 (line 4);k - 1 1234
+#
+# with the weight in microseconds. report() prints the nodes that took the
+# most time.
+#
+# Nodes are labelled with their source text, and statements with their line
+# when the program was parsed by parse_with_locations(). The optimizer builds
+# new nodes, so statements of an optimized program have no line. The
+# evaluator reads the variable and literal operands of the expressions it
+# types without a node of their own, and fuses a comparison that is an if or
+# while condition with the branch, so those nodes go uncounted. Loops that
+# closed_form.py could solve go round every time, so that their bodies are
+# profiled. The clock is read twice for every node, which slows a program
+# down several times over; the proportions between nodes are what matter.
+
+class Statistics:
+    __slots__ = ("node", "count", "inclusive", "exclusive")
+
+    def __init__(self, node):
+        self.node = node
+        self.count = 0
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+
+class Profiler(Evaluator):
+    solves_loops = False
+
+    def __init__(self, environment=None, output=None, trace=None, budget=None,
+                 locations=None, clock=time.perf_counter):
+        super().__init__(environment, output, trace, budget)
+        # id(statement node) -> line number
+        self.locations = {} if locations is None else locations
+        self.clock = clock
+        # id(node) -> Statistics
+        self.statistics = {}
+        # tuple of node ids from the program down -> exclusive seconds
+        self.stacks = {}
+        self.stack = ()
+        # time taken by the children of the node running now
+        self.children = 0.0
+
+    def evaluate(self, node):
+        if type(node) is not dict:
+            return Evaluator.evaluate(self, node)
+        key = id(node)
+        parent_stack = self.stack
+        stack = self.stack = parent_stack + (key,)
+        parent_children = self.children
+        self.children = 0.0
+        start = self.clock()
+        try:
+            return Evaluator.evaluate(self, node)
+        finally:
+            elapsed = self.clock() - start
+            exclusive = elapsed - self.children
+            self.stack = parent_stack
+            self.children = parent_children + elapsed
+            statistics = self.statistics.get(key)
+            if statistics is None:
+                statistics = self.statistics[key] = Statistics(node)
+            statistics.count += 1
+            statistics.inclusive += elapsed
+            statistics.exclusive += exclusive
+            self.stacks[stack] = self.stacks.get(stack, 0.0) + exclusive
+
+    def label(self, key):
+        node = self.statistics[key].node
+        line = self.locations.get(key)
+        text = describe(node)
+        return text if line is None else f"{text} (line {line})"
+
+    # Write one line per stack of nodes, with its exclusive time in
+    # microseconds. Stacks that took less than a microsecond are left out.
+    def write_collapsed(self, f):
+        labels = {}
+        for stack, seconds in self.stacks.items():
+            weight = round(seconds * 1e6)
+            if weight <= 0:
+                continue
+            frames = []
+            for key in stack:
+                if key not in labels:
+                    labels[key] = self.label(key).replace(";", ",")
+                frames.append(labels[key])
+            f.write(f"{';'.join(frames)} {weight}\n")
+
+    # Print the `top` nodes with the most exclusive time, or inclusive time
+    # with by="inclusive".
+    def report(self, f=None, top=20, by="exclusive"):
+        f = sys.stdout if f is None else f
+        statistics = sorted(self.statistics.items(),
+                            key=lambda item: getattr(item[1], by), reverse=True)
+        total = sum(entry.exclusive for entry in self.statistics.values()) or 1.0
+        f.write(f"{'count':>10} {'inclusive':>12} {'exclusive':>12} {'%':>6}  {'line':>5}  node\n")
+        for key, entry in statistics[:top]:
+            line = self.locations.get(key)
+            f.write(f"{entry.count:>10} {entry.inclusive * 1000:10.3f}ms {entry.exclusive * 1000:10.3f}ms "
+                    f"{entry.exclusive / total * 100:5.1f}%  {'' if line is None else line:>5}  "
+                    f"{describe(entry.node)}\n")
+
+# A Parser that also records the line each statement starts on, in
+# 'locations' keyed by the id of the statement node. The iterative parser
+# only reports top-level statements, so nested statements get no line there.
+class LocatingParser(Parser):
+    def __init__(self, line_starts):
+        super().__init__()
+        self.line_starts = line_starts
+        self.starts = None
+        self.locations = {}
+
+    def locate(self, parse_statement):
+        offset = self.starts[self.current_token_index]
+        node = parse_statement()
+        self.locations[id(node)] = bisect_right(self.line_starts, offset)
+        return node
+
+    def parse_statement(self):
+        return self.locate(super().parse_statement)
+
+    def parse_statement_iterative(self):
+        return self.locate(super().parse_statement_iterative)
+
+# Parse source, returning its AST and the line of each statement for a
+# Profiler's 'locations'. The lines are keyed by node id, so they only hold
+# while the AST is kept.
+def parse_with_locations(source, iterative=False):
+    line_starts = [0]
+    line_starts.extend(index + 1 for index, character in enumerate(source) if character == "\n")
+    table = scan_table(source)
+    parser = LocatingParser(line_starts)
+    parser.starts = table.starts
+    ast = parser.parse(table, iterative)
+    return ast, parser.locations
+
+precedence = {"||": 1, "&&": 2, "==": 3, "!=": 3, "<": 3, "<=": 3, ">": 3, ">=": 3,
+              "+": 4, "-": 4, "*": 5, "/": 5}
+
+# Source text for an expression, with only the parentheses it needs.
+def expression_text(node, level=0):
+    if type(node) is int:
+        return str(node)
+    if type(node) is not dict:
+        return f"{node:g}"
+    t = node["type"]
+    if t == "identifier":
+        return node["name"]
+    if t == "unary":
+        return node["operator"] + expression_text(node["expression"], 6)
+    if t == "binary" or t == "logical":
+        operator_level = precedence[node["operator"]]
+        text = (f"{expression_text(node['left'], operator_level)} {node['operator']} "
+                f"{expression_text(node['right'], operator_level + 1)}")
+        return f"({text})" if operator_level < level else text
+    raise Exception(f"Unknown content in AST={node}")
+
+# A one-line description of a node: the head of a statement, or the text of
+# an expression.
+def describe(node, width=60):
+    t = node["type"] if type(node) is dict else None
+    if t == "program":
+        text = "program"
+    elif t == "block":
+        text = "{ ... }"
+    elif t == "print":
+        text = f"print {expression_text(node['expression'])}"
+    elif t == "if" or t == "while":
+        text = f"{t} ({expression_text(node['condition'])})"
+    elif t == "assignment":
+        text = f"{node['name']} = {expression_text(node['expression'])}"
+    else:
+        text = expression_text(node)
+    return text if len(text) <= width else text[:width - 3] + "..."
+
+class FakeClock:
+    "A clock that moves on by one tick every time it is read."
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+def profile(source, clock=time.perf_counter):
+    ast, locations = parse_with_locations(source)
+    profiler = Profiler(output=ListOutput(), locations=locations, clock=clock)
+    profiler.evaluate(ast)
+    return ast, profiler
+
+def test_counts():
+    print("testing profile counts")
+    ast, profiler = profile("k = 3;\nwhile (k) {\n  k = k - 1;\n}\nprint k;\n")
+    counts = {}
+    for entry in profiler.statistics.values():
+        counts[describe(entry.node)] = counts.get(describe(entry.node), 0) + entry.count
+    # the condition runs four times, 'k - 1' three times and 'print k' once
+    assert counts == {"program": 1, "k = 3": 1, "while (k)": 1, "k": 8, "{ ... }": 3,
+                      "k = k - 1": 3, "k - 1": 3, "print k": 1}
+    assert profiler.environment == {"k": 0}
+    lines = {describe(entry.node): profiler.locations.get(key)
+             for key, entry in profiler.statistics.items()}
+    assert lines["k = 3"] == 1 and lines["while (k)"] == 2
+    assert lines["{ ... }"] == 2 and lines["k = k - 1"] == 3 and lines["print k"] == 5
+
+def test_solvable_loops_go_round():
+    print("testing loops closed_form.py can solve are profiled")
+    ast, profiler = profile("k = 1000;\ns = 0;\nwhile (k) {\n  s = s + 2;\n  k = k - 1;\n}\n")
+    counts = {describe(entry.node): entry.count for entry in profiler.statistics.values()}
+    assert counts["while (k)"] == 1 and counts["s = s + 2"] == 1000 and counts["k = k - 1"] == 1000
+    assert profiler.environment == {"k": 0, "s": 2000}
+
+def test_inclusive_and_exclusive_time():
+    print("testing inclusive and exclusive time")
+    # every node reads the clock twice, so with a clock that ticks once per
+    # read a node's inclusive time is one tick plus two for each node below it
+    clock = FakeClock()
+    ast, profiler = profile("y = 1;\nx = -(2 * y);\n", clock)
+    entries = {describe(entry.node): entry for entry in profiler.statistics.values()}
+    assert entries["y"].inclusive == 1.0 and entries["y"].exclusive == 1.0
+    assert entries["2 * y"].inclusive == 3.0 and entries["2 * y"].exclusive == 2.0
+    assert entries["-(2 * y)"].inclusive == 5.0
+    assert entries["x = -(2 * y)"].inclusive == 7.0
+    assert entries["program"].inclusive == 11.0
+    assert sum(entry.exclusive for entry in entries.values()) == 11.0
+
+def test_collapsed_stacks():
+    print("testing collapsed stacks")
+    import io
+    ast, profiler = profile("k = 2;\nwhile (k) k = k - 1;\n", FakeClock())
+    f = io.StringIO()
+    profiler.write_collapsed(f)
+    stacks = dict(line.rsplit(" ", 1) for line in f.getvalue().splitlines())
+    assert stacks["program;while (k) (line 2);k = k - 1 (line 2);k - 1;k"] == str(2 * 10 ** 6)
+    assert stacks["program;while (k) (line 2);k"] == str(3 * 10 ** 6)
+    total = sum(int(weight) for weight in stacks.values())
+    assert total == round(profiler.statistics[id(ast)].inclusive * 1e6)
+
+def test_report():
+    print("testing the profile report")
+    import io
+    ast, profiler = profile("k = 1000;\nwhile (k) {\n  s = k * k;\n  k = k - 1;\n}\n")
+    f = io.StringIO()
+    profiler.report(f, top=3)
+    lines = f.getvalue().splitlines()
+    assert len(lines) == 4 and lines[0].split() == ["count", "inclusive", "exclusive", "%", "line", "node"]
+    f = io.StringIO()
+    profiler.report(f, top=2, by="inclusive")
+    lines = f.getvalue().splitlines()
+    assert lines[1].endswith("program") and lines[2].endswith("while (k)")
+
+def test_describe():
+    print("testing node descriptions")
+    ast, _ = parse_with_locations("x = (a - (b - c)) * -d / 2 + 1.5;")
+    assert describe(ast["statements"][0]) == "x = (a - (b - c)) * -d / 2 + 1.5"
+    assert describe(ast["statements"][0], width=10) == "x = (a ..."
+    ast, _ = parse_with_locations("while (a < b + 1 && !(c || d == 2)) {}")
+    assert describe(ast["statements"][0]) == "while (a < b + 1 && !(c || d == 2))"
+
+def test_iterative_parser_locations():
+    print("testing locations from the iterative parser")
+    source = "a = 1;\n\nwhile (a) {\n a = a - 1;\n}\n"
+    ast, locations = parse_with_locations(source, iterative=True)
+    recursive, _ = parse_with_locations(source)
+    assert ast == recursive
+    assert [locations.get(id(statement)) for statement in ast["statements"]] == [1, 3]
+
+if __name__ == "__main__":
+    test_counts()
+    test_solvable_loops_go_round()
+    test_inclusive_and_exclusive_time()
+    test_collapsed_stacks()
+    test_report()
+    test_describe()
+    test_iterative_parser_locations()
+    print("done")
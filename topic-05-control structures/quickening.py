@@ -0,0 +1,577 @@
+import sys
+
+import evaluator
+from evaluator import binary_operations, unary_operations, comparisons, typed_operations
+
+# Self-specialising nodes ("quickening"). The AST is turned into a tree of node
+# objects, each with a run() that does the node's work. A node starts out in a
+# generic form that works everything out each time it runs, as the evaluator
+# does, and once it has run THRESHOLD times in a row the same way it rewrites
+# its own run() into a form specialised for what it has seen:
+#
+#   int+int, float<int, ...  a binary operator whose operands have had the
+#                            same types every time: the form checks the types
+#                            and applies the operator's C function, reading
+#                            a variable or literal operand itself
+#   cached-slot              an identifier or assignment that keeps the cell
+#                            its variable lives in, instead of looking the
+#                            name up
+#   constant                 a number literal, which starts out in this form
+#                            as nothing about it can change
+#
+# Each specialised form has a guard: the operand types for a binary
+# operator, and for an identifier that its variable has a value. A variable
+# never loses its value once it has one, so in practice only the type guards
+# fail. When a guard fails the node deoptimises: it goes back to the generic
+# form, which gives this run's value, and starts counting again. A binary
+# node that has deoptimised MAX_DEOPTIMISATIONS times, counting the times
+# its operand types changed before it specialised, becomes megamorphic: it
+# stays generic for good and stops watching its operand types, so a node
+# whose types keep changing does not keep paying for rewrites. An
+# assignment's cell cannot change while the program runs, so its cached-slot
+# form needs no guard. &&, || and the unary operators only have the generic
+# form.
+#
+# A comparison that is an if or while condition gives True or False rather
+# than 1 or 0, the fused compare-and-branch of the evaluator.
+#
+# Variables live in cells, one for each name the program uses, that start out
+# from the evaluator's environment and are written back to it when the
+# program finishes, as slots.py does with its slots. The trace hook, output
+# sink and budget are the evaluator's, looked up when the program is
+# quickened. Closed-form loops are not used: every iteration runs.
+#
+# Given a Statistics, evaluate_quickened() counts for every form how many
+# times a node was rewritten into it, how often it ran, and how often its
+# guard held (hits) or failed (misses). Counting wraps every run() in
+# another call, so it slows the program down.
+
+# runs in a row with the same operand types before a node specialises
+THRESHOLD = 4
+MAX_DEOPTIMISATIONS = 3
+
+GENERIC = "generic"
+MEGAMORPHIC = "megamorphic"
+CACHED_SLOT = "cached-slot"
+CONSTANT = "constant"
+
+# marks a cell whose variable has not been assigned yet
+UNASSIGNED = object()
+
+class FormStatistics:
+    __slots__ = ("rewrites", "runs", "misses")
+
+    def __init__(self):
+        self.rewrites = 0
+        self.runs = 0
+        self.misses = 0
+
+    @property
+    def hits(self):
+        return self.runs - self.misses
+
+class Statistics:
+    def __init__(self):
+        # form name -> FormStatistics
+        self.forms = {}
+
+    def form(self, name):
+        entry = self.forms.get(name)
+        if entry is None:
+            entry = self.forms[name] = FormStatistics()
+        return entry
+
+    # Print one line for each form, most run first. The generic forms have no
+    # guard, so no hit rate.
+    def report(self, f=None):
+        f = sys.stdout if f is None else f
+        f.write(f"{'form':14} {'rewrites':>9} {'runs':>12} {'hits':>12} {'misses':>9} {'hit rate':>9}\n")
+        forms = sorted(self.forms.items(), key=lambda item: item[1].runs, reverse=True)
+        for name, entry in forms:
+            if entry.runs and name not in [GENERIC, MEGAMORPHIC]:
+                rate = f"{entry.hits / entry.runs * 100:8.2f}%"
+            else:
+                rate = f"{'-':>9}"
+            f.write(f"{name:14} {entry.rewrites:>9} {entry.runs:>12} {entry.hits:>12} "
+                    f"{entry.misses:>9} {rate}\n")
+
+def counted(run, entry):
+    def counted_run():
+        entry.runs += 1
+        return run()
+    return counted_run
+
+class Cell:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+# What the nodes of one quickened program share.
+class Frame:
+    def __init__(self, environment, output, trace, budget, statistics):
+        self.environment = environment
+        # name -> Cell
+        self.cells = {}
+        self.output = output
+        self.trace = trace
+        self.budget = budget
+        self.statistics = statistics
+
+    def cell(self, name):
+        cell = self.cells.get(name)
+        if cell is None:
+            cell = self.cells[name] = Cell(self.environment.get(name, UNASSIGNED))
+        return cell
+
+    # The assigned variables by name, as evaluate() would have them.
+    def variables(self):
+        return {name: cell.value for name, cell in self.cells.items() if cell.value is not UNASSIGNED}
+
+# A node that rewrites itself. run holds its current form.
+class Node:
+    __slots__ = ("frame", "run", "form", "count", "deoptimisations")
+
+    def __init__(self, frame, run, form):
+        self.frame = frame
+        self.count = 0
+        self.deoptimisations = 0
+        self.rewrite(run, form)
+
+    def rewrite(self, run, form):
+        statistics = self.frame.statistics
+        if statistics is not None:
+            entry = statistics.form(form)
+            entry.rewrites += 1
+            run = counted(run, entry)
+        self.form = form
+        self.run = run
+
+    # The guard of the current form failed: go back to the generic form and
+    # let it work out this run's value.
+    def deoptimise(self):
+        statistics = self.frame.statistics
+        if statistics is not None:
+            statistics.form(self.form).misses += 1
+        self.deoptimisations += 1
+        self.count = 0
+        self.rewrite(self.run_generic, GENERIC)
+        return self.run_generic()
+
+class Constant(Node):
+    __slots__ = ("value",)
+
+    def __init__(self, frame, value):
+        self.value = value
+        super().__init__(frame, self.run_constant, CONSTANT)
+
+    def run_constant(self):
+        return self.value
+
+class Identifier(Node):
+    __slots__ = ("name", "cell")
+
+    def __init__(self, frame, name):
+        self.name = name
+        self.cell = frame.cell(name)
+        super().__init__(frame, self.run_generic, GENERIC)
+
+    def run_generic(self):
+        value = self.frame.cells[self.name].value
+        if value is UNASSIGNED:
+            raise KeyError(self.name)
+        self.count += 1
+        if self.count >= THRESHOLD:
+            self.specialise()
+        return value
+
+    def specialise(self):
+        cell = self.cell
+        deoptimise = self.deoptimise
+        def run():
+            value = cell.value
+            if value is UNASSIGNED:
+                return deoptimise()
+            return value
+        self.rewrite(run, CACHED_SLOT)
+
+class Assignment(Node):
+    __slots__ = ("name", "cell", "expression")
+
+    def __init__(self, frame, name, expression):
+        self.name = name
+        self.cell = frame.cell(name)
+        self.expression = expression
+        super().__init__(frame, self.run_generic, GENERIC)
+
+    def run_generic(self):
+        x = self.expression.run()
+        self.frame.cells[self.name].value = x
+        if self.frame.trace is not None:
+            self.frame.trace("assignment", self.name, x)
+        self.count += 1
+        if self.count >= THRESHOLD:
+            self.specialise()
+        return x
+
+    def specialise(self):
+        cell = self.cell
+        expression = self.expression
+        trace = self.frame.trace
+        if trace is None:
+            def run():
+                x = expression.run()
+                cell.value = x
+                return x
+        else:
+            name = self.name
+            def run():
+                x = expression.run()
+                cell.value = x
+                trace("assignment", name, x)
+                return x
+        self.rewrite(run, CACHED_SLOT)
+
+class Binary(Node):
+    __slots__ = ("operator", "left", "right", "function", "typed", "seen")
+
+    # A comparison built as a condition gives True or False.
+    def __init__(self, frame, operator, left, right, condition=False):
+        assert operator in binary_operations
+        self.operator = operator
+        self.left = left
+        self.right = right
+        if condition and operator in comparisons:
+            self.function = self.typed = comparisons[operator]
+        else:
+            self.function = binary_operations[operator]
+            self.typed = typed_operations[operator]
+        # the operand types of the runs counted so far
+        self.seen = None
+        super().__init__(frame, self.run_generic, GENERIC)
+
+    def run_generic(self):
+        x = self.left.run()
+        y = self.right.run()
+        seen = (type(x), type(y))
+        if seen == self.seen:
+            self.count += 1
+            if self.count >= THRESHOLD:
+                self.specialise()
+        else:
+            if self.seen is not None:
+                # the types changed before the node could specialise, which
+                # counts against it like a deoptimisation
+                self.deoptimisations += 1
+                if self.deoptimisations >= MAX_DEOPTIMISATIONS:
+                    self.rewrite(self.run_megamorphic, MEGAMORPHIC)
+            self.seen = seen
+            self.count = 1
+        return self.function(x, y)
+
+    def run_megamorphic(self):
+        return self.function(self.left.run(), self.right.run())
+
+    def specialise(self):
+        if self.deoptimisations >= MAX_DEOPTIMISATIONS:
+            self.rewrite(self.run_megamorphic, MEGAMORPHIC)
+            return
+        left_type, right_type = self.seen
+        left, right = self.left, self.right
+        function = self.typed
+        deoptimise = self.deoptimise
+        # The type checks also catch a variable with no value, which is not
+        # an int or a float.
+        if type(left) is Identifier and type(right) is Constant:
+            cell, y = left.cell, right.value
+            def run():
+                x = cell.value
+                if type(x) is left_type:
+                    return function(x, y)
+                return deoptimise()
+        elif type(left) is Identifier and type(right) is Identifier:
+            left_cell, right_cell = left.cell, right.cell
+            def run():
+                x = left_cell.value
+                y = right_cell.value
+                if type(x) is left_type and type(y) is right_type:
+                    return function(x, y)
+                return deoptimise()
+        else:
+            def run():
+                x = left.run()
+                y = right.run()
+                if type(x) is left_type and type(y) is right_type:
+                    return function(x, y)
+                return deoptimise()
+        self.rewrite(run, f"{left_type.__name__}{self.operator}{right_type.__name__}")
+
+class Unary:
+    __slots__ = ("function", "expression")
+
+    def __init__(self, operator, expression):
+        assert operator in unary_operations
+        self.function = unary_operations[operator]
+        self.expression = expression
+
+    def run(self):
+        return self.function(self.expression.run())
+
+class Logical:
+    __slots__ = ("operator", "left", "right")
+
+    def __init__(self, operator, left, right):
+        self.operator = operator
+        self.left = left
+        self.right = right
+
+    def run(self):
+        x = self.left.run()
+        if self.operator == "&&":
+            return 1 if x and self.right.run() else 0
+        return 1 if x or self.right.run() else 0
+
+class Block:
+    __slots__ = ("statements",)
+
+    def __init__(self, statements):
+        self.statements = statements
+
+    def run(self):
+        most_recent_value = None
+        for statement in self.statements:
+            most_recent_value = statement.run()
+        return most_recent_value
+
+class Print:
+    __slots__ = ("frame", "expression")
+
+    def __init__(self, frame, expression):
+        self.frame = frame
+        self.expression = expression
+
+    def run(self):
+        x = self.expression.run()
+        self.frame.output.write(x)
+        if self.frame.trace is not None:
+            self.frame.trace("print", None, x)
+        return x
+
+class If:
+    __slots__ = ("frame", "condition", "then", "otherwise")
+
+    def __init__(self, frame, condition, then, otherwise):
+        self.frame = frame
+        self.condition = condition
+        self.then = then
+        self.otherwise = otherwise
+
+    def run(self):
+        taken = self.condition.run()
+        if self.frame.trace is not None:
+            self.frame.trace("branch", "if", bool(taken))
+        if taken:
+            return self.then.run()
+        if self.otherwise is not None:
+            return self.otherwise.run()
+        return None
+
+class While:
+    __slots__ = ("frame", "condition", "do")
+
+    def __init__(self, frame, condition, do):
+        self.frame = frame
+        self.condition = condition
+        self.do = do
+
+    def run(self):
+        frame = self.frame
+        condition = self.condition
+        do = self.do
+        trace = frame.trace
+        budget = frame.budget
+        result = None
+        while True:
+            # condition.run is looked up every time, as it may have rewritten
+            # itself
+            taken = condition.run()
+            if trace is not None:
+                trace("branch", "while", bool(taken))
+            if not taken:
+                return result
+            if budget is not None:
+                budget.count += 1
+                if budget.count >= budget.next_check:
+                    budget.check(frame.variables())
+            result = do.run()
+
+# Turn an AST into nodes sharing frame. condition is set for the condition of
+# an if or while.
+def quicken(node, frame, condition=False):
+    if type(node) is dict:
+        t = node["type"]
+        if t == "program" or t == "block":
+            return Block([quicken(statement, frame) for statement in node["statements"]])
+        if t == "print":
+            return Print(frame, quicken(node["expression"], frame))
+        if t == "if":
+            otherwise = quicken(node["else"], frame) if node["else"] else None
+            return If(frame, quicken(node["condition"], frame, True),
+                      quicken(node["then"], frame), otherwise)
+        if t == "while":
+            return While(frame, quicken(node["condition"], frame, True), quicken(node["do"], frame))
+        if t == "assignment":
+            return Assignment(frame, node["name"], quicken(node["expression"], frame))
+        if t == "binary":
+            return Binary(frame, node["operator"], quicken(node["left"], frame),
+                          quicken(node["right"], frame), condition)
+        if t == "logical":
+            return Logical(node["operator"], quicken(node["left"], frame), quicken(node["right"], frame))
+        if t == "unary":
+            return Unary(node["operator"], quicken(node["expression"], frame))
+        if t == "identifier":
+            return Identifier(frame, node["name"])
+    if type(node) in [float, int]:
+        return Constant(frame, node)
+    raise Exception(f"Unknown content in AST={node}")
+
+# Quicken and run a node against the environment, the evaluator's by
+# default, which gets the variables back afterwards, so programs run one
+# after another share them just as they do with evaluate().
+def evaluate_quickened(node, statistics=None, environment=None):
+    if environment is None:
+        environment = evaluator.environment
+    frame = Frame(environment, evaluator.output, evaluator.trace, evaluator.budget, statistics)
+    tree = quicken(node, frame)
+    try:
+        return tree.run()
+    finally:
+        environment.update(frame.variables())
+
+from tokenizer import tokenize
+from parser import parse
+from evaluator import run_captured
+
+def test_quickened_matches_evaluate():
+    print("testing quickened nodes against evaluate")
+    with open("example.t") as f:
+        source = f.read()
+    for program in [
+        source,
+        "x = 23; x = x - 1; x = x - 1; y = x; x = x - 1 + y;",
+        "if (0) {j=1; k=2;} else {j=0; k=1;}",
+        "k = 10; s = 0; while (k) { s = s + k * 2; k = k - 1; }",
+        "i = 0; n = 20; s = 0; while (i < n) { if (i >= 2 && !(i == 3) || s > 100) s = s + i; i = i + 1; }",
+        "x = 1; print 0 && 1 / 0; print 1 || q; print x && 0.5; print (x < 3) + !x;",
+        # s turns from an int to a float, and v changes type every other time round
+        "i = 0; s = 0; t = 0; while (i < 30) { if (t) v = 1.5; else v = 2; t = !t; s = s + v * i; i = i + 1; }",
+        "n = 25; f = 1; while (n > 0) { f = f * n; n = n - 1; } print f / 3; print -f;",
+    ]:
+        expected = run_captured(evaluator.evaluate, program)
+        assert run_captured(evaluate_quickened, program) == expected, program
+
+def test_specialisation():
+    print("testing specialised forms")
+    statistics = Statistics()
+    evaluator.environment.clear()
+    evaluate_quickened(parse(tokenize("i = 0; s = 0; while (i < 100) { s = s + i * 2.5; i = i + 1; }")),
+                       statistics)
+    assert evaluator.environment == {"i": 100, "s": 12375.0}
+    forms = statistics.forms
+    assert set(forms) == {GENERIC, CONSTANT, CACHED_SLOT, "int<int", "int*float", "int+int",
+                          "float+float"}
+    # i < 100 and i + 1 specialise once, after THRESHOLD runs, and never miss
+    assert forms["int<int"].rewrites == 1 and forms["int<int"].misses == 0
+    assert forms["int<int"].hits == 101 - THRESHOLD
+    assert forms["int+int"].hits == 100 - THRESHOLD
+    # s = s + ... sees int + float once, then float + float
+    assert forms["float+float"].hits == 99 - THRESHOLD
+    assert sum(entry.misses for entry in forms.values()) == 0
+
+def test_deoptimisation():
+    print("testing deoptimisation")
+    # x is an int for the first 10 times round and a float after that, so
+    # x + 1 specialises to int+int, misses once and specialises again
+    statistics = Statistics()
+    evaluator.environment.clear()
+    evaluate_quickened(parse(tokenize("i = 0; x = 0; while (i < 20) { if (i == 10) x = 0.5; y = x + 1; i = i + 1; }")),
+                       statistics)
+    assert evaluator.environment == {"i": 20, "x": 0.5, "y": 1.5}
+    forms = statistics.forms
+    # i + 1 is int+int too
+    assert forms["int+int"].rewrites == 2 and forms["int+int"].misses == 1
+    assert forms["float+int"].rewrites == 1 and forms["float+int"].misses == 0
+    assert forms["float+int"].runs == 10 - THRESHOLD
+
+def test_megamorphic():
+    print("testing megamorphic nodes")
+    # v is an int for four times round and a float for four, over and over
+    statistics = Statistics()
+    evaluator.environment.clear()
+    program = ("i = 0; s = 0.0; c = 0; v = 1; while (i < 100) {"
+               " if (c == 4) { c = 0; if (v == 1) v = 0.5; else v = 1; }"
+               " s = s + v; c = c + 1; i = i + 1; }")
+    expected = run_captured(evaluator.evaluate, program)
+    evaluator.environment.clear()
+    assert run_captured(lambda ast: evaluate_quickened(ast, statistics), program) == expected
+    forms = statistics.forms
+    # s + v specialises to float+int, misses, specialises to float+float,
+    # misses, and sees its types change once more; v == 1 sees them change
+    # every time it runs
+    assert forms[MEGAMORPHIC].rewrites == 2
+    assert forms["float+int"].misses == 1 and forms["float+float"].misses == 1
+
+def test_quickened_trace_events():
+    print("testing quickened trace events")
+    from tracing import EventBuffer, traced
+    for program in ["k = 5; while (k) k = k - 1; if (k) print 1; else print 2;",
+                    "k = 0; while (k < 6) k = k + 1; if (k == 6) print 1; if (k > 6 || 0) print 2;"]:
+        with traced(EventBuffer()) as expected:
+            evaluator.evaluate(parse(tokenize(program)))
+        with traced(EventBuffer()) as events:
+            evaluate_quickened(parse(tokenize(program)))
+        assert events.events == expected.events
+
+def test_unassigned_variable():
+    print("testing an unassigned variable")
+    for program in ["if (0) q = 1; print q;",
+                    # q has been specialised by the time p is read
+                    "i = 0; while (i < 10) { if (i < 8) q = i + 1; else q = p + 1; i = i + 1; }"]:
+        evaluator.environment.clear()
+        try:
+            evaluate_quickened(parse(tokenize(program)))
+        except KeyError as e:
+            assert e.args[0] in ["q", "p"]
+        else:
+            assert False, "Expected KeyError"
+    # the variables assigned before the error are kept
+    assert evaluator.environment["i"] == 8
+
+def test_shared_environment():
+    print("testing quickened programs share the environment")
+    evaluator.environment.clear()
+    evaluate_quickened(parse(tokenize("x=4;y=5;")))
+    assert evaluate_quickened(parse(tokenize("print x+3;"))) == 7
+
+def test_report():
+    print("testing the statistics report")
+    import io
+    statistics = Statistics()
+    evaluator.environment.clear()
+    evaluate_quickened(parse(tokenize("k = 10; while (k) k = k - 1;")), statistics)
+    f = io.StringIO()
+    statistics.report(f)
+    lines = f.getvalue().splitlines()
+    assert lines[0].split() == ["form", "rewrites", "runs", "hits", "misses", "hit", "rate"]
+    assert [line.split()[0] for line in lines[1:]] == [GENERIC, CACHED_SLOT, "int-int", CONSTANT]
+
+if __name__ == "__main__":
+    test_quickened_matches_evaluate()
+    test_specialisation()
+    test_deoptimisation()
+    test_megamorphic()
+    test_quickened_trace_events()
+    test_unassigned_variable()
+    test_shared_environment()
+    test_report()
+    print("done")
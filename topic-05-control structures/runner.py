@@ -1,41 +1,195 @@
+import argparse
 import sys
 
-from tokenizer import tokenize
+from tokenizer import scan_stream
 
-from parser import parse
+from parser import parse, parse_statements
 
-from evaluator import evaluate
+from evaluator import evaluate, set_trace, set_output, set_budget
+
+from budget import Budget, BudgetExceeded
+
+from tracing import EnvironmentPrinter
+
+from output import output_sinks
+
+from optimizer import optimize
+
+from closures import evaluate_compiled
+
+from bytecode import evaluate_bytecode
+
+from slots import evaluate_with_slots
+
+from quickening import evaluate_quickened, Statistics
+
+from transpiler import evaluate_transpiled
+
+from cache import load_program
+
+from session import Session
+
+from profiler import Profiler, parse_with_locations
+
+import evaluator
+
+# execution modes for --mode
+modes = {
+    "evaluate": evaluate,
+    "closures": evaluate_compiled,
+    "bytecode": evaluate_bytecode,
+    "slots": evaluate_with_slots,
+    "quickened": evaluate_quickened,
+    "python": evaluate_transpiled,
+}
 
 def main():
+    argument_parser = argparse.ArgumentParser(description="Run a program, or start a REPL.")
+    argument_parser.add_argument("filename", nargs="?", help="program to run")
+    argument_parser.add_argument("--stream", action="store_true",
+        help="read, parse and run the file one statement at a time, so memory "
+             "does not grow with the size of the file (statements before a "
+             "syntax error will already have run)")
+    argument_parser.add_argument("--trace", action="store_true",
+        help="print the environment after every assignment")
+    argument_parser.add_argument("--output", choices=["stdout", "buffered", "null"],
+        default="stdout",
+        help="where print statements go: straight to stdout (the default), "
+             "to stdout through a buffer, or nowhere")
+    argument_parser.add_argument("-O", "--optimize", type=int, choices=[0, 1, 2], default=0,
+        help="optimisation level: 0 none, 1 constant folding and dead branch "
+             "removal, 2 also algebraic simplification")
+    argument_parser.add_argument("--parser", choices=["recursive", "iterative"], default="recursive",
+        help="the iterative parser uses explicit stacks, so deeply nested "
+             "programs cannot hit Python's recursion limit")
+    argument_parser.add_argument("--mode", choices=list(modes), default="evaluate",
+        help="how to run the program: walk the AST (the default), compile it "
+             "to closures, to bytecode for the stack VM, walk it with "
+             "slot-resolved variables, run it as nodes that specialise "
+             "themselves, or translate it to Python")
+    argument_parser.add_argument("--no-cache", action="store_true",
+        help="always tokenize and parse the file, without reading or writing "
+             "the parsed program in __tcache__")
+    argument_parser.add_argument("--max-iterations", type=int,
+        help="stop the program after this many loop iterations")
+    argument_parser.add_argument("--timeout", type=float,
+        help="stop the program after this many seconds")
+    argument_parser.add_argument("--max-memory", type=int,
+        help="stop the program when its variables take roughly this many bytes")
+    argument_parser.add_argument("--profile", action="store_true",
+        help="run the file with the AST evaluator while timing every "
+             "statement and expression, and print the ones that took longest "
+             "to stderr")
+    argument_parser.add_argument("--profile-top", type=int, default=20,
+        help="nodes in the profile report (default: 20)")
+    argument_parser.add_argument("--flamegraph", metavar="FILE",
+        help="with --profile, also write the time for every stack of nodes "
+             "to FILE in the collapsed-stack format flamegraph tools read")
+    argument_parser.add_argument("--quickening-stats", action="store_true",
+        help="with --mode quickened, print how often each specialised form "
+             "of a node ran and how often its guard failed, to stderr")
+    args = argument_parser.parse_args()
+    if args.profile and (not args.filename or args.stream or args.mode != "evaluate"):
+        argument_parser.error("--profile needs a filename, without --stream, and --mode evaluate")
+    if args.flamegraph and not args.profile:
+        argument_parser.error("--flamegraph needs --profile")
+    if args.quickening_stats and args.mode != "quickened":
+        argument_parser.error("--quickening-stats needs --mode quickened")
+    run = modes[args.mode]
+    statistics = None
+    if args.quickening_stats:
+        statistics = Statistics()
+        run = lambda ast: evaluate_quickened(ast, statistics)
+    iterative = args.parser == "iterative"
+
+    if args.trace:
+        set_trace(EnvironmentPrinter())
+    output = output_sinks[args.output]()
+    set_output(output)
+    budget = None
+    if args.max_iterations is not None or args.timeout is not None or args.max_memory is not None:
+        budget = Budget(args.max_iterations, args.timeout, args.max_memory)
+        set_budget(budget)
+
     # Check for command line arguments
-    if len(sys.argv) > 1:
-        # Filename provided, read and execute it
-        with open(sys.argv[1], 'r') as f:
-            source_code = f.read()
-        
-        tokens = tokenize(source_code)
-        ast = parse(tokens)
-        evaluate(ast)
+    if args.filename and args.stream:
+        try:
+            with open(args.filename, 'r') as f:
+                for statement in parse_statements(scan_stream(f), iterative):
+                    run(optimize(statement, args.optimize))
+        except BudgetExceeded as e:
+            sys.exit(f"Error: {e}")
+        finally:
+            output.flush()
+            if statistics is not None:
+                statistics.report(sys.stderr)
+
+    elif args.filename and args.profile:
+        # Parse the file afresh, so statements keep their line numbers, and
+        # run it on a Profiler
+        with open(args.filename) as f:
+            ast, locations = parse_with_locations(f.read(), iterative)
+        ast = optimize(ast, args.optimize)
+        profiler = Profiler(evaluator.environment, output, evaluator.trace, budget, locations)
+        if budget is not None:
+            budget.reset()
+        try:
+            profiler.evaluate(ast)
+        except BudgetExceeded as e:
+            sys.exit(f"Error: {e}")
+        finally:
+            output.flush()
+            profiler.report(sys.stderr, args.profile_top)
+            if args.flamegraph:
+                with open(args.flamegraph, "w") as f:
+                    profiler.write_collapsed(f)
+
+    elif args.filename:
+        # Filename provided, load it (from the cache if it is up to date) and execute it
+        ast = load_program(args.filename, args.optimize, iterative, use_cache=not args.no_cache)
+        if budget is not None:
+            budget.reset()
+        try:
+            run(ast)
+        except BudgetExceeded as e:
+            sys.exit(f"Error: {e}")
+        finally:
+            output.flush()
+            if statistics is not None:
+                statistics.report(sys.stderr)
 
     else:
-        # REPL loop
+        # REPL loop. Input is buffered until it makes complete statements
+        # (see session.py); ':ast' toggles showing the AST of each snippet
+        # and ':env' shows the variables.
+        session = Session(args.mode, args.optimize, iterative)
         while True:
             try:
                 # Read input
-                source_code = input('>> ')
+                source_code = input('.. ' if session.pending else '>> ')
+            except EOFError:
+                break
 
+            if not session.pending:
                 # Exit condition for the REPL loop
-                if source_code.strip() in ['exit', 'quit']:
+                command = source_code.strip()
+                if command in ['exit', 'quit']:
                     break
+                if command == ':ast':
+                    session.show_ast = not session.show_ast
+                    continue
+                if command == ':env':
+                    print(session.environment)
+                    continue
 
-                # Tokenize, parse, and execute the code
-                tokens = tokenize(source_code)
-                ast = parse(tokens)
-                print(ast)
-                evaluate(ast)
+            try:
+                if budget is not None and not session.pending:
+                    budget.reset()
+                session.feed(source_code)
             except Exception as e:
                 print(f"Error: {e}")
+            finally:
+                output.flush()
 
 if __name__ == "__main__":
     main()
-
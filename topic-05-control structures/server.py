@@ -0,0 +1,369 @@
+import argparse
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from interpreter import Interpreter
+from budget import Budget
+
+# An evaluation server, so a service can run programs without starting
+# runner.py for every request.
+#
+# Clients connect over TCP or a Unix socket and send requests as JSON lines,
+#
+#   {"source": "k = 3; while (k) { print k; k = k - 1; }"}
+#
+# and for each request get back, also as JSON lines, every printed value as
+# it is produced, then the value of the program or its error:
+#
+#   {"print": 3}
+#   {"print": 2}
+#   {"print": 1}
+#   {"result": 0}            or   {"error": "Expected ';'"}
+#
+# A connection can send any number of requests, one after another.
+#
+# Programs run on a thread pool, each on its own Interpreter, so the event
+# loop is never blocked. At most `limit` programs run at once; further
+# requests wait their turn. Printed values travel from the worker to the
+# connection in batches, and a worker may only have `window` batches that the
+# client has not taken yet: a client that reads slowly makes the worker wait
+# in its next print rather than letting output pile up in memory. If the
+# client goes away, the program stops at its next print. Given limits, every
+# program runs under its own Budget (see budget.py), so a 'while (1) {}' ends
+# with an error instead of holding a worker forever.
+
+class Cancelled(Exception):
+    pass
+
+class StreamingOutput:
+    "Output sink for a worker thread: hands printed values to the event loop in batches."
+    def __init__(self, loop, queue, window=16, batch_size=256, interval=0.05):
+        self.loop = loop
+        self.queue = queue
+        self.credits = threading.Semaphore(window)
+        self.batch_size = batch_size
+        self.interval = interval
+        # guards the batch, which the event loop's timer may also send
+        self.lock = threading.Lock()
+        self.batch = []
+        # whether a timer is set to send the batch
+        self.timed = False
+        self.sent = time.monotonic()
+        self.cancelled = False
+
+    def write(self, value):
+        with self.lock:
+            self.batch.append(value)
+            if len(self.batch) == 1 and not self.timed:
+                # the first value of a batch waits at most `interval`, even
+                # if the program prints nothing more for a long time
+                self.timed = True
+                self.loop.call_soon_threadsafe(self.loop.call_later, self.interval, self.send_waiting)
+        # a batch goes when it is full, or at once when the last one went
+        # long enough ago, so slow programs still stream
+        if len(self.batch) >= self.batch_size or time.monotonic() - self.sent >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        while not self.credits.acquire(timeout=0.1):
+            if self.cancelled:
+                raise Cancelled("client went away")
+        if self.cancelled:
+            raise Cancelled("client went away")
+        with self.lock:
+            if not self.batch:
+                # the timer sent it first
+                self.credits.release()
+                return
+            self.send()
+
+    # Hand the batch over. Called holding the lock and a credit.
+    def send(self):
+        batch, self.batch = self.batch, []
+        self.sent = time.monotonic()
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, batch)
+
+    # On the event loop: send the batch that has waited `interval`, unless
+    # the worker already has. Without a credit to send it, try again later.
+    def send_waiting(self):
+        with self.lock:
+            self.timed = False
+            if not self.batch or self.cancelled:
+                return
+            if not self.credits.acquire(blocking=False):
+                self.timed = True
+                self.loop.call_later(self.interval, self.send_waiting)
+                return
+            self.send()
+
+def run_program(source, sink, limits):
+    budget = Budget(**limits) if limits else None
+    result = Interpreter(sink, budget=budget).run(source)
+    sink.flush()
+    return result
+
+class Server:
+    def __init__(self, workers=4, limit=None, window=16, batch_size=256, limits=None):
+        self.pool = ThreadPoolExecutor(workers)
+        # keyword arguments for each program's Budget
+        self.limits = limits or {}
+        self.limit = asyncio.Semaphore(limit or workers)
+        self.window = window
+        self.batch_size = batch_size
+        # programs running now, and the most there have been at once
+        self.running = 0
+        self.peak = 0
+        # open connections, writer -> the task handling it
+        self.connections = {}
+
+    async def serve_tcp(self, host="127.0.0.1", port=8765):
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def serve_unix(self, path):
+        return await asyncio.start_unix_server(self.handle, path)
+
+    # Close every open connection and wait for their programs to stop.
+    async def close(self):
+        for writer in list(self.connections):
+            writer.close()
+        await asyncio.gather(*self.connections.values(), return_exceptions=True)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def handle(self, reader, writer):
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    source = json.loads(line)["source"]
+                except (ValueError, KeyError, TypeError):
+                    await send(writer, [{"error": "Expected a JSON object with a 'source'"}])
+                    continue
+                async with self.limit:
+                    await self.run_request(source, writer)
+        except (ConnectionError, Cancelled):
+            pass
+        finally:
+            del self.connections[writer]
+            writer.close()
+
+    async def run_request(self, source, writer):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        sink = StreamingOutput(loop, queue, self.window, self.batch_size)
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        future = loop.run_in_executor(self.pool, run_program, source, sink, self.limits)
+        future.add_done_callback(lambda _: queue.put_nowait(None))
+        try:
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    break
+                await send(writer, [{"print": value} for value in batch])
+                sink.credits.release()
+        except BaseException:
+            # stop the worker at its next print, and wait for it to finish
+            sink.cancelled = True
+            await asyncio.gather(future, return_exceptions=True)
+            raise
+        finally:
+            self.running -= 1
+        try:
+            result = await future
+        except Exception as e:
+            await send(writer, [{"error": str(e)}])
+        else:
+            await send(writer, [{"result": result}])
+
+async def send(writer, messages):
+    writer.write("".join(json.dumps(message) + "\n" for message in messages).encode())
+    await writer.drain()
+
+# Send one program on an open connection and read its replies. Returns the
+# printed values and the final message.
+async def submit(reader, writer, source):
+    writer.write((json.dumps({"source": source}) + "\n").encode())
+    await writer.drain()
+    printed = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("server closed the connection")
+        message = json.loads(line)
+        if "print" in message:
+            printed.append(message["print"])
+        else:
+            return printed, message
+
+async def serve(args):
+    limits = {}
+    if args.max_iterations is not None:
+        limits["iterations"] = args.max_iterations
+    if args.timeout is not None:
+        limits["seconds"] = args.timeout
+    if args.max_memory is not None:
+        limits["memory"] = args.max_memory
+    server = Server(args.workers, args.limit, args.window, limits=limits)
+    if args.unix:
+        listener = await server.serve_unix(args.unix)
+    else:
+        listener = await server.serve_tcp(args.host, args.port)
+    addresses = ", ".join(str(socket.getsockname()) for socket in listener.sockets)
+    print(f"serving on {addresses}")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await server.close()
+
+def main():
+    argument_parser = argparse.ArgumentParser(description="Serve program evaluation over a socket.")
+    argument_parser.add_argument("--host", default="127.0.0.1")
+    argument_parser.add_argument("--port", type=int, default=8765)
+    argument_parser.add_argument("--unix", help="listen on this Unix socket instead of TCP")
+    argument_parser.add_argument("--workers", type=int, default=4,
+        help="threads running programs")
+    argument_parser.add_argument("--limit", type=int,
+        help="programs allowed to run at once (default: the number of workers)")
+    argument_parser.add_argument("--window", type=int, default=16,
+        help="batches of printed values a program may have in flight")
+    argument_parser.add_argument("--max-iterations", type=int,
+        help="stop each program after this many loop iterations")
+    argument_parser.add_argument("--timeout", type=float,
+        help="stop each program after this many seconds")
+    argument_parser.add_argument("--max-memory", type=int,
+        help="stop each program when its variables take roughly this many bytes")
+    args = argument_parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+# Run test(server, address) against a server on a free local port.
+def with_server(test, **options):
+    async def run():
+        server = Server(**options)
+        listener = await server.serve_tcp("127.0.0.1", 0)
+        try:
+            return await test(server, listener.sockets[0].getsockname()[:2])
+        finally:
+            listener.close()
+            await server.close()
+            await listener.wait_closed()
+    return asyncio.run(run())
+
+def test_streamed_output():
+    print("testing streamed output")
+    async def test(server, address):
+        reader, writer = await asyncio.open_connection(*address)
+        printed, final = await submit(reader, writer, "k = 3; while (k) { print k; k = k - 1; }")
+        assert printed == [3, 2, 1]
+        assert final == {"result": 0} and type(final["result"]) is int
+        # errors are reported, and the connection can be used again
+        assert await submit(reader, writer, "x = ;") == ([], {"error": "Unexpected token in factor"})
+        assert await submit(reader, writer, "print 1 / 0;") == ([], {"error": "division by zero"})
+        assert await submit(reader, writer, "print 1.0 / 0;") == ([], {"error": "float division by zero"})
+        assert await submit(reader, writer, "x = 2;") == ([], {"result": 2})
+        writer.close()
+    with_server(test)
+
+def test_output_before_a_long_loop():
+    print("testing output is sent before a long loop ends")
+    async def test(server, address):
+        reader, writer = await asyncio.open_connection(*address)
+        start = time.monotonic()
+        writer.write((json.dumps({"source": "print 1; k = 200000; while (k) k = k - 1;"}) + "\n").encode())
+        await writer.drain()
+        assert json.loads(await reader.readline()) == {"print": 1}
+        printed_after = time.monotonic() - start
+        assert json.loads(await reader.readline()) == {"result": 0}
+        finished_after = time.monotonic() - start
+        assert printed_after < 0.5 and printed_after < finished_after / 2, (printed_after, finished_after)
+        writer.close()
+    # a budget turns closed-form loops off, so the loop goes round
+    with_server(test, limits={"iterations": 10 ** 9})
+
+def test_large_output():
+    print("testing large streamed output")
+    async def test(server, address):
+        reader, writer = await asyncio.open_connection(*address)
+        printed, final = await submit(reader, writer, "k = 20000; while (k) { print k; k = k - 1; }")
+        assert printed == list(range(20000, 0, -1))
+        assert final == {"result": 0}
+        writer.close()
+    with_server(test, window=2, batch_size=16)
+
+def test_back_pressure():
+    print("testing back-pressure")
+    async def test():
+        queue = asyncio.Queue()
+        sink = StreamingOutput(asyncio.get_running_loop(), queue, window=2, batch_size=1)
+        worker = threading.Thread(target=lambda: [sink.write(n) for n in range(5)])
+        worker.start()
+        # nobody takes the batches, so the worker stops once two are in flight
+        await asyncio.sleep(0.3)
+        assert worker.is_alive() and queue.qsize() == 2
+        for expected in range(5):
+            assert await queue.get() == [expected]
+            sink.credits.release()
+        await asyncio.to_thread(worker.join)
+        # a worker waiting for credit stops when the client goes away
+        sink.cancelled = True
+        sink.credits = threading.Semaphore(0)
+        try:
+            sink.write(5)
+        except Cancelled:
+            pass
+        else:
+            assert False, "Expected the program to be cancelled"
+    asyncio.run(test())
+
+def test_concurrency_limit():
+    print("testing the concurrency limit")
+    async def test(server, address):
+        async def client(n):
+            reader, writer = await asyncio.open_connection(*address)
+            try:
+                return await submit(reader, writer, f"k = {n}; s = 0; while (k) {{ s = s + k; k = k - 1; }}")
+            finally:
+                writer.close()
+        results = await asyncio.gather(*[client(2000 + n) for n in range(6)])
+        assert [final for _, final in results] == [{"result": 0}] * 6
+        assert server.peak == 2
+    with_server(test, workers=4, limit=2)
+
+def test_budget():
+    print("testing program budgets")
+    async def test(server, address):
+        reader, writer = await asyncio.open_connection(*address)
+        assert await submit(reader, writer, "while (1) {}") == (
+            [], {"error": "Time budget of 0.1s exceeded"})
+        assert await submit(reader, writer, "k = 5; while (k) k = k - 1;") == ([], {"result": 0})
+        writer.close()
+    with_server(test, limits={"seconds": 0.1})
+
+def test_client_going_away():
+    print("testing a client going away")
+    async def test(server, address):
+        reader, writer = await asyncio.open_connection(*address)
+        writer.write((json.dumps({"source": "while (1) print 1;"}) + "\n").encode())
+        await writer.drain()
+        await reader.readline()
+        writer.close()
+        for _ in range(100):
+            if server.running == 0:
+                break
+            await asyncio.sleep(0.05)
+        assert server.running == 0
+    with_server(test, window=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+import parser
+import evaluator
+from evaluator import Evaluator
+from token_table import TokenTable, scan_table, END, LEFT_BRACE, RIGHT_BRACE
+from optimizer import optimize
+from closures import compile_closures
+from bytecode import compile_bytecode, run
+from slots import evaluate_with_slots
+from quickening import evaluate_quickened
+from transpiler import compile_python
+
+# A REPL session. Lines are fed in one at a time and buffered until they make
+# complete statements: the braces balance and the buffered tokens parse. An
+# if statement without an else at the end of the buffer, even one ending a
+# while or another if's else, also waits for the next line, which may start
+# with 'else'; the statements before it run at once, so only the if stays
+# buffered. A blank line runs whatever is buffered, so a broken snippet
+# reports its error instead of waiting for more input.
+#
+# Every complete snippet is compiled once, for the session's mode, and kept
+# by its source text, so typing the same input again skips the tokenizer,
+# parser, optimizer and compiler. The variables live in the session's own
+# environment, which every snippet is given to run against, so nothing is
+# shared with the module-level evaluate() or with another session. The
+# evaluator's trace hook, output sink and budget are looked up when a snippet
+# is compiled.
+
+# For each --mode, a function that compiles an AST into a callable taking the
+# environment.
+def compile_evaluate(ast):
+    output, trace, budget = evaluator.output, evaluator.trace, evaluator.budget
+    return lambda environment: Evaluator(environment, output, trace, budget).evaluate(ast)
+
+def compile_bytecode_runner(ast):
+    code = compile_bytecode(ast)
+    return lambda environment: run(code, environment)
+
+def compile_slots(ast):
+    return lambda environment: evaluate_with_slots(ast, environment)
+
+def compile_quickened(ast):
+    return lambda environment: evaluate_quickened(ast, environment=environment)
+
+def compile_transpiled(ast):
+    try:
+        program = compile_python(ast)
+    except (SyntaxError, RecursionError, MemoryError):
+        return compile_closures(ast)
+    return lambda environment: program(environment, evaluator.output.write, evaluator.trace,
+                                       evaluator.budget)
+
+snippet_compilers = {
+    "evaluate": compile_evaluate,
+    "closures": compile_closures,
+    "bytecode": compile_bytecode_runner,
+    "slots": compile_slots,
+    "quickened": compile_quickened,
+    "python": compile_transpiled,
+}
+
+# Whether statements end in an if without an else, which the next line could
+# still give one. The if can end another statement, as the body of a while
+# or the else of an if, but not inside braces, which have closed.
+def waits_for_else(statements):
+    node = statements[-1] if statements else None
+    while type(node) is dict:
+        if node["type"] == "if":
+            if node["else"] is None:
+                return True
+            node = node["else"]
+        elif node["type"] == "while":
+            node = node["do"]
+        else:
+            return False
+    return False
+
+class Session:
+    def __init__(self, mode="evaluate", level=0, iterative=False, cache_size=1024):
+        self.compile = snippet_compilers[mode]
+        self.level = level
+        self.iterative = iterative
+        self.cache_size = cache_size
+        self.show_ast = False
+        self.environment = {}
+        self.parser = parser.Parser()
+        # source text -> (ast, compiled snippet, whether it waits for an else)
+        self.snippets = {}
+        self.reset_input()
+
+    def reset_input(self):
+        self.lines = []
+        # the length of the buffered lines joined by newlines
+        self.length = 0
+        self.tokens = TokenTable()
+        self.depth = 0
+
+    # True while buffered lines are waiting for the rest of a statement.
+    @property
+    def pending(self):
+        return bool(self.lines)
+
+    # Add a line of input. Runs the buffered snippet, and returns its value,
+    # once it is complete; returns None while more input is needed. A syntax
+    # error discards the buffered lines.
+    def feed(self, line):
+        if not self.lines:
+            snippet = self.snippets.get(line)
+            if snippet and not snippet[2]:
+                return self.execute(snippet)
+        if not line.strip():
+            if not self.lines:
+                return None
+            return self.complete(True)
+        try:
+            table = scan_table(line)
+        except Exception:
+            self.reset_input()
+            raise
+        offset = self.length + 1 if self.lines else 0
+        self.lines.append(line)
+        self.length = offset + len(line)
+        self.tokens.kinds.extend(table.kinds)
+        self.tokens.values.extend(table.values)
+        self.tokens.starts.extend(start + offset for start in table.starts)
+        self.depth += table.kinds.count(LEFT_BRACE) - table.kinds.count(RIGHT_BRACE)
+        if self.depth > 0:
+            return None
+        return self.complete(False)
+
+    def complete(self, forced):
+        source = "\n".join(self.lines)
+        snippet = self.snippets.get(source)
+        if snippet is not None and (forced or not snippet[2]):
+            self.reset_input()
+            return self.execute(snippet)
+        statements = []
+        # the index of the first token of each statement
+        starts = [0]
+        try:
+            for statement in self.parser.parse_statements(self.tokens, self.iterative):
+                statements.append(statement)
+                starts.append(self.parser.current_token_index)
+        except Exception:
+            # ran out of tokens: wait for the next line, unless told not to
+            if not forced and self.depth == 0 and self.parser.current_kind == END:
+                return None
+            self.reset_input()
+            raise
+        if not forced and waits_for_else(statements):
+            if len(statements) > 1:
+                head = {"type": "program", "statements": statements[:-1]}
+                self.keep_from(starts[-2], source)
+                optimized = optimize(head, self.level)
+                self.execute((optimized, self.compile(optimized), False))
+            return None
+        self.reset_input()
+        return self.execute(self.remember(source, {"type": "program", "statements": statements}))
+
+    # Drop the buffered input before token index start.
+    def keep_from(self, start, source):
+        offset = self.tokens.starts[start]
+        tokens = TokenTable()
+        tokens.kinds = self.tokens.kinds[start:]
+        tokens.values = self.tokens.values[start:]
+        tokens.starts.extend(position - offset for position in self.tokens.starts[start:])
+        self.tokens = tokens
+        self.lines = [source[offset:]]
+        self.length = len(self.lines[0])
+
+    def remember(self, source, ast):
+        if len(self.snippets) >= self.cache_size:
+            # forget the oldest snippet
+            del self.snippets[next(iter(self.snippets))]
+        optimized = optimize(ast, self.level)
+        snippet = self.snippets[source] = (optimized, self.compile(optimized),
+                                           waits_for_else(ast["statements"]))
+        return snippet
+
+    def execute(self, snippet):
+        ast, compiled, _ = snippet
+        if self.show_ast:
+            print(ast)
+        return compiled(self.environment)
+
+from output import ListOutput
+from contextlib import contextmanager
+
+@contextmanager
+def captured_output():
+    saved = evaluator.output
+    sink = ListOutput()
+    evaluator.set_output(sink)
+    try:
+        yield sink.values
+    finally:
+        evaluator.set_output(saved)
+
+def test_multi_line_input():
+    print("testing multi-line input")
+    session = Session()
+    with captured_output() as printed:
+        assert session.feed("k = 3;") == 3
+        for line in ["while (k) {", "    print k;", "    k = k - 1;"]:
+            assert session.feed(line) is None
+            assert session.pending
+        session.feed("}")
+        assert not session.pending
+        session.feed("if (k)")
+        assert session.pending
+        session.feed("    print 1;")
+        assert session.pending
+        session.feed("else")
+        session.feed("    print 2;")
+        assert not session.pending
+        session.feed("if (k) print 3;")
+        session.feed("print 4;")
+    assert printed == [3, 2, 1, 2, 4]
+    assert session.environment == {"k": 0}
+
+def test_blank_line_reports_errors():
+    print("testing a blank line ends incomplete input")
+    session = Session()
+    assert session.feed("x = 1 +") is None
+    try:
+        session.feed("")
+    except Exception:
+        pass
+    else:
+        assert False, "Expected a syntax error"
+    assert not session.pending
+    session.feed("x = 2;")
+    assert session.environment == {"x": 2}
+
+def test_unbalanced_brace():
+    print("testing an unbalanced brace")
+    session = Session()
+    try:
+        session.feed("x = 1; }")
+    except Exception:
+        pass
+    else:
+        assert False, "Expected a syntax error"
+    assert not session.pending
+
+def test_snippet_cache():
+    print("testing the snippet cache")
+    session = Session(mode="closures", cache_size=2)
+    session.feed("x = 0;")
+    for _ in range(3):
+        session.feed("x = x + 1;")
+    assert session.environment == {"x": 3}
+    assert list(session.snippets) == ["x = 0;", "x = x + 1;"]
+    session.feed("y = x;")
+    assert list(session.snippets) == ["x = x + 1;", "y = x;"]
+
+def test_sessions_are_separate():
+    print("testing separate sessions")
+    evaluator.environment.clear()
+    first, second = Session(), Session(mode="bytecode")
+    first.feed("x = 1;")
+    second.feed("x = 2;")
+    first.feed("y = x;")
+    assert first.environment == {"x": 1, "y": 1}
+    assert second.environment == {"x": 2}
+    assert evaluator.environment == {}
+
+def test_trailing_if():
+    print("testing statements before a trailing if run at once")
+    session = Session()
+    with captured_output() as printed:
+        session.feed("x = 1; print 5; if (x) print 6;")
+        # print 5 has run; the if waits in case the next line is an else
+        assert printed == [5] and session.lines == ["if (x) print 6;"]
+        for _ in range(3):
+            assert session.feed("if (x) print 7;") is None
+            assert session.lines == ["if (x) print 7;"]
+        session.feed("else print 8;")
+        session.feed("")
+    assert printed == [5, 6, 7, 7, 7]
+    # only complete snippets are cached
+    assert list(session.snippets) == ["if (x) print 7;\nelse print 8;"]
+
+def test_nested_trailing_if():
+    print("testing an if at the end of another statement")
+    session = Session()
+    with captured_output() as printed:
+        session.feed("x = 0;")
+        # the else on the next line belongs to the if inside
+        assert session.feed("if (x) print 1; else if (x) print 2;") is None
+        session.feed("else print 3;")
+        assert session.feed("k = 2; while (k) if (k > 1) k = k - 1;") is None
+        session.feed("else { print k; k = k - 1; }")
+        # inside braces the if is finished
+        session.feed("{ if (x) print 4; }")
+        assert not session.pending
+    assert printed == [3, 1]
+
+def test_sessions_do_not_touch_the_evaluator():
+    print("testing sessions leave the evaluator's environment alone")
+    evaluator.environment.clear()
+    for mode in snippet_compilers:
+        session = Session(mode=mode)
+        session.feed("x = 1; k = 3; while (k) k = k - 1;")
+        assert session.environment == {"x": 1, "k": 0}, mode
+    assert evaluator.environment == {}
+
+def test_modes_match():
+    print("testing every mode in a session")
+    with open("example.t") as f:
+        lines = f.read().splitlines()
+    results = []
+    for mode in snippet_compilers:
+        session = Session(mode=mode, level=1)
+        with captured_output() as printed:
+            for line in lines:
+                session.feed(line)
+            session.feed("")
+        results.append((printed, session.environment))
+    assert all(result == results[0] for result in results), results
+
+if __name__ == "__main__":
+    test_multi_line_input()
+    test_blank_line_reports_errors()
+    test_unbalanced_brace()
+    test_snippet_cache()
+    test_sessions_are_separate()
+    test_trailing_if()
+    test_nested_trailing_if()
+    test_sessions_do_not_touch_the_evaluator()
+    test_modes_match()
+    print("done")
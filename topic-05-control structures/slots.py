@@ -0,0 +1,203 @@
+import evaluator
+from evaluator import binary_operations, unary_operations, comparisons
+
+# Slot-resolved variables. A resolver pass gives every variable name in a
+# program a fixed slot number, and the slot evaluator keeps the values in a
+# preallocated list indexed by those numbers instead of looking names up in
+# the environment dict on every access.
+
+# marks a slot that has not been assigned yet
+UNASSIGNED = object()
+
+# Return a copy of the AST where every identifier and assignment node also has
+# a "slot" key. slot_numbers maps names to slots and is extended with any new
+# names, in order of first appearance.
+def resolve(node, slot_numbers):
+    if type(node) is dict:
+        resolved = {}
+        for key, value in node.items():
+            if type(value) is list:
+                resolved[key] = [resolve(item, slot_numbers) for item in value]
+            else:
+                resolved[key] = resolve(value, slot_numbers)
+        if node["type"] in ["identifier", "assignment"]:
+            resolved["slot"] = slot_numbers.setdefault(node["name"], len(slot_numbers))
+        return resolved
+    return node
+
+# The environment as evaluate() would show it: the assigned slots by name.
+def slot_environment(slots, names):
+    return {name: value for name, value in zip(names, slots) if value is not UNASSIGNED}
+
+def evaluate_slots(node, slots, names):
+    if type(node) is dict:
+        t = node["type"]
+
+        if t == "identifier":
+            value = slots[node["slot"]]
+            if value is UNASSIGNED:
+                raise Exception(f"Variable '{node['name']}' used before assignment")
+            return value
+
+        if t == "binary":
+            op = node["operator"]
+            assert op in binary_operations
+            x = evaluate_slots(node["left"], slots, names)
+            y = evaluate_slots(node["right"], slots, names)
+            return binary_operations[op](x, y)
+
+        if t == "assignment":
+            x = evaluate_slots(node["expression"], slots, names)
+            slots[node["slot"]] = x
+            if evaluator.trace is not None:
+                evaluator.trace("assignment", node["name"], x)
+            return x
+
+        if t == "while":
+            result = None
+            budget = evaluator.budget
+            condition = node["condition"]
+            compare = None
+            if type(condition) is dict and condition["type"] == "binary":
+                compare = comparisons.get(condition["operator"])
+            while True:
+                if compare is not None:
+                    # a fused compare-and-branch, as in the evaluator
+                    taken = compare(evaluate_slots(condition["left"], slots, names),
+                                    evaluate_slots(condition["right"], slots, names))
+                else:
+                    taken = evaluate_slots(condition, slots, names)
+                if evaluator.trace is not None:
+                    evaluator.trace("branch", "while", bool(taken))
+                if not taken:
+                    return result
+                if budget is not None:
+                    budget.count += 1
+                    if budget.count >= budget.next_check:
+                        budget.check(slots)
+                result = evaluate_slots(node["do"], slots, names)
+
+        if t == "program" or t == "block":
+            most_recent_value = None
+            for statement in node["statements"]:
+                most_recent_value = evaluate_slots(statement, slots, names)
+            return most_recent_value
+
+        if t == "print":
+            x = evaluate_slots(node["expression"], slots, names)
+            evaluator.output.write(x)
+            if evaluator.trace is not None:
+                evaluator.trace("print", None, x)
+            return x
+
+        if t == "if":
+            condition = node["condition"]
+            if (type(condition) is dict and condition["type"] == "binary"
+                    and condition["operator"] in comparisons):
+                taken = comparisons[condition["operator"]](
+                    evaluate_slots(condition["left"], slots, names),
+                    evaluate_slots(condition["right"], slots, names))
+            else:
+                taken = evaluate_slots(condition, slots, names)
+            if evaluator.trace is not None:
+                evaluator.trace("branch", "if", bool(taken))
+            if taken:
+                return evaluate_slots(node["then"], slots, names)
+            if node["else"]:
+                return evaluate_slots(node["else"], slots, names)
+            return None
+
+        if t == "unary":
+            op = node["operator"]
+            assert op in unary_operations
+            return unary_operations[op](evaluate_slots(node["expression"], slots, names))
+
+        if t == "logical":
+            x = evaluate_slots(node["left"], slots, names)
+            if node["operator"] == "&&":
+                return 1 if x and evaluate_slots(node["right"], slots, names) else 0
+            if node["operator"] == "||":
+                return 1 if x or evaluate_slots(node["right"], slots, names) else 0
+
+    if type(node) in [float, int]:
+        return node
+    raise Exception(f"Unknown content in AST={node}")
+
+# Resolve and run a node. The slots start out from the environment, the
+# evaluator's by default, and are written back to it afterwards, so programs
+# run one after another share variables just as they do with evaluate().
+def evaluate_with_slots(node, environment=None):
+    if environment is None:
+        environment = evaluator.environment
+    slot_numbers = {name: slot for slot, name in enumerate(environment)}
+    resolved = resolve(node, slot_numbers)
+    names = list(slot_numbers)
+    slots = [environment.get(name, UNASSIGNED) for name in names]
+    try:
+        return evaluate_slots(resolved, slots, names)
+    finally:
+        environment.update(slot_environment(slots, names))
+
+from tokenizer import tokenize
+from parser import parse
+from evaluator import run_captured
+
+def test_resolve():
+    print("testing resolve")
+    slot_numbers = {}
+    resolved = resolve(parse(tokenize("x = 1; y = x; x = y + x;")), slot_numbers)
+    assert slot_numbers == {"x": 0, "y": 1}
+    assignment = resolved["statements"][2]
+    assert assignment["slot"] == 0
+    assert assignment["expression"]["left"] == {"type": "identifier", "name": "y", "slot": 1}
+    assert assignment["expression"]["right"]["slot"] == 0
+
+def test_slots_match_evaluate():
+    print("testing slots against evaluate")
+    with open("example.t") as f:
+        source = f.read()
+    for program in [
+        source,
+        "x = 23; x = x - 1; x = x - 1; y = x; x = x - 1 + y;",
+        "if (0) {j=1; k=2;} else {j=0; k=1;}",
+        "k = 3; s = 0; while (k) { s = s + k * 2; k = k - 1; }",
+        "i = 0; n = 5; s = 0; while (i < n) { if (i >= 2 && !(i == 3) || s > 100) s = s + i; i = i + 1; }",
+        "x = 1; print 0 && 1 / 0; print 1 || q; print x && 0.5; print (x < 3) + !x;",
+    ]:
+        expected = run_captured(evaluator.evaluate, program)
+        assert run_captured(evaluate_with_slots, program) == expected, program
+
+def test_slots_trace_events():
+    print("testing slots trace events")
+    from tracing import EventBuffer, traced
+    for program in ["k = 2; while (k) k = k - 1; if (k) print 1; else print 2;",
+                    "k = 0; while (k < 2) k = k + 1; if (k == 2) print 1; if (k > 2 || 0) print 2;"]:
+        with traced(EventBuffer()) as expected:
+            evaluator.evaluate(parse(tokenize(program)))
+        with traced(EventBuffer()) as events:
+            evaluate_with_slots(parse(tokenize(program)))
+        assert events.events == expected.events
+
+def test_shared_environment():
+    print("testing slots share the environment between programs")
+    evaluator.environment.clear()
+    evaluate_with_slots(parse(tokenize("x=4;y=5;")))
+    assert evaluate_with_slots(parse(tokenize("print x+3;"))) == 7
+
+def test_unassigned_variable():
+    print("testing unassigned variable")
+    evaluator.environment.clear()
+    try:
+        evaluate_with_slots(parse(tokenize("if (0) q = 1; print q;")))
+    except Exception as e:
+        assert str(e) == "Variable 'q' used before assignment"
+    else:
+        assert False, "Expected an exception"
+
+if __name__ == "__main__":
+    test_resolve()
+    test_slots_match_evaluate()
+    test_slots_trace_events()
+    test_shared_environment()
+    test_unassigned_variable()
+    print("done")
@@ -0,0 +1,164 @@
+import sys
+from array import array
+
+from tokenizer import patterns, master_pattern, group_tokens, number
+
+# A compact token layout. Instead of one Python object per token (a bare string
+# like "+" or a list like ["number", 1]), a TokenTable keeps parallel arrays:
+#
+#   kinds   - one byte per token, a small integer code for the token kind
+#   values  - the number, string or identifier name, None for everything else
+#   starts  - offset of the first character of the token in the source
+#   ends    - offset just past the last character of the token
+#
+# Identifier names are interned, so each distinct name is stored once.
+
+# Kind codes, in the order the kinds first appear in the pattern list.
+# Code 0 is reserved for the end of the input.
+kind_names = [None]
+for regex, token in patterns:
+    if token is not None and token != "error" and token not in kind_names:
+        kind_names.append(token)
+kind_codes = {name: code for code, name in enumerate(kind_names)}
+
+END = 0
+PRINT = kind_codes["print"]
+IF = kind_codes["if"]
+ELSE = kind_codes["else"]
+WHILE = kind_codes["while"]
+PLUS = kind_codes["+"]
+MINUS = kind_codes["-"]
+TIMES = kind_codes["*"]
+DIVIDE = kind_codes["/"]
+LEFT_PAREN = kind_codes["("]
+RIGHT_PAREN = kind_codes[")"]
+LEFT_BRACE = kind_codes["{"]
+RIGHT_BRACE = kind_codes["}"]
+SEMICOLON = kind_codes[";"]
+ASSIGN = kind_codes["="]
+EQUAL = kind_codes["=="]
+NOT_EQUAL = kind_codes["!="]
+LESS = kind_codes["<"]
+LESS_EQUAL = kind_codes["<="]
+GREATER = kind_codes[">"]
+GREATER_EQUAL = kind_codes[">="]
+AND = kind_codes["&&"]
+OR = kind_codes["||"]
+NOT = kind_codes["!"]
+NUMBER = kind_codes["number"]
+STRING = kind_codes["string"]
+IDENTIFIER = kind_codes["identifier"]
+
+# Kind code for each group of the tokenizer's master pattern. Whitespace has
+# no code and illegal characters get ERROR, which never reaches a table.
+ERROR = -1
+group_kinds = {}
+for group, token in group_tokens.items():
+    if token is None:
+        group_kinds[group] = None
+    elif token == "error":
+        group_kinds[group] = ERROR
+    else:
+        group_kinds[group] = kind_codes[token]
+
+class TokenTable:
+    __slots__ = ("kinds", "values", "starts", "ends")
+
+    def __init__(self):
+        self.kinds = array("B")
+        self.values = []
+        self.starts = array("I")
+        self.ends = array("I")
+
+    def __len__(self):
+        return len(self.kinds)
+
+    # (kind code, value) pairs, the form the parser reads
+    def pairs(self):
+        return zip(self.kinds, self.values)
+
+    # The token at index i in the original list shape.
+    def token(self, i):
+        name = kind_names[self.kinds[i]]
+        value = self.values[i]
+        return name if value is None else [name, value]
+
+    # Adapter to the original list-of-tokens shape.
+    def to_list(self):
+        return [name if value is None else [name, value]
+                for name, value in zip(map(kind_names.__getitem__, self.kinds), self.values)]
+
+def scan_table(characters):
+    table = TokenTable()
+    kinds = table.kinds.append
+    values = table.values.append
+    starts = table.starts.append
+    ends = table.ends.append
+    intern = sys.intern
+    for match in master_pattern.finditer(characters):
+        kind = group_kinds[match.lastgroup]
+        if kind is None:
+            continue
+        if kind == IDENTIFIER:
+            values(intern(match.group()))
+        elif kind == NUMBER:
+            values(number(match.group()))
+        elif kind == STRING:
+            values(match.group()[1:-1].replace('""', '"'))
+        elif kind == ERROR:
+            raise AssertionError("Syntax error: illegal character at " + match.group())
+        else:
+            values(None)
+        kinds(kind)
+        starts(match.start())
+        ends(match.end())
+    return table
+
+# Adapt tokens in the original shape, from a list or a stream, to
+# (kind code, value) pairs.
+def kind_value_pairs(tokens):
+    for token in tokens:
+        if type(token) is list:
+            yield kind_codes[token[0]], token[1]
+        else:
+            yield kind_codes[token], None
+
+def test_scan_table():
+    print("testing token table")
+    from tokenizer import scan
+    with open("example.t") as f:
+        source = f.read()
+    source += ' s = "an embedded "" quote"; alpha = 12.5; x == y;'
+    table = scan_table(source)
+    assert table.to_list() == scan(source)
+    assert [table.token(i) for i in range(len(table))] == scan(source)
+    assert list(table.pairs()) == list(kind_value_pairs(scan(source)))
+
+def test_spans():
+    print("testing token spans")
+    source = "x1 = 12.5 * ab;"
+    table = scan_table(source)
+    spans = [source[start:end] for start, end in zip(table.starts, table.ends)]
+    assert spans == ["x1", "=", "12.5", "*", "ab", ";"]
+    assert list(table.kinds) == [IDENTIFIER, ASSIGN, NUMBER, TIMES, IDENTIFIER, SEMICOLON]
+
+def test_interned_identifiers():
+    print("testing interned identifiers")
+    table = scan_table("counter = counter + 1;")
+    assert table.values[0] is table.values[2]
+
+def test_illegal_character():
+    print("testing illegal character")
+    try:
+        scan_table("x = 1 @ 2;")
+    except AssertionError as e:
+        assert "illegal character at @" in str(e)
+    else:
+        assert False, "Expected a syntax error"
+
+if __name__ == "__main__":
+    test_scan_table()
+    test_spans()
+    test_interned_identifiers()
+    test_illegal_character()
+    print("done")
@@ -21,6 +21,9 @@ patterns = [
     [r">=", ">="],
     [r"<", "<"],
     [r">", ">"],
+    [r"&&", "&&"],
+    [r"\|\|", "||"],
+    [r"!", "!"],
     [r"=", "="],
     [r"\[", "["],
     [r"\]", "]"],
@@ -39,9 +42,79 @@ def number(s):
     else:
         return int(s)
 
+# All of the patterns compiled once into a single alternation. Each entry
+# becomes a named group t0, t1, ... in the same order as the list above, so
+# the first alternative that matches wins, just like trying them one by one.
+master_pattern = re.compile(
+    "|".join(f"(?P<t{i}>{regex})" for i, (regex, token) in enumerate(patterns))
+)
+group_tokens = {f"t{i}": token for i, (regex, token) in enumerate(patterns)}
+
 # The lex/tokenize function
 def tokenize(characters):
     print("tokenizing", characters)
+    return scan(characters)
+
+# Single pass over the characters: one regex match per token, dispatched on
+# the name of the group that matched.
+def scan(characters):
+    tokens = []
+    append = tokens.append
+    for match in master_pattern.finditer(characters):
+        token = group_tokens[match.lastgroup]
+        if token is None:
+            continue
+        if token == "number":
+            append([token, number(match.group())])
+        elif token == "identifier":
+            append([token, match.group()])
+        elif token == "string":
+            # omit closing and beginning strings, replace two quotes with one quote
+            append([token, match.group()[1:-1].replace('""', '"')])
+        elif token == "error":
+            raise AssertionError("Syntax error: illegal character at " + match.group())
+        else:
+            append(token)
+    return tokens
+
+# Lazily tokenize a file, reading it chunk_size characters at a time. A token
+# that touches the end of the buffer could still grow, and so could a string
+# followed by another quote ("" is an escaped quote) or a lone quote whose
+# closing quote is in a later chunk. Those are carried over and scanned again
+# together with the next chunk.
+def scan_stream(file, chunk_size=65536):
+    buffer = ""
+    while True:
+        chunk = file.read(chunk_size)
+        buffer += chunk
+        final = not chunk
+        limit = len(buffer) - 1
+        pos = 0
+        for match in master_pattern.finditer(buffer):
+            if not final and (match.end() >= limit or match.group() == '"'
+                              or buffer[match.end()] == '"' and match.group()[0] == '"'):
+                break
+            pos = match.end()
+            token = group_tokens[match.lastgroup]
+            if token is None:
+                continue
+            if token == "number":
+                yield [token, number(match.group())]
+            elif token == "identifier":
+                yield [token, match.group()]
+            elif token == "string":
+                yield [token, match.group()[1:-1].replace('""', '"')]
+            elif token == "error":
+                raise AssertionError("Syntax error: illegal character at " + match.group())
+            else:
+                yield token
+        if final:
+            return
+        buffer = buffer[pos:]
+
+# The original engine, which tries every pattern in turn at each position.
+# Kept as a reference for testing and benchmarking scan().
+def scan_each_pattern(characters):
     tokens = []
     pos = 0
     while pos < len(characters):
@@ -68,7 +141,6 @@ def tokenize(characters):
         tokens.append(token)
     return tokens
 
-
 def test_simple_tokens():
     print("testing simple tokens")
     examples = "+,-,*,/,(,),{,},;".split(",")
@@ -123,11 +195,47 @@ def test_multiple_tokens():
     assert tokenize("3+4*(5-2)") == tokenize(" 3 + 4 * (5 - 2) ")
 
 
+def test_comparison_and_logical_tokens():
+    print("testing comparison and logical tokens")
+    for example in ["==", "!=", "<", "<=", ">", ">=", "&&", "||", "!"]:
+        assert tokenize(example) == [example]
+    assert tokenize("!(a!=b)&&c<=1||!!d") == [
+        "!", "(", ["identifier", "a"], "!=", ["identifier", "b"], ")", "&&",
+        ["identifier", "c"], "<=", ["number", 1], "||", "!", "!", ["identifier", "d"]]
+
 def test_keywords():
     print("testing keywords")
     for keyword in ["print","if","else","while"]:
         assert tokenize(keyword) == [keyword]
 
+def test_scan_matches_pattern_loop():
+    print("testing scan against the pattern loop")
+    with open("example.t") as f:
+        source = f.read()
+    source += ' x1 = 2.5 * (y_2 / 3.) ; s = "a "" b"; if (a >= b) a != b; [1, 2] <= > == < ;'
+    assert scan(source) == scan_each_pattern(source)
+    assert scan("printer") == ["print", ["identifier", "er"]]
+
+def test_scan_stream():
+    print("testing streaming scan")
+    import io
+    with open("example.t") as f:
+        source = f.read()
+    source += ' s = "an embedded "" quote"; t = "x""""y"; alpha123 = 12.75; x == y; z <= 1;'
+    for chunk_size in [1, 2, 3, 7, 64, 100000]:
+        tokens = list(scan_stream(io.StringIO(source), chunk_size))
+        assert tokens == scan(source), f"chunk size {chunk_size}"
+
+def test_illegal_character():
+    print("testing illegal character")
+    for engine in [scan, scan_each_pattern]:
+        try:
+            engine("x = 1 @ 2;")
+        except AssertionError as e:
+            assert "illegal character at @" in str(e)
+        else:
+            assert False, "Expected a syntax error"
+
 if __name__ == "__main__":
     test_simple_tokens()
     test_number_tokens()
@@ -135,5 +243,9 @@ if __name__ == "__main__":
     test_identifier_tokens()
     test_whitespace()
     test_multiple_tokens()
+    test_comparison_and_logical_tokens()
     test_keywords()
+    test_scan_matches_pattern_loop()
+    test_scan_stream()
+    test_illegal_character()
     print(tokenize("print 3+4*(5-2);"))
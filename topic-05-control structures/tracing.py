@@ -0,0 +1,92 @@
+from contextlib import contextmanager
+
+import evaluator
+
+# Sinks for the evaluator's trace hook. Any callable taking
+# (event, subject, value) can be a hook; see evaluator.set_trace().
+
+class EnvironmentPrinter:
+    "Prints the environment after every assignment, the old debug output."
+    def __init__(self, environment=None):
+        # a copy of the environment kept up to date from assignment events,
+        # so it works the same whichever backend runs the program
+        self.environment = dict(environment or {})
+
+    def __call__(self, event, subject, value):
+        if event == "assignment":
+            self.environment[subject] = value
+            print(self.environment)
+
+class EventBuffer:
+    "Collects (event, subject, value) tuples and hands them on in batches."
+    def __init__(self, output=None, size=1024):
+        # Without an output the events just accumulate in self.events.
+        self.output = output
+        self.size = size
+        self.events = []
+
+    def __call__(self, event, subject, value):
+        events = self.events
+        events.append((event, subject, value))
+        if self.output is not None and len(events) >= self.size:
+            self.flush()
+
+    def flush(self):
+        if self.output is not None and self.events:
+            self.output(self.events)
+            self.events = []
+
+# Set the trace hook for the duration of a with block.
+@contextmanager
+def traced(hook):
+    saved = evaluator.trace
+    evaluator.set_trace(hook)
+    try:
+        yield hook
+    finally:
+        if isinstance(hook, EventBuffer):
+            hook.flush()
+        evaluator.set_trace(saved)
+
+from tokenizer import tokenize
+from parser import parse
+
+def test_environment_printer():
+    print("testing environment printer")
+    import io
+    from contextlib import redirect_stdout
+    ast = parse(tokenize("x = 1; y = 2; x = 3;"))
+    output = io.StringIO()
+    with redirect_stdout(output), traced(EnvironmentPrinter()):
+        evaluator.evaluate(ast)
+    assert output.getvalue() == (
+        "{'x': 1}\n"
+        "{'x': 1, 'y': 2}\n"
+        "{'x': 3, 'y': 2}\n"
+    )
+
+def test_event_buffer():
+    print("testing event buffer")
+    batches = []
+    buffer = EventBuffer(batches.append, size=4)
+    with traced(buffer):
+        evaluator.evaluate(parse(tokenize("k = 2; while (k) k = k - 1;")))
+    assert [len(batch) for batch in batches] == [4, 2]
+    assert batches[1] == [("assignment", "k", 0), ("branch", "while", False)]
+    assert evaluator.trace is None
+
+def test_trace_off_by_default():
+    print("testing trace is off by default")
+    import io
+    from contextlib import redirect_stdout
+    ast = parse(tokenize("x = 1; print x;"))
+    output = io.StringIO()
+    with redirect_stdout(output):
+        evaluator.evaluate(ast)
+    assert output.getvalue() == "1\n"
+
+if __name__ == "__main__":
+    test_environment_printer()
+    test_event_buffer()
+    test_trace_off_by_default()
+    print("done")
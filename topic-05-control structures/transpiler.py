@@ -0,0 +1,294 @@
+import math
+
+import evaluator
+from evaluator import binary_operations, unary_operations, comparisons
+
+# Translate the AST into Python source for one function, then compile() and
+# run it, so loops run as ordinary CPython bytecode. Toy while and if become
+# Python while and if, and toy variables become Python locals named v_<name>
+# (the prefix keeps names like 'class' or 'None' legal). The function copies
+# the variables it uses in from the environment on entry and back out when it
+# finishes, even if it fails.
+#
+# Like evaluate(), every statement leaves its value in _result, which the
+# function returns. Conditions of if and while are translated as Python
+# tests, so a comparison there is Python's own compare-and-branch and never
+# becomes the 1 or 0 it has as a value. Reading a variable that was never
+# assigned raises UnboundLocalError rather than KeyError. The evaluator's
+# trace hook, output sink and budget are looked up when the program is
+# translated; with a budget, the loops take their ticks from a local that is
+# handed back to the budget at the end.
+
+class Translator:
+    def __init__(self):
+        self.lines = []
+        self.names = []
+        self.trace = evaluator.trace is not None
+        self.budget = evaluator.budget is not None
+
+    def emit(self, depth, line):
+        self.lines.append("    " * depth + line)
+
+    def variable(self, name):
+        if name not in self.names:
+            self.names.append(name)
+        return "v_" + name
+
+    def statement(self, node, depth):
+        t = node["type"] if type(node) is dict else None
+
+        if t == "program" or t == "block":
+            if not node["statements"]:
+                self.emit(depth, "_result = None")
+            for statement in node["statements"]:
+                self.statement(statement, depth)
+
+        elif t == "print":
+            self.emit(depth, f"_result = {self.expression(node['expression'])}")
+            self.emit(depth, "write(_result)")
+            if self.trace:
+                self.emit(depth, 'trace("print", None, _result)')
+
+        elif t == "assignment":
+            variable = self.variable(node["name"])
+            self.emit(depth, f"_result = {variable} = {self.expression(node['expression'])}")
+            if self.trace:
+                self.emit(depth, f"trace(\"assignment\", {node['name']!r}, {variable})")
+
+        elif t == "if":
+            condition = self.condition(node["condition"])
+            if self.trace:
+                self.emit(depth, f"_taken = {condition}")
+                self.emit(depth, 'trace("branch", "if", bool(_taken))')
+                condition = "_taken"
+            self.emit(depth, f"if {condition}:")
+            self.statement(node["then"], depth + 1)
+            self.emit(depth, "else:")
+            if node["else"]:
+                self.statement(node["else"], depth + 1)
+            else:
+                self.emit(depth + 1, "_result = None")
+
+        elif t == "while":
+            condition = self.condition(node["condition"])
+            self.emit(depth, "_result = None")
+            if self.budget:
+                self.budgeted_while(node, condition, depth)
+                return
+            if self.trace:
+                self.emit(depth, "while True:")
+                self.emit(depth + 1, f"_taken = {condition}")
+                self.emit(depth + 1, 'trace("branch", "while", bool(_taken))')
+                self.emit(depth + 1, "if not _taken:")
+                self.emit(depth + 2, "break")
+            else:
+                self.emit(depth, f"while {condition}:")
+            self.statement(node["do"], depth + 1)
+
+        else:
+            # a bare expression, such as an evaluator test's operand tree
+            self.emit(depth, f"_result = {self.expression(node)}")
+
+    # A loop under a budget goes round with `for _ in _ticks`, so there is no
+    # count to keep (see budget.py). Nested loops share _ticks: when a loop
+    # finds its ticks run out it checks the budget, unless a loop inside it
+    # has already done so and replaced them.
+    def budgeted_while(self, node, condition, depth):
+        ticks = f"_ticks{depth}"
+        self.emit(depth, f"if {self.test(condition, depth)}:")
+        self.emit(depth + 1, "while True:")
+        self.emit(depth + 2, f"{ticks} = _ticks")
+        self.emit(depth + 2, f"for _ in {ticks}:")
+        self.statement(node["do"], depth + 3)
+        self.emit(depth + 3, f"if not {self.test(condition, depth + 3)}:")
+        self.emit(depth + 4, "break")
+        self.emit(depth + 2, "else:")
+        self.emit(depth + 3, f"if {ticks} is _ticks:")
+        self.emit(depth + 4, "_ticks = budget.tick(locals())")
+        self.emit(depth + 3, "continue")
+        self.emit(depth + 2, "break")
+
+    # Emit what goes before testing condition, which is tracing it, and
+    # return the test.
+    def test(self, condition, depth):
+        if not self.trace:
+            return condition
+        self.emit(depth, f"_taken = {condition}")
+        self.emit(depth, 'trace("branch", "while", bool(_taken))')
+        return "_taken"
+
+    # A Python test for condition, which only has to be true or false:
+    # comparisons, &&, || and ! become Python's comparisons, and, or and not.
+    def condition(self, node):
+        t = node["type"] if type(node) is dict else None
+        if t == "binary" and node["operator"] in comparisons:
+            return f"({self.expression(node['left'])} {node['operator']} {self.expression(node['right'])})"
+        if t == "logical" and node["operator"] in ["&&", "||"]:
+            op = "and" if node["operator"] == "&&" else "or"
+            return f"({self.condition(node['left'])} {op} {self.condition(node['right'])})"
+        if t == "unary" and node["operator"] == "!":
+            return f"(not {self.condition(node['expression'])})"
+        return self.expression(node)
+
+    def expression(self, node):
+        if type(node) is dict:
+            t = node["type"]
+            if t == "identifier":
+                return self.variable(node["name"])
+            if t == "binary":
+                op = node["operator"]
+                assert op in binary_operations
+                if op in comparisons:
+                    return f"(1 if {self.condition(node)} else 0)"
+                left = self.expression(node["left"])
+                right = self.expression(node["right"])
+                if op in ["+", "-", "*", "/"]:
+                    return f"({left} {op} {right})"
+                return f"binary_operations[{op!r}]({left}, {right})"
+            if t == "logical":
+                if node["operator"] not in ["&&", "||"]:
+                    raise Exception(f"Unknown logical operator {node['operator']}")
+                return f"(1 if {self.condition(node)} else 0)"
+            if t == "unary":
+                op = node["operator"]
+                assert op in unary_operations
+                expression = self.expression(node["expression"])
+                if op == "-":
+                    return f"(-{expression})"
+                if op == "!":
+                    return f"(0 if {expression} else 1)"
+                return f"unary_operations[{op!r}]({expression})"
+        if type(node) in [float, int]:
+            if type(node) is float and not math.isfinite(node):
+                return f"float({str(node)!r})"
+            return repr(node)
+        raise Exception(f"Unknown content in AST={node}")
+
+# Python source for a function program(environment, write, trace, budget)
+# that runs the AST.
+def transpile(ast):
+    translator = Translator()
+    translator.statement(ast, 2)
+    body = translator.lines
+    lines = ["def program(environment, write, trace, budget=None):"]
+    for name in translator.names:
+        lines.append(f"    if {name!r} in environment: v_{name} = environment[{name!r}]")
+    lines.append("    _result = None")
+    if translator.budget:
+        lines.append("    _ticks = budget.start_ticks()")
+    lines.append("    try:")
+    lines.extend(body)
+    lines.append("    finally:")
+    if translator.budget:
+        lines.append("        budget.stop_ticks(_ticks)")
+    lines.append("        _variables = locals()")
+    lines.append(f"        for _name in {tuple(translator.names)!r}:")
+    lines.append("            if 'v_' + _name in _variables:")
+    lines.append("                environment[_name] = _variables['v_' + _name]")
+    lines.append("    return _result")
+    return "\n".join(lines) + "\n"
+
+def compile_python(ast):
+    namespace = {
+        "binary_operations": binary_operations,
+        "unary_operations": unary_operations,
+    }
+    exec(compile(transpile(ast), "<transpiled>", "exec"), namespace)
+    return namespace["program"]
+
+# Translate, compile and run a node against the evaluator's environment. Code
+# nested deeper than CPython can compile is run with the closure backend
+# instead.
+def evaluate_transpiled(node):
+    try:
+        program = compile_python(node)
+    except (SyntaxError, RecursionError, MemoryError):
+        from closures import evaluate_compiled
+        return evaluate_compiled(node)
+    return program(evaluator.environment, evaluator.output.write, evaluator.trace, evaluator.budget)
+
+from tokenizer import tokenize
+from parser import parse
+from evaluator import run_captured
+
+def test_transpile():
+    print("testing transpile")
+    source = transpile(parse(tokenize("k = 2; while (k) k = k - 1;")))
+    assert source == "\n".join([
+        "def program(environment, write, trace, budget=None):",
+        "    if 'k' in environment: v_k = environment['k']",
+        "    _result = None",
+        "    try:",
+        "        _result = v_k = 2",
+        "        _result = None",
+        "        while v_k:",
+        "            _result = v_k = (v_k - 1)",
+        "    finally:",
+        "        _variables = locals()",
+        "        for _name in ('k',):",
+        "            if 'v_' + _name in _variables:",
+        "                environment[_name] = _variables['v_' + _name]",
+        "    return _result",
+    ]) + "\n"
+
+def test_transpiled_matches_evaluate():
+    print("testing transpiled code against evaluate")
+    with open("example.t") as f:
+        source = f.read()
+    for program in [
+        source,
+        "print 1+2*3-4/2;",
+        "print -2-2; print -(2-2); print -(2)-(2);",
+        "x = 23; x = x - 1; x = x - 1; y = x; x = x - 1 + y;",
+        "if (1) j = 2; else j = 0;",
+        "if (0) {j=1; k=2;} else {j=0; k=1;}",
+        "j = 5; if (0) j = 1;",
+        "k = 3; s = 0; while (k) { s = s + k * 2; k = k - 1; }",
+        "k = 0; while (k) k = k - 1; {} if (k) {}",
+        "class = 1; None = class + 1; print None;",
+        "i = 0; n = 5; s = 0; while (i < n) { if (i >= 2 && !(i == 3) || s > 100) s = s + i; i = i + 1; }",
+        "x = 1; print 0 && 1 / 0; print 1 || q; print x && 0.5; print (x < 3) + !x; print 1 < 2 < 3;",
+        "a = 2; b = 1; if (a < b) print 1; if (!(a >= b)) print 2; else print 3; if (a > b || q) print 4;",
+    ]:
+        expected = run_captured(evaluator.evaluate, program)
+        assert run_captured(evaluate_transpiled, program) == expected, program
+
+def test_transpiled_trace_events():
+    print("testing transpiled trace events")
+    from tracing import EventBuffer, traced
+    for program in ["k = 2; while (k) k = k - 1; if (k) print 1; else print 2;",
+                    "k = 0; while (k < 2) k = k + 1; if (k == 2) print 1; if (k > 2 || 0) print 2;"]:
+        with traced(EventBuffer()) as expected:
+            evaluator.evaluate(parse(tokenize(program)))
+        with traced(EventBuffer()) as events:
+            evaluate_transpiled(parse(tokenize(program)))
+        assert events.events == expected.events
+
+def test_environment_written_back_on_error():
+    print("testing environment is written back on error")
+    evaluator.environment.clear()
+    try:
+        evaluate_transpiled(parse(tokenize("x = 1; y = x / 0;")))
+    except ZeroDivisionError:
+        pass
+    assert evaluator.environment == {"x": 1}
+
+def test_deep_nesting_falls_back():
+    print("testing deeply nested code falls back to closures")
+    from tokenizer import scan
+    evaluator.environment.clear()
+    assert evaluate_transpiled(parse(scan("k = 1; " + "while (k) " * 30 + "k = 0;"))) == 0
+
+def test_non_finite_constants():
+    print("testing non-finite constants")
+    assert evaluate_transpiled({"type": "binary", "operator": "-",
+                                "left": float("inf"), "right": 1.0}) == float("inf")
+
+if __name__ == "__main__":
+    test_transpile()
+    test_transpiled_matches_evaluate()
+    test_transpiled_trace_events()
+    test_environment_written_back_on_error()
+    test_deep_nesting_falls_back()
+    test_non_finite_constants()
+    print(transpile(parse(tokenize(open("example.t").read()))))